@@ -4,7 +4,10 @@ from flask_sqlalchemy import SQLAlchemy
 
 from config import config
 from .ui import bootstrap
-from .persistence import db
+from .compression import compression
+from .hashing import hashing
+from .admission import admission
+from .persistence import db, sqlite_tuning, read_replicas, write_queue, book_suggest, entity_cache, cache_coherence
 
 
 def create_app(config_name):
@@ -12,20 +15,35 @@ def create_app(config_name):
 	app.config.from_object(config[config_name])
 	config[config_name].init_app(app)
 
+	# Registered first, so its after_request hook runs after every other one.
+	compression.init_app(app)
+	hashing.init_app(app)
+	# Before any other before_request hook, so a request that is turned away costs as little as possible.
+	admission.init_app(app)
 	bootstrap.init_app(app)
 	db.init_app(app)
+	sqlite_tuning.init_app(app)
+	read_replicas.init_app(app)
+	write_queue.init_app(app)
+	book_suggest.init_app(app)
+	entity_cache.init_app(app)
+	cache_coherence.init_app(app)
 
 	# attach routes and custom error pages here
 	from .ui import ui_blueprint
 	app.register_blueprint(ui_blueprint)
 	
-	from .api import api_blueprint
+	from .api import api_blueprint, response_cache, book_stream
 	app.register_blueprint(api_blueprint, url_prefix = "/api")
+	response_cache.init_app(app)
+	book_stream.init_app(app)
 
 	from .auth import ui_auth_blueprint
 	app.register_blueprint(ui_auth_blueprint, url_prefix = "/auth/ui")
 
-	from .auth import api_auth_blueprint
+	from .auth import api_auth_blueprint, token_epochs, principal_cache
 	app.register_blueprint(api_auth_blueprint, url_prefix = "/auth/api")
+	token_epochs.init_app(app)
+	principal_cache.init_app(app)
 
 	return app
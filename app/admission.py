@@ -0,0 +1,151 @@
+import bisect
+import threading
+import time
+
+from flask import request, json, g, current_app
+
+
+# Requests that are not admitted at all. The event stream holds its connection for as long as the client
+# listens, and stats have to answer while everything else is saturated.
+EXEMPT_ENDPOINTS = frozenset(["api_blueprint.stream_book_changes", "api_blueprint.get_stats", "static"])
+
+# Full listings, exports, the change feed and bulk writes, which can each keep a worker busy for a long time.
+BULK_ENDPOINTS = frozenset([
+    "api_blueprint.get_all_books",
+    "api_blueprint.get_all_users",
+    "api_blueprint.get_book_changes",
+    "api_blueprint.add_books_bulk",
+    "api_blueprint.update_books_bulk",
+    "api_blueprint.delete_books_bulk",
+    "api_blueprint.update_users_bulk",
+    "api_blueprint.delete_users_bulk"
+])
+
+AUTH_BLUEPRINTS = frozenset(["api_auth_blueprint", "ui_auth_blueprint"])
+
+READ_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+
+# Upper bounds, in milliseconds, of the queue wait histogram buckets. The last bucket takes everything longer.
+WAIT_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class Gate(object):
+    """
+    Admits at most limit requests at a time. Up to queue_size more wait their turn, for at most timeout
+    seconds, and any beyond that are turned away at once.
+    """
+
+    def __init__(self, limit, queue_size, timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.waits = [0] * (len(WAIT_BUCKETS) + 1)
+
+    def acquire(self):
+        with self.condition:
+            # Nobody is let past requests that are already waiting.
+            if self.active < self.limit and not self.waiting:
+                self.admit(0)
+                return True
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                return False
+
+            self.waiting += 1
+            start = time.time()
+            try:
+                while self.active >= self.limit:
+                    remaining = start + self.timeout - time.time()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        return False
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.admit(time.time() - start)
+            return True
+
+    def admit(self, wait):
+        self.active += 1
+        self.admitted += 1
+        self.waits[bisect.bisect_left(WAIT_BUCKETS, wait * 1000)] += 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            labels = ["<=%d" % bound for bound in WAIT_BUCKETS] + [">%d" % WAIT_BUCKETS[-1]]
+            return {
+                "limit": self.limit,
+                "queue_size": self.queue_size,
+                "active": self.active,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "wait_ms": dict(zip(labels, self.waits))
+            }
+
+
+class AdmissionController(object):
+    """
+    Limits how many requests of each class run at once, so a burst of one kind cannot take every worker.
+    Requests are classed as read, write, auth or bulk, each with its limit in ADMISSION_LIMITS and its queue
+    in ADMISSION_QUEUE_SIZES. A request that finds its queue full, or waits longer than ADMISSION_TIMEOUT,
+    is answered with 503 and a Retry-After header.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        limits = app.config["ADMISSION_LIMITS"]
+        queue_sizes = app.config["ADMISSION_QUEUE_SIZES"]
+        app.extensions["admission"] = dict(
+            (name, Gate(limits[name], queue_sizes[name], app.config["ADMISSION_TIMEOUT"])) for name in limits)
+        app.before_request(self.admit)
+        app.teardown_request(self.release)
+
+    def get_class(self):
+        if request.endpoint is None or request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        if request.endpoint in BULK_ENDPOINTS:
+            return "bulk"
+        if request.blueprint in AUTH_BLUEPRINTS:
+            return "auth"
+        return "read" if request.method in READ_METHODS else "write"
+
+    def admit(self):
+        name = self.get_class()
+        if name is None:
+            return None
+
+        gate = current_app.extensions["admission"][name]
+        if not gate.acquire():
+            retry_after = str(current_app.config["ADMISSION_RETRY_AFTER"])
+            return json.dumps({"Error": "The server is busy. Try again later."}), 503, {"Retry-After": retry_after}
+        # Released when the request is torn down, which for a streamed response is once the stream is done.
+        g.admission_gate = gate
+        return None
+
+    def release(self, exception=None):
+        gate = g.pop("admission_gate", None)
+        if gate is not None:
+            gate.release()
+
+    def stats(self):
+        gates = current_app.extensions["admission"]
+        return dict((name, gate.stats()) for name, gate in gates.items())
+
+
+admission = AdmissionController()
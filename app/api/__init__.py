@@ -1,7 +1,12 @@
 from flask import Blueprint
 
+from .response_cache import ResponseCache
+from .book_stream import BookStream
+
 
 api_blueprint = Blueprint("api_blueprint", __name__)
+response_cache = ResponseCache()
+book_stream = BookStream()
 
 
 from . import api_handler, errors
@@ -1,17 +1,177 @@
-from flask import request, abort, redirect, json
+import base64
+import hashlib
 
-from . import api_blueprint
-from ..persistence import db_util
+from flask import request, abort, redirect, json, url_for, current_app, Response, stream_with_context
+from werkzeug.http import http_date, quote_etag, is_resource_modified
+
+from . import api_blueprint, response_cache, book_stream, serializers
+from ..admission import admission
+from ..auth import principal_cache
+from ..persistence.models import Book, User
+from ..persistence import db_util, book_suggest, entity_cache, write_queue
 
 
 @api_blueprint.route("/books/<int:book_id>", methods=["GET"])
 def get_book(book_id):
+    serializer, error = get_serializer(Book)
+    if error is not None:
+        return error
+
     book = db_util.get_book(book_id)
     if book is None:
         abort(404)
 
-    json_data = book.to_json()
-    return json_data, 200
+    headers = get_validators(serializer, ("book", book.id, book.updated_at), book.updated_at)
+    if not is_resource_modified(request.environ, headers["ETag"], last_modified=book.updated_at):
+        return Response(status=304, headers=headers)
+
+    data = serializer.encode(book)
+    headers["Content-Type"] = serializer.mimetype
+    return data, 200, headers
+
+
+def get_validators(serializer, version, last_modified):
+    # A strong ETag for one representation: the version of the data plus everything in the request that
+    # shapes the output. Returned as response headers, with Last-Modified when it is known.
+    representation = (version, serializer.mimetype, sorted(request.args.items(multi=True)))
+    headers = {"ETag": quote_etag(hashlib.sha1(repr(representation).encode("utf-8")).hexdigest())}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+
+    return headers
+
+
+def encode_search_cursor(score, book_id):
+    return base64.urlsafe_b64encode(json.dumps([score, book_id]).encode("utf-8")).decode("ascii")
+
+
+def decode_search_cursor(cursor):
+    # Raises ValueError for a malformed cursor, so request.args.get treats it as missing.
+    try:
+        score, book_id = json.loads(base64.urlsafe_b64decode(str(cursor)).decode("utf-8"))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid search cursor.")
+    if not isinstance(score, (int, float)) or not isinstance(book_id, int):
+        raise ValueError("Invalid search cursor.")
+
+    return score, book_id
+
+
+@api_blueprint.route("/books/search", methods=["GET"])
+@response_cache.cached
+def search_books():
+    query = request.args.get("q", "").strip()
+    if query == "":
+        return json.dumps({"Error": "q cannot be empty."}), 400
+
+    serializer, error = get_serializer(Book)
+    if error is not None:
+        return error
+
+    limit, after, error = get_page_args(after_type=decode_search_cursor)
+    if error is not None:
+        return error
+
+    results = db_util.search_books(query, limit + 1, after)
+    next_url = None
+    if len(results) > limit:
+        book, score = results[limit - 1]
+        next_url = url_for("api_blueprint.search_books", q=query, limit=limit,
+                           after=encode_search_cursor(score, book.id), fields=request.args.get("fields"),
+                           v=request.args.get("v"), _external=True)
+
+    data = serializer.encode_collection("books", [book for book, score in results[:limit]], next_url)
+    return data, 200, {"Content-Type": serializer.mimetype}
+
+
+@api_blueprint.route("/books/changes", methods=["GET"])
+def get_book_changes():
+    # Inserts and updates after ?since=, reported as upserts with the current book, and deletes, oldest first.
+    # A client stores cursor and passes it as since on the next poll.
+    since = request.args.get("since", type=int)
+    if since is None or since < 0:
+        return json.dumps({"Error": "since must be a change sequence number of 0 or more."}), 400
+
+    fields, error = get_fields(Book)
+    if error is not None:
+        return error
+
+    limit, after, error = get_page_args()
+    if error is not None:
+        return error
+
+    changes, cursor, more = db_util.get_book_changes(since, limit, fields)
+    if changes is None:
+        return json.dumps({"Error": "Changes before %d are no longer kept. Fetch all books again." % since}), 410
+
+    serializer = serializers.ModelSerializer(Book, fields, serializers.negotiate_codec(request.accept_mimetypes))
+    items = []
+    for change_seq, book_id, book in changes:
+        if book is None:
+            items.append({"seq": change_seq, "op": "delete", "id": book_id})
+        else:
+            items.append({"seq": change_seq, "op": "upsert", "id": book_id, "book": serializer.to_dict(book)})
+
+    next_url = None
+    if more:
+        next_url = url_for("api_blueprint.get_book_changes", since=cursor, limit=limit,
+                           fields=request.args.get("fields"), _external=True)
+
+    data = serializer.codec.dumps({"changes": items, "cursor": cursor, "next": next_url})
+    return data, 200, {"Content-Type": serializer.mimetype}
+
+
+@api_blueprint.route("/books/stream", methods=["GET"])
+def stream_book_changes():
+    # Server-sent events for every book change. Resumes after Last-Event-ID, or ?since= for clients that cannot
+    # set headers, and otherwise starts with the next change.
+    last_event_id = request.headers.get("Last-Event-ID", request.args.get("since"))
+    since = None
+    if last_event_id is not None:
+        try:
+            since = int(last_event_id)
+        except ValueError:
+            since = -1
+        if since < 0:
+            return json.dumps({"Error": "Last-Event-ID must be a change sequence number of 0 or more."}), 400
+
+    fields, error = get_fields(Book)
+    if error is not None:
+        return error
+
+    # Subscribed before the response starts, so nothing committed from now on can be missed.
+    subscription, last_seq = book_stream.subscribe()
+    events = book_stream.events(subscription, since if since is not None else last_seq,
+                                serializers.ModelSerializer(Book, fields), catch_up=since is not None)
+    response = Response(stream_with_context(events), 200, mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    app = current_app._get_current_object()
+    response.call_on_close(lambda: book_stream.unsubscribe(app, subscription))
+    return response
+
+
+@api_blueprint.route("/books/suggest", methods=["GET"])
+@response_cache.cached
+def suggest_books():
+    prefix = request.args.get("prefix", "").strip()
+    if prefix == "":
+        return json.dumps({"Error": "prefix cannot be empty."}), 400
+
+    limit = request.args.get("limit", current_app.config["API_SUGGEST_SIZE"], type=int)
+    if limit < 1 or limit > current_app.config["API_MAX_PAGE_SIZE"]:
+        return json.dumps({
+            "Error": "limit must be an integer between 1 and %d." % current_app.config["API_MAX_PAGE_SIZE"]
+        }), 400
+
+    suggestions = []
+    for value, field, book_id in book_suggest.suggest(prefix, limit):
+        suggestion = {"value": value, "field": field}
+        if book_id is not None:
+            suggestion["id"] = book_id
+            suggestion["url"] = url_for("api_blueprint.get_book", book_id=book_id, _external=True)
+        suggestions.append(suggestion)
+
+    return json.dumps({"suggestions": suggestions}), 200
 
 
 @api_blueprint.route("/books", methods=["POST"])
@@ -22,13 +182,139 @@ def add_book():
             "Error": "JSON data is empty. To add book, send POST request with book_name, [author_name] and [comments]."
         }), 400
 
-    data = json.loads(request_data)
+    serializer, error = get_serializer(Book)
+    if error is not None:
+        return error
+
+    data = get_request_data(request_data)
     if "book_name" not in data:
         return json.dumps({"Error": "book_name cannot be empty."}), 400
 
     book = db_util.add_book(data)
-    json_data = book.to_json()
-    return json_data, 200
+    if book is None:
+        return json.dumps({"Error": "A book named %s already exists." % data["book_name"]}), 409
+
+    return serializer.encode(book), 200, {"Content-Type": serializer.mimetype}
+
+
+@api_blueprint.route("/books/bulk", methods=["POST"])
+def add_books_bulk():
+    request_data = request.get_data()
+    if request_data is None or request_data == "":
+        return json.dumps({
+            "Error": "JSON data is empty. To add books, send POST request with a list of books."
+        }), 400
+
+    data = get_request_data(request_data)
+    if not isinstance(data, list):
+        return json.dumps({"Error": "JSON data must be a list of books."}), 400
+    if len(data) > current_app.config["API_MAX_BULK_SIZE"]:
+        return json.dumps({
+            "Error": "Cannot add more than %d books at once." % current_app.config["API_MAX_BULK_SIZE"]
+        }), 400
+
+    # Invalid items are reported individually instead of failing the whole batch.
+    results = []
+    valid_books = []
+    for index, book_data in enumerate(data):
+        if not isinstance(book_data, dict) or not book_data.get("book_name"):
+            results.append({"index": index, "status": "invalid", "Error": "book_name cannot be empty."})
+            continue
+        # Any other value would fail the whole batch once it reaches the database.
+        invalid_keys = [key for key in ("book_name", "author_name", "comments")
+                        if key in book_data and not isinstance(book_data[key], basestring)]
+        if invalid_keys:
+            results.append({"index": index, "status": "invalid", "Error": "%s must be a string." % invalid_keys[0]})
+            continue
+        results.append({"index": index})
+        valid_books.append(book_data)
+
+    added = iter(db_util.add_books(valid_books))
+    created = 0
+    for result in results:
+        if "status" in result:
+            continue
+        result["status"], result["id"] = next(added)
+        if result["status"] == "created":
+            created += 1
+
+    return encode_document({"created": created, "results": results})
+
+
+def get_bulk_target(data, filter_keys):
+    # Returns (ids, filters, error) for a bulk request body holding either "ids" or "filter".
+    if not isinstance(data, dict):
+        return None, None, (json.dumps({"Error": "JSON data must be an object with ids or filter."}), 400)
+
+    if "ids" in data:
+        ids = data["ids"]
+        if not isinstance(ids, list) or not all(isinstance(row_id, int) and not isinstance(row_id, bool)
+                                                for row_id in ids):
+            return None, None, (json.dumps({"Error": "ids must be a list of integers."}), 400)
+        if len(ids) > current_app.config["API_MAX_BULK_SIZE"]:
+            return None, None, (json.dumps({
+                "Error": "Cannot change more than %d ids at once." % current_app.config["API_MAX_BULK_SIZE"]
+            }), 400)
+        return ids, {}, None
+
+    filters = data.get("filter")
+    if not isinstance(filters, dict) or not filters or not set(filters).issubset(filter_keys):
+        return None, None, (json.dumps({
+            "Error": "JSON data must have ids, or a filter on one or more of: %s." % ", ".join(filter_keys)
+        }), 400)
+    if not all(isinstance(value, basestring) for value in filters.values()):
+        # A null value would drop out of the filter and leave it matching every row.
+        return None, None, (json.dumps({"Error": "filter values must be strings."}), 400)
+    return None, filters, None
+
+
+def get_bulk_changes(data, change_keys):
+    changes = data.get("changes")
+    if not isinstance(changes, dict) or not changes or not set(changes).issubset(change_keys):
+        return None, (json.dumps({
+            "Error": "changes must set one or more of: %s." % ", ".join(change_keys)
+        }), 400)
+    return changes, None
+
+
+@api_blueprint.route("/books/bulk", methods=["PATCH"])
+def update_books_bulk():
+    request_data = request.get_data()
+    if request_data is None or request_data == "":
+        return json.dumps({
+            "Error": "JSON data is empty. To update books, send PATCH request with ids or filter, and changes."
+        }), 400
+
+    data = get_request_data(request_data)
+    book_ids, filters, error = get_bulk_target(data, ("book_name", "author_name"))
+    if error is not None:
+        return error
+    changes, error = get_bulk_changes(data, ("author_name", "comments"))
+    if error is not None:
+        return error
+    for key in sorted(changes):
+        if not isinstance(changes[key], basestring):
+            return json.dumps({"Error": "%s must be a string." % key}), 400
+
+    updated_ids, not_found_ids = db_util.update_books(changes, book_ids, **filters)
+    return encode_document({"updated": len(updated_ids), "not_found": not_found_ids})
+
+
+@api_blueprint.route("/books/bulk", methods=["DELETE"])
+def delete_books_bulk():
+    request_data = request.get_data()
+    if request_data is None or request_data == "":
+        return json.dumps({
+            "Error": "JSON data is empty. To delete books, send DELETE request with ids or filter."
+        }), 400
+
+    data = get_request_data(request_data)
+    book_ids, filters, error = get_bulk_target(data, ("book_name", "author_name"))
+    if error is not None:
+        return error
+
+    removed_ids, not_found_ids = db_util.remove_books(book_ids, **filters)
+    return encode_document({"removed": len(removed_ids), "not_found": not_found_ids})
 
 
 @api_blueprint.route("/books/<int:book_id>", methods=["PUT"])
@@ -38,55 +324,223 @@ def update_book(book_id):
         return json.dumps(
             {"Error": "JSON data is empty. To update book, send PUT request with book_name, [author_name] and [comments]."}), 400
 
-    data = json.loads(request_data)
+    serializer, error = get_serializer(Book)
+    if error is not None:
+        return error
+
+    data = get_request_data(request_data)
     book = db_util.update_book(book_id, data)
     if book is None:
         abort(404)
 
-    json_data = book.to_json()
-    return json_data, 200
+    return serializer.encode(book), 200, {"Content-Type": serializer.mimetype}
+
+
+@api_blueprint.route("/books/by-name/<path:book_name>", methods=["PUT"])
+def upsert_book(book_name):
+    # Creates or updates the book with this name. The body, [author_name] and [comments], may be empty.
+    serializer, error = get_serializer(Book)
+    if error is not None:
+        return error
+
+    request_data = request.get_data()
+    data = {} if request_data is None or request_data == "" else get_request_data(request_data)
+    if not isinstance(data, dict):
+        return json.dumps({"Error": "JSON data must be an object with [author_name] and [comments]."}), 400
+    for key in ("author_name", "comments"):
+        if key in data and not isinstance(data[key], basestring):
+            return json.dumps({"Error": "%s must be a string." % key}), 400
+
+    book = db_util.upsert_book(book_name, data)
+    return serializer.encode(book), 200, {"Content-Type": serializer.mimetype}
 
 
 @api_blueprint.route("/books/<int:book_id>", methods=["DELETE"])
 def delete_book(book_id):
+    serializer, error = get_serializer(Book)
+    if error is not None:
+        return error
+
     book = db_util.remove_book(book_id)
     if book is None:
         abort(404)
 
-    json_data = book.to_json()
-    return json_data, 200
+    return serializer.encode(book), 200, {"Content-Type": serializer.mimetype}
+
+
+def get_page_args(after_type=int):
+    # Parses ?limit=&after= into (limit, after, error). error is a ready response when the args are invalid.
+    limit = current_app.config["API_PAGE_SIZE"]
+    if "limit" in request.args:
+        limit = request.args.get("limit", type=int)
+    if limit is None or limit < 1 or limit > current_app.config["API_MAX_PAGE_SIZE"]:
+        error = json.dumps({
+            "Error": "limit must be an integer between 1 and %d." % current_app.config["API_MAX_PAGE_SIZE"]
+        }), 400
+        return None, None, error
+
+    after = None
+    if "after" in request.args:
+        after = request.args.get("after", type=after_type)
+        if after is None:
+            return None, None, (json.dumps({"Error": "after is not a valid cursor."}), 400)
+
+    return limit, after, None
+
+
+def get_next_url(endpoint, items, limit):
+    # One extra row is fetched per page, so a full page plus one means there is more to read.
+    if len(items) <= limit:
+        return None
+    return url_for(endpoint, limit=limit, after=items[limit - 1].id, fields=request.args.get("fields"),
+                   v=request.args.get("v"), _external=True)
+
+
+def get_serializer(model, negotiate=True):
+    # Picks the output version from ?v=, the sparse fieldset from ?fields= and the wire format from the Accept
+    # header. Returns (serializer, error). Streams are always JSON, so they skip the negotiation.
+    version = request.args.get("v", type=int) if "v" in request.args else 1
+    if version not in serializers.SERIALIZERS:
+        return None, (json.dumps({"Error": "v must be one of %s." % sorted(serializers.SERIALIZERS)}), 400)
+
+    fields, error = get_fields(model)
+    if error is not None:
+        return None, error
+
+    codec = serializers.negotiate_codec(request.accept_mimetypes) if negotiate else None
+    return serializers.get_serializer(model, fields, version, codec), None
+
+
+def encode_document(data):
+    # A response that is not a model, such as the result of a bulk write, in the format the client accepts.
+    codec = serializers.negotiate_codec(request.accept_mimetypes)
+    return codec.dumps(data), 200, {"Content-Type": codec.mimetype}
+
+
+def get_request_data(request_data):
+    # Decodes a request body in the format named by its Content-Type.
+    return serializers.get_codec(request.mimetype).loads(request_data)
+
+
+def get_fields(model):
+    # Parses ?fields=id,book_name into a list of the model's field names. Returns (fields, error), where
+    # fields is None when the client did not ask for a sparse fieldset.
+    if "fields" not in request.args:
+        return None, None
+
+    fields = [field.strip() for field in request.args["fields"].split(",") if field.strip() != ""]
+    if len(fields) == 0 or any(field not in model.FIELDS for field in fields):
+        return None, (json.dumps({
+            "Error": "fields must be a comma separated list of %s." % ", ".join(model.FIELDS)
+        }), 400)
+
+    return fields, None
+
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def get_stream_format():
+    # Returns "ndjson", "json" or None when the client asked for a regular paged response.
+    accept = request.accept_mimetypes
+    if request.args.get("stream") == "ndjson" or accept[NDJSON_MIMETYPE] > accept["application/json"]:
+        return "ndjson"
+    if request.args.get("stream") in ("1", "true", "json"):
+        return "json"
+    return None
+
+
+def stream_collection(key, items, stream_format, serializer):
+    # Writes the collection out chunk by chunk, so memory use does not grow with the table.
+    chunk_size = current_app.config["API_STREAM_CHUNK_SIZE"]
+
+    def generate():
+        chunk = []
+        if stream_format == "json":
+            chunk.append('{"%s": [' % key)
+        for index, item in enumerate(items):
+            if stream_format == "ndjson":
+                chunk.append(serializer.encode(item) + "\n")
+            else:
+                # Keeps the shape of the paged response for the requested version.
+                chunk.append((", " if index > 0 else "") + serializer.encode_element(item))
+            if len(chunk) >= chunk_size:
+                yield "".join(chunk)
+                chunk = []
+        if stream_format == "json":
+            chunk.append('], "next": null}')
+        if chunk:
+            yield "".join(chunk)
+
+    mimetype = NDJSON_MIMETYPE if stream_format == "ndjson" else "application/json"
+    return Response(stream_with_context(generate()), 200, mimetype=mimetype)
 
 
 @api_blueprint.route("/books", methods=["GET"])
+@response_cache.cached
 def get_all_books():
-    books = db_util.get_all_books()
-    books_dict = {
-        "books": [book.to_json() for book in books]
-    }
-    json_data = json.dumps(books_dict)
+    stream_format = get_stream_format()
+    serializer, error = get_serializer(Book, negotiate=stream_format is None)
+    if error is not None:
+        return error
 
-    return json_data, 200
+    if stream_format is not None:
+        books = db_util.iter_books(current_app.config["API_STREAM_CHUNK_SIZE"], serializer.fields)
+        return stream_collection("books", books, stream_format, serializer)
+
+    limit, after, error = get_page_args()
+    if error is not None:
+        return error
+
+    # Checked against an aggregate over the table, before any page of books is read. There is no Last-Modified,
+    # because a delete does not move max(updated_at) forward.
+    version = db_util.get_books_version()
+    headers = get_validators(serializer, ("books",) + tuple(version), None)
+    if not is_resource_modified(request.environ, headers["ETag"]):
+        return Response(status=304, headers=headers)
+
+    books = db_util.get_books_page(limit + 1, after, serializer.fields)
+    next_url = get_next_url("api_blueprint.get_all_books", books, limit)
+    data = serializer.encode_collection("books", books[:limit], next_url)
+    headers["Content-Type"] = serializer.mimetype
+
+    return data, 200, headers
 
 
 @api_blueprint.route("/users", methods=["GET"])
 def get_all_users():
-    users = db_util.get_all_users()
-    users_dict = {
-        "users": [user.to_json() for user in users]
-    }
-    json_data = json.dumps(users_dict)
+    stream_format = get_stream_format()
+    serializer, error = get_serializer(User, negotiate=stream_format is None)
+    if error is not None:
+        return error
+
+    if stream_format is not None:
+        users = db_util.iter_users(current_app.config["API_STREAM_CHUNK_SIZE"], serializer.fields)
+        return stream_collection("users", users, stream_format, serializer)
 
-    return json_data, 200
+    limit, after, error = get_page_args()
+    if error is not None:
+        return error
+
+    users = db_util.get_users_page(limit + 1, after, serializer.fields)
+    next_url = get_next_url("api_blueprint.get_all_users", users, limit)
+    data = serializer.encode_collection("users", users[:limit], next_url)
+
+    return data, 200, {"Content-Type": serializer.mimetype}
 
 
 @api_blueprint.route("/users/<int:user_id>", methods=["GET"])
 def get_user(user_id):
+    serializer, error = get_serializer(User)
+    if error is not None:
+        return error
+
     user = db_util.get_user(user_id)
     if user is None:
         abort(404)
 
-    json_data = user.to_json()
-    return json_data, 200
+    data = serializer.encode(user)
+    return data, 200, {"Content-Type": serializer.mimetype}
 
 
 @api_blueprint.route("/users/<int:user_id>", methods=["PUT"])
@@ -97,26 +551,82 @@ def update_user(user_id):
             "Error": "JSON data is empty. To update user, send PUT request with username, [email] and [password]."
         }), 400
 
-    data = json.loads(request_data)
+    serializer, error = get_serializer(User)
+    if error is not None:
+        return error
+
+    data = get_request_data(request_data)
     user = db_util.update_user(user_id, data)
     if user is None:
         abort(404)
 
-    # Adding dynamic json contents here.
-    user_dict = user.to_dict()
+    # Adding dynamic contents here.
+    user_dict = serializer.to_dict(user)
     if not user.confirmed:
         user_dict["token"] = user.generate_confirmation_token()
 
-    # Return json response.
-    json_data = json.dumps(user_dict)
-    return json_data, 200
+    return encode_document(user_dict)
+
+
+@api_blueprint.route("/users/bulk", methods=["PATCH"])
+def update_users_bulk():
+    request_data = request.get_data()
+    if request_data is None or request_data == "":
+        return json.dumps({
+            "Error": "JSON data is empty. To update users, send PATCH request with ids or filter, and changes."
+        }), 400
+
+    data = get_request_data(request_data)
+    user_ids, filters, error = get_bulk_target(data, ("username", "email"))
+    if error is not None:
+        return error
+    changes, error = get_bulk_changes(data, ("confirmed",))
+    if error is not None:
+        return error
+    if not isinstance(changes["confirmed"], bool):
+        return json.dumps({"Error": "confirmed must be true or false."}), 400
+
+    updated_ids, not_found_ids = db_util.update_users(changes, user_ids, **filters)
+    return encode_document({"updated": len(updated_ids), "not_found": not_found_ids})
+
+
+@api_blueprint.route("/users/bulk", methods=["DELETE"])
+def delete_users_bulk():
+    request_data = request.get_data()
+    if request_data is None or request_data == "":
+        return json.dumps({
+            "Error": "JSON data is empty. To delete users, send DELETE request with ids or filter."
+        }), 400
+
+    data = get_request_data(request_data)
+    user_ids, filters, error = get_bulk_target(data, ("username", "email"))
+    if error is not None:
+        return error
+
+    removed_ids, not_found_ids = db_util.remove_users(user_ids, **filters)
+    return encode_document({"removed": len(removed_ids), "not_found": not_found_ids})
 
 
 @api_blueprint.route("/users/<int:user_id>", methods=["DELETE"])
 def delete_user(user_id):
+    serializer, error = get_serializer(User)
+    if error is not None:
+        return error
+
     user = db_util.remove_user(user_id)
     if user is None:
         abort(404)
 
-    json_data = user.to_json()
-    return json_data, 200
+    return serializer.encode(user), 200, {"Content-Type": serializer.mimetype}
+
+
+@api_blueprint.route("/stats", methods=["GET"])
+def get_stats():
+    stats_dict = {
+        "entity_cache": entity_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "principal_cache": principal_cache.stats(),
+        "admission": admission.stats(),
+        "write_queue": write_queue.stats()
+    }
+    return json.dumps(stats_dict), 200
@@ -0,0 +1,155 @@
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from flask import current_app
+
+from . import serializers
+from ..persistence import db, db_util
+from ..persistence.signals import books_changed
+
+
+class Subscription(object):
+    def __init__(self, size):
+        self.queue = queue.Queue(size)
+        self.overflowed = False
+
+    def put(self, changes):
+        # Never blocks the publisher. A full queue marks the subscriber, which then catches up from the database.
+        for change in changes:
+            if self.overflowed:
+                return
+            try:
+                self.queue.put_nowait(change)
+            except queue.Full:
+                self.overflowed = True
+
+    def drain(self):
+        self.overflowed = False
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+
+class BookStream(object):
+    """
+    Fans book changes out to the clients of the server-sent events stream.
+
+    books_changed, sent after every commit and for changes seen from other processes, wakes one publisher thread
+    per app. It reads the change feed past the last published change_seq and puts the changes on a bounded queue
+    per subscriber. It also polls every SSE_POLL_INTERVAL seconds, and exits when the last subscriber leaves.
+    A subscriber that falls SSE_QUEUE_SIZE changes behind is not waited for. It drops its queue and reads what
+    it missed from the change feed itself. Event ids are change_seq values, so clients resume with Last-Event-ID.
+    """
+
+    def __init__(self, app=None):
+        books_changed.connect(self.on_books_changed)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["book_stream"] = {
+            "subscribers": set(),
+            "lock": threading.Lock(),
+            "wake": threading.Event(),
+            "thread": None,
+            "last_seq": None
+        }
+
+    def on_books_changed(self, app, ids=None, **kwargs):
+        state = app.extensions.get("book_stream")
+        if state is not None:
+            state["wake"].set()
+
+    def subscribe(self):
+        # Returns (subscription, change_seq). Every change after change_seq is put on the subscription's queue.
+        app = current_app._get_current_object()
+        state = app.extensions["book_stream"]
+        subscription = Subscription(app.config["SSE_QUEUE_SIZE"])
+        with state["lock"]:
+            if state["thread"] is None:
+                state["last_seq"] = db_util.get_current_change_seq()
+                thread = threading.Thread(target=self.publish_loop, args=(app, state))
+                thread.daemon = True
+                state["thread"] = thread
+                thread.start()
+            state["subscribers"].add(subscription)
+            return subscription, state["last_seq"]
+
+    def unsubscribe(self, app, subscription):
+        # Called when the response is closed, which can be after the request context is gone.
+        state = app.extensions["book_stream"]
+        with state["lock"]:
+            state["subscribers"].discard(subscription)
+        state["wake"].set()
+
+    def publish_loop(self, app, state):
+        with app.app_context():
+            while True:
+                state["wake"].wait(app.config["SSE_POLL_INTERVAL"])
+                state["wake"].clear()
+                with state["lock"]:
+                    if not state["subscribers"]:
+                        state["thread"] = None
+                        return
+                try:
+                    self.publish(app, state)
+                except Exception:
+                    app.logger.exception("Publishing book changes failed.")
+                finally:
+                    db.session.remove()
+
+    def publish(self, app, state):
+        more = True
+        while more:
+            changes, cursor, more = db_util.get_book_changes(state["last_seq"], app.config["SSE_BATCH_SIZE"])
+            with state["lock"]:
+                if changes is None:
+                    # The publisher fell behind compacted tombstones. Subscribers find out when they catch up.
+                    for subscription in state["subscribers"]:
+                        subscription.overflowed = True
+                    state["last_seq"] = db_util.get_current_change_seq()
+                    return
+                for subscription in state["subscribers"]:
+                    subscription.put(changes)
+                state["last_seq"] = cursor
+
+    def events(self, subscription, last_seq, serializer, catch_up):
+        # Yields the event stream for one subscriber, starting after last_seq. With catch_up the changes already
+        # in the database are read first. Anything seen twice, from the feed and the queue, is skipped by seq.
+        keepalive = current_app.config["SSE_KEEPALIVE"]
+        while True:
+            if catch_up or subscription.overflowed:
+                subscription.drain()
+                more = True
+                while more:
+                    changes, cursor, more = db_util.get_book_changes(last_seq, current_app.config["SSE_BATCH_SIZE"])
+                    if changes is None:
+                        yield "event: resync\ndata: {}\n\n"
+                        return
+                    for change in changes:
+                        yield self.format_event(change, serializer)
+                    last_seq = max(last_seq, cursor)
+                catch_up = False
+
+            try:
+                change = subscription.queue.get(timeout=keepalive)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if change[0] > last_seq:
+                last_seq = change[0]
+                yield self.format_event(change, serializer)
+
+    def format_event(self, change, serializer):
+        change_seq, book_id, book = change
+        if book is None:
+            data = {"seq": change_seq, "op": "delete", "id": book_id}
+        else:
+            data = {"seq": change_seq, "op": "upsert", "id": book_id, "book": serializer.to_dict(book)}
+        return "id: %d\nevent: %s\ndata: %s\n\n" % (change_seq, data["op"], serializers.dumps(data))
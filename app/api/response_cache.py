@@ -0,0 +1,116 @@
+import functools
+import threading
+import time
+
+from flask import request, current_app, Response
+
+from ..cache import LRUCache
+from ..persistence.signals import books_changed
+
+
+# Request headers that let the view answer 304 instead of rendering.
+CONDITIONAL_HEADERS = ("HTTP_IF_NONE_MATCH", "HTTP_IF_MODIFIED_SINCE")
+
+
+class ResponseCache(object):
+    """
+    Caches the rendered bodies of book GET responses, keyed by host, endpoint, query args and Accept
+    header, since the bodies hold external urls.
+
+    Each entry remembers the write generation it was rendered at, and books_changed bumps the generation, so
+    entries never outlive a write. Entries older than RESPONSE_CACHE_TTL are still served for up to
+    RESPONSE_CACHE_STALE_TTL more seconds while a single background thread renders a fresh copy, so an expiry
+    does not send every waiting client to the database at once.
+    """
+
+    def __init__(self, app=None):
+        books_changed.connect(self.on_books_changed)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["response_cache"] = {
+            "entries": LRUCache(app.config["RESPONSE_CACHE_SIZE"]),
+            "generation": 0,
+            "refreshing": set(),
+            "lock": threading.Lock()
+        }
+
+    def cached(self, view):
+        @functools.wraps(view)
+        def wrapper(**view_args):
+            state = current_app.extensions["response_cache"]
+            if state["entries"].maxsize <= 0:
+                return view(**view_args)
+
+            key = (request.host_url, request.endpoint, tuple(sorted(request.args.items(multi=True))),
+                   request.headers.get("Accept", ""))
+            hit, entry = state["entries"].get(key)
+            if hit and entry["generation"] == state["generation"]:
+                age = time.time() - entry["created_at"]
+                if age < current_app.config["RESPONSE_CACHE_TTL"]:
+                    return self.make_response(entry, "hit")
+                if age < current_app.config["RESPONSE_CACHE_TTL"] + current_app.config["RESPONSE_CACHE_STALE_TTL"]:
+                    self.start_refresh(state, key, view, view_args)
+                    return self.make_response(entry, "stale")
+
+            return self.render(state, key, view, view_args)
+
+        return wrapper
+
+    def render(self, state, key, view, view_args):
+        generation = state["generation"]
+        response = current_app.make_response(view(**view_args))
+        # Streamed and error responses are passed through untouched.
+        if response.status_code == 200 and not response.is_streamed:
+            state["entries"].add(key, {
+                "body": response.get_data(),
+                "status": response.status_code,
+                "content_type": response.headers.get("Content-Type"),
+                "validators": [(name, response.headers[name]) for name in ("ETag", "Last-Modified")
+                               if name in response.headers],
+                "generation": generation,
+                "created_at": time.time()
+            })
+        response.headers["X-Cache"] = "miss"
+        return response
+
+    def start_refresh(self, state, key, view, view_args):
+        with state["lock"]:
+            if key in state["refreshing"]:
+                return
+            state["refreshing"].add(key)
+
+        app = current_app._get_current_object()
+        # The refresh renders the view again in a copy of this request, without its body or conditional headers.
+        environ = dict((name, value) for name, value in request.environ.items()
+                       if not name.startswith("wsgi.input") and name not in CONDITIONAL_HEADERS)
+
+        def refresh():
+            try:
+                with app.request_context(environ):
+                    self.render(state, key, view, view_args)
+            except Exception:
+                app.logger.exception("Refreshing cached response failed.")
+            finally:
+                with state["lock"]:
+                    state["refreshing"].discard(key)
+
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+
+    def make_response(self, entry, status):
+        response = Response(entry["body"], entry["status"], content_type=entry["content_type"],
+                            headers=entry["validators"])
+        response.headers["X-Cache"] = status
+        # Conditional requests are answered from the cached validators.
+        return response.make_conditional(request)
+
+    def stats(self):
+        return current_app.extensions["response_cache"]["entries"].stats()
+
+    def on_books_changed(self, app, ids=None, **kwargs):
+        state = app.extensions["response_cache"]
+        with state["lock"]:
+            state["generation"] += 1
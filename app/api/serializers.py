@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from operator import attrgetter
+
+from flask import json, url_for
+
+from ..persistence.models import Book, User
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+# Stands in for the id while a url template is built. Any value the int converter accepts will do.
+URL_ID_SENTINEL = 2147483647
+
+URL_ENDPOINTS = {
+    Book: ("api_blueprint.get_book", "book_id"),
+    User: ("api_blueprint.get_user", "user_id")
+}
+
+
+def get_dumps():
+    # The fastest installed JSON encoder. flask.json already prefers simplejson over the standard library.
+    if orjson is not None:
+        return lambda obj: orjson.dumps(obj).decode("utf-8")
+    if ujson is not None:
+        return lambda obj: ujson.dumps(obj, escape_forward_slashes=False)
+    return json.dumps
+
+
+dumps = get_dumps()
+
+
+class Codec(object):
+    def __init__(self, mimetype, dumps, loads):
+        self.mimetype = mimetype
+        self.dumps = dumps
+        self.loads = loads
+
+
+JSON_MIMETYPE = "application/json"
+
+# Wire formats by mimetype, in order of preference when the client accepts several equally. The binary
+# formats are only offered when their library is installed.
+CODECS = OrderedDict([(JSON_MIMETYPE, Codec(JSON_MIMETYPE, dumps, json.loads))])
+if msgpack is not None:
+    for mimetype in ("application/msgpack", "application/x-msgpack"):
+        CODECS[mimetype] = Codec(mimetype, lambda obj: msgpack.packb(obj, use_bin_type=True),
+                                 lambda data: msgpack.unpackb(data, raw=False))
+if cbor2 is not None:
+    CODECS["application/cbor"] = Codec("application/cbor", cbor2.dumps, cbor2.loads)
+
+
+def negotiate_codec(accept_mimetypes):
+    return CODECS[accept_mimetypes.best_match(list(CODECS), default=JSON_MIMETYPE)]
+
+
+def get_codec(mimetype):
+    # Request bodies without a known Content-Type are JSON, as they always have been.
+    return CODECS.get(mimetype, CODECS[JSON_MIMETYPE])
+
+
+class LegacySerializer(object):
+    """
+    Version 1 output. Every item is encoded by its to_json, and a collection is a JSON list of those strings.
+    """
+
+    mimetype = JSON_MIMETYPE
+
+    def __init__(self, model, fields=None):
+        self.fields = fields
+
+    def to_dict(self, instance):
+        return instance.to_dict(self.fields)
+
+    def encode(self, instance):
+        return instance.to_json(self.fields)
+
+    def encode_element(self, instance):
+        # An item as it appears inside a collection.
+        return json.dumps(self.encode(instance))
+
+    def encode_collection(self, key, instances, next_url):
+        return json.dumps({key: [self.encode(instance) for instance in instances], "next": next_url})
+
+
+class ModelSerializer(object):
+    """
+    Version 2 output, selected with ?v=2 and used for every binary format. A collection is one nested document
+    encoded in one pass, and urls are filled into a template built once per serializer instead of calling
+    url_for for every row.
+    """
+
+    def __init__(self, model, fields=None, codec=None):
+        self.fields = fields
+        self.codec = codec or CODECS[JSON_MIMETYPE]
+        self.mimetype = self.codec.mimetype
+        endpoint, id_arg = URL_ENDPOINTS[model]
+        url = url_for(endpoint, _external=True, **{id_arg: URL_ID_SENTINEL})
+        self.url_prefix, _, self.url_suffix = url.rpartition(str(URL_ID_SENTINEL))
+
+        self.getters = []
+        for field in fields or model.FIELDS:
+            getter = self.get_url if field == "url" else attrgetter(field)
+            self.getters.append((field, getter))
+
+    def get_url(self, instance):
+        return "%s%d%s" % (self.url_prefix, instance.id, self.url_suffix)
+
+    def to_dict(self, instance):
+        return dict((field, getter(instance)) for field, getter in self.getters)
+
+    def encode(self, instance):
+        return self.codec.dumps(self.to_dict(instance))
+
+    encode_element = encode
+
+    def encode_collection(self, key, instances, next_url):
+        return self.codec.dumps({key: [self.to_dict(instance) for instance in instances], "next": next_url})
+
+
+SERIALIZERS = {
+    1: LegacySerializer,
+    2: ModelSerializer
+}
+
+
+def get_serializer(model, fields=None, version=1, codec=None):
+    # The version 1 layout of JSON strings inside JSON has no meaning in a binary format, so those get version 2.
+    if codec is not None and codec.mimetype != JSON_MIMETYPE:
+        return ModelSerializer(model, fields, codec)
+    return SERIALIZERS[version](model, fields)
@@ -1,10 +1,15 @@
 from flask import Blueprint
 from flask_httpauth import HTTPBasicAuth
 
+from .principal_cache import PrincipalCache
+from .token_epochs import TokenEpochs
+
 
 ui_auth_blueprint = Blueprint("ui_auth_blueprint", __name__)
 api_auth_blueprint = Blueprint("api_auth_blueprint", __name__)
 api_auth = HTTPBasicAuth()
+token_epochs = TokenEpochs()
+principal_cache = PrincipalCache(token_epochs)
 
 
 from . import auth_handler, api_auth_handler, ui_auth_handler
@@ -1,7 +1,13 @@
-from flask import request, json, url_for, g
+import base64
+import os
+import uuid
+from datetime import datetime, timedelta
 
-from . import api_auth, api_auth_blueprint
-from ..persistence.models import User
+from flask import request, json, url_for, g, current_app
+
+from . import api_auth, api_auth_blueprint, principal_cache, token_epochs
+from .principal_cache import Principal
+from ..persistence.models import User, RefreshToken
 from ..persistence import db_util
 import auth_handler
 
@@ -11,11 +17,12 @@ def verify_password(email, password):
     if password == "" or password is None:
         # Token based authorization.
         token = email
-        user = User.verify_auth_token(token)
-        if user is None or not user.confirmed:
+        principal = principal_cache.verify_token(token)
+        if principal is None or not principal.confirmed:
             return False
         else:
-            g.current_user = user
+            # The user itself is only loaded if a view asks for it, through get_current_user.
+            g.principal = principal
             return True
 
     # Authorization using email and password.
@@ -23,10 +30,20 @@ def verify_password(email, password):
     if user is None or not user.confirmed:
         return False
 
+    g.principal = Principal(user.id, user.confirmed)
     g.current_user = user
     return user.verify_password(password)
 
 
+def get_current_user():
+    # The authenticated user. Token authorization only sets g.principal, so the user is loaded on first use.
+    user = getattr(g, "current_user", None)
+    if user is None:
+        user = db_util.get_user(g.principal.user_id)
+        g.current_user = user
+    return user
+
+
 @api_auth_blueprint.route("/register", methods=["POST"])
 def register():
     request_data = request.get_data()
@@ -82,7 +99,7 @@ def confirm(token):
     if user.confirmed:
         return json.dumps({"message": "You have already verified your account."}), 401
 
-    valid_token = user.confirm(token)
+    valid_token = db_util.confirm_user(user.id, token)
     if valid_token:
         return json.dumps({"message": "You have successfully verified your account."}), 200
     else:
@@ -92,12 +109,79 @@ def confirm(token):
 @api_auth_blueprint.route("/token")
 @api_auth.login_required
 def token():
+    user = get_current_user()
     token_data = {
-        "token": g.current_user.generate_auth_token()
+        "token": user.generate_auth_token(token_epochs.get_epoch(user.id))
     }
     return json.dumps(token_data), 200
 
 
+@api_auth_blueprint.route("/login", methods=["POST"])
+def login():
+    request_data = request.get_data()
+    if request_data is None or request_data == "":
+        return json.dumps(
+            {"Error": "JSON data is empty. To log in, send POST request with email and password."}), 400
+
+    json_data = json.loads(request_data)
+    # A null email would drop out of a filter and match every user, so both have to be strings.
+    if not isinstance(json_data, dict) or not isinstance(json_data.get("email"), basestring):
+        return json.dumps({"Error": "email cannot be empty."}), 400
+    if not isinstance(json_data.get("password"), basestring):
+        return json.dumps({"Error": "password cannot be empty."}), 400
+
+    user = db_util.get_user_by_email(json_data["email"])
+    if user is None or not user.verify_password(json_data["password"]):
+        return json.dumps({"Error": "Invalid email or password."}), 401
+
+    if not user.confirmed:
+        return json.dumps({"Error": "Confirm your account before logging in."}), 401
+
+    refresh_token = generate_refresh_token()
+    db_util.add_refresh_token(user.id, RefreshToken.hash_token(refresh_token), uuid.uuid4().hex,
+                              get_refresh_expiry())
+    return get_tokens_json(user, refresh_token), 200
+
+
+@api_auth_blueprint.route("/refresh", methods=["POST"])
+def refresh():
+    request_data = request.get_data()
+    if request_data is None or request_data == "":
+        return json.dumps(
+            {"Error": "JSON data is empty. To refresh, send POST request with refresh_token."}), 400
+
+    json_data = json.loads(request_data)
+    if not isinstance(json_data, dict) or not isinstance(json_data.get("refresh_token"), basestring):
+        return json.dumps({"Error": "refresh_token cannot be empty."}), 400
+
+    refresh_token = generate_refresh_token()
+    user_id = db_util.use_refresh_token(RefreshToken.hash_token(json_data["refresh_token"]),
+                                        RefreshToken.hash_token(refresh_token), get_refresh_expiry())
+    user = db_util.get_user(user_id) if user_id is not None else None
+    if user is None:
+        return json.dumps({"Error": "The refresh token is invalid."}), 401
+
+    return get_tokens_json(user, refresh_token), 200
+
+
+def generate_refresh_token():
+    return base64.urlsafe_b64encode(os.urandom(32)).rstrip("=")
+
+
+def get_refresh_expiry():
+    return datetime.utcnow() + timedelta(seconds=current_app.config["REFRESH_TOKEN_TTL"])
+
+
+def get_tokens_json(user, refresh_token):
+    # The access token authorizes like the one from /token, as the username of HTTP Basic auth.
+    expiration = current_app.config["ACCESS_TOKEN_TTL"]
+    return json.dumps({
+        "token": user.generate_auth_token(token_epochs.get_epoch(user.id), expiration),
+        "expires_in": expiration,
+        "refresh_token": refresh_token
+    })
+
+
 @api_auth_blueprint.route("/test_auth_token")
 @api_auth.login_required
 def test_auth_token():
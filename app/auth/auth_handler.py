@@ -1,15 +1,5 @@
-from ..persistence.models import User
-from ..persistence import db
+from ..persistence import db_util
 
 
 def register(user_json):
-    email = user_json["email"]
-    username = user_json["username"]
-    password = user_json["password"]
-
-    user = User(email=email, username=username, password=password)
-
-    db.session.add(user)
-    db.session.commit()
-
-    return user
\ No newline at end of file
+    return db_util.add_user(user_json)
\ No newline at end of file
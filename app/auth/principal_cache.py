@@ -0,0 +1,98 @@
+import collections
+import threading
+import time
+
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+
+from ..cache import LRUCache
+from ..persistence import db_util
+from ..persistence.signals import users_changed
+
+
+# What the API needs to know about the user behind a token.
+Principal = collections.namedtuple("Principal", ["user_id", "confirmed"])
+
+
+class PrincipalCache(object):
+    """
+    LRU cache from verified auth token to Principal, so token authenticated requests skip the signature check
+    and the user lookup.
+
+    An entry lives no longer than its token. Every user has a generation, bumped by users_changed, and entries
+    remember the generation they were loaded at, so a change to the user makes all of their entries stale.
+
+    Tokens that carry their claims are checked against the in-memory token epochs instead of loading the user,
+    on every hit too. Tokens that only carry the user id are still accepted, and load the user on a miss.
+    """
+
+    def __init__(self, token_epochs, app=None):
+        self.token_epochs = token_epochs
+        users_changed.connect(self.on_users_changed)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["principal_cache"] = {
+            "entries": LRUCache(app.config["PRINCIPAL_CACHE_SIZE"]),
+            "generations": collections.defaultdict(int),
+            # Bumped when any user may have changed.
+            "generation": 0,
+            "lock": threading.Lock()
+        }
+
+    def verify_token(self, token):
+        # Returns the Principal for a valid token, or None.
+        state = current_app.extensions["principal_cache"]
+        hit, entry = state["entries"].get(token)
+        if hit:
+            principal, generation, epoch = entry
+            if generation == self.get_generation(state, principal.user_id) and (
+                    epoch is None or epoch == self.token_epochs.get_epoch(principal.user_id)):
+                return principal
+
+        serializer = Serializer(current_app.config["SECRET_KEY"])
+        try:
+            data, header = serializer.loads(token, return_header=True)
+            user_id = data["uid"] if "uid" in data else data["token"]
+        except Exception:
+            return None
+
+        # Read before the user is loaded, so a change that lands in between leaves a stale entry, not a wrong one.
+        generation = self.get_generation(state, user_id)
+        epoch = data.get("epoch")
+        if epoch is not None:
+            if epoch > self.token_epochs.get_epoch(user_id):
+                # Issued after the epochs were last read, possibly by another process.
+                self.token_epochs.refresh()
+            if epoch != self.token_epochs.get_epoch(user_id):
+                return None
+            principal = Principal(user_id, data["confirmed"])
+        else:
+            user = db_util.get_user(user_id)
+            if user is None:
+                return None
+            principal = Principal(user.id, user.confirmed)
+
+        ttl = header["exp"] - time.time()
+        if ttl > 0:
+            state["entries"].add(token, (principal, generation, epoch), ttl=ttl)
+        return principal
+
+    def get_generation(self, state, user_id):
+        with state["lock"]:
+            return state["generation"], state["generations"][user_id]
+
+    def stats(self):
+        return current_app.extensions["principal_cache"]["entries"].stats()
+
+    def on_users_changed(self, app, ids=None, **kwargs):
+        state = app.extensions.get("principal_cache")
+        if state is None:
+            return
+        with state["lock"]:
+            if ids is None:
+                state["generation"] += 1
+                return
+            for user_id in ids:
+                state["generations"][user_id] += 1
@@ -0,0 +1,59 @@
+import threading
+import time
+
+from flask import current_app
+
+from ..persistence import db_util
+from ..persistence.signals import users_changed
+
+
+class TokenEpochs(object):
+    """
+    In-memory copy of the token_epochs table, which token authorization checks instead of the database.
+
+    It is read once and then refreshed incrementally, reading only the rows whose seq is past the last one
+    seen. That happens on the next lookup after users_changed, sent for this process's writes and, with cache
+    coherence, for other processes' writes, and at least every TOKEN_EPOCH_REFRESH_INTERVAL seconds otherwise.
+    """
+
+    def __init__(self, app=None):
+        users_changed.connect(self.on_users_changed)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["token_epochs"] = {
+            "epochs": {},
+            "seq": -1,
+            "refreshed_at": None,
+            "stale": True,
+            "lock": threading.Lock()
+        }
+
+    def get_epoch(self, user_id):
+        state = current_app.extensions["token_epochs"]
+        interval = current_app.config["TOKEN_EPOCH_REFRESH_INTERVAL"]
+        if state["stale"] or state["refreshed_at"] is None or time.time() - state["refreshed_at"] >= interval:
+            self.refresh()
+        return state["epochs"].get(user_id, 0)
+
+    def refresh(self):
+        state = current_app.extensions["token_epochs"]
+        with state["lock"]:
+            # Cleared first, so a change committed while the table is read marks it stale again.
+            state["stale"] = False
+            try:
+                rows = db_util.get_token_epochs(state["seq"])
+            except Exception:
+                # The next lookup tries again.
+                state["stale"] = True
+                raise
+            for user_id, epoch, seq in rows:
+                state["epochs"][user_id] = epoch
+                state["seq"] = seq
+            state["refreshed_at"] = time.time()
+
+    def on_users_changed(self, app, ids=None, **kwargs):
+        state = app.extensions.get("token_epochs")
+        if state is not None:
+            state["stale"] = True
@@ -0,0 +1,67 @@
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    Thread safe LRU cache with an optional time to live. None is a valid value, which lets callers cache misses.
+
+    get returns a (hit, value) tuple. Loaders should read invalidations before loading and hand it back to add,
+    so a value loaded while the key was being invalidated is never stored.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.invalidations = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or (entry[1] is not None and entry[1] < time.time()):
+                self.misses += 1
+                return False, None
+            # Re-inserting moves the key to the most recently used end.
+            self.entries[key] = entry
+            self.hits += 1
+            return True, entry[0]
+
+    def add(self, key, value, invalidations=None, ttl=None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self.lock:
+            if invalidations is not None and invalidations != self.invalidations:
+                return
+            self.entries.pop(key, None)
+            self.entries[key] = (value, expires_at)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.invalidations += 1
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
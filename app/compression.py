@@ -0,0 +1,130 @@
+import re
+import zlib
+
+from flask import request, current_app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# The suffix compress_response adds to the ETag of a compressed response.
+ETAG_SUFFIX = re.compile(r'-(?:gzip|br)"')
+
+
+class GzipEncoder(object):
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        # Emits everything compressed so far without ending the stream.
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliEncoder(object):
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class Compression(object):
+    """
+    Compresses responses with brotli, when it is installed, or gzip, whichever the client's Accept-Encoding
+    prefers. Bodies below COMPRESS_MIN_SIZE are sent as they are. Streamed responses are compressed chunk by
+    chunk, and every chunk is flushed, so clients still receive the stream as it is produced.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self.strip_etag_suffixes)
+        app.after_request(self.compress_response)
+
+    def strip_etag_suffixes(self):
+        # Clients revalidate with the ETag of the compressed response they hold. Without the encoding suffix it
+        # is the ETag the view computes, so views never need to know about compression.
+        if_none_match = request.environ.get("HTTP_IF_NONE_MATCH")
+        if if_none_match:
+            request.environ["HTTP_IF_NONE_MATCH"] = ETAG_SUFFIX.sub('"', if_none_match)
+
+    def get_encodings(self):
+        return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+    def get_encoder(self, app, encoding):
+        if encoding == "br":
+            return BrotliEncoder(app.config["COMPRESS_BROTLI_QUALITY"])
+        return GzipEncoder(app.config["COMPRESS_LEVEL"])
+
+    def compress_response(self, response):
+        app = current_app
+        if response.status_code == 304:
+            # Carries the ETag a full response would have had, which is compressed unless the body is tiny.
+            encoding = request.accept_encodings.best_match(self.get_encodings())
+            if encoding is not None:
+                self.set_etag_suffix(response, encoding)
+            return response
+
+        if (response.mimetype not in app.config["COMPRESS_MIMETYPES"] or response.status_code < 200 or
+                response.status_code == 204 or response.direct_passthrough or
+                "Content-Encoding" in response.headers):
+            return response
+
+        # The body depends on Accept-Encoding from here on, even when this particular response is not compressed.
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(self.get_encodings())
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self.compress_stream(response.iter_encoded(), response.response,
+                                                     self.get_encoder(app, encoding))
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+                return response
+            encoder = self.get_encoder(app, encoding)
+            response.set_data(encoder.compress(data) + encoder.finish())
+
+        response.headers["Content-Encoding"] = encoding
+        self.set_etag_suffix(response, encoding)
+
+        return response
+
+    def set_etag_suffix(self, response, encoding):
+        # A strong ETag names one exact representation, so each encoding gets its own.
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.set_etag("%s-%s" % (etag, encoding), weak)
+
+    def compress_stream(self, chunks, body, encoder):
+        try:
+            for chunk in chunks:
+                data = encoder.compress(chunk) + encoder.flush()
+                if data:
+                    yield data
+            yield encoder.finish()
+        finally:
+            # Closing the response closes this generator, which has to close the original body in turn.
+            if hasattr(body, "close"):
+                body.close()
+
+
+compression = Compression()
@@ -0,0 +1,81 @@
+import multiprocessing
+import os
+import threading
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordHashing(object):
+    """
+    Hashes and checks passwords in a pool of PASSWORD_HASH_POOL_SIZE worker processes, so the PBKDF2 rounds
+    of one request do not hold the GIL the request threads share. The calling thread waits for the result
+    without holding it, for at most PASSWORD_HASH_TIMEOUT seconds. The pool is started on first use in each
+    process. With a pool size of 0, the default outside production, the work is done on the calling thread.
+
+    New hashes use PASSWORD_HASH_METHOD. Checking reads the method from the stored hash, so hashes made with
+    an older work factor keep working.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["password_hashing"] = {
+            "size": app.config["PASSWORD_HASH_POOL_SIZE"],
+            "pool": None,
+            "pid": None,
+            "method": app.config["PASSWORD_HASH_METHOD"],
+            "timeout": app.config["PASSWORD_HASH_TIMEOUT"],
+            "lock": threading.Lock()
+        }
+
+    def get_state(self):
+        # Hashing also happens outside of an app, in scripts and in the models' tests.
+        if current_app:
+            return current_app.extensions.get("password_hashing")
+        return None
+
+    def generate(self, password):
+        state = self.get_state()
+        if state is None:
+            return generate_password_hash(password)
+        return self.run(state, generate_password_hash, password, state["method"])
+
+    def check(self, password_hash, password):
+        state = self.get_state()
+        if state is None:
+            return check_password_hash(password_hash, password)
+        return self.run(state, check_password_hash, password_hash, password)
+
+    def run(self, state, function, *args):
+        pool = self.ensure_pool(state)
+        if pool is None:
+            return function(*args)
+        # A worker that dies mid-task never returns its result, so the wait is bounded.
+        return pool.apply_async(function, args).get(state["timeout"])
+
+    def ensure_pool(self, state):
+        if not state["size"]:
+            return None
+        with state["lock"]:
+            # A pool does not survive a fork, since its handler threads stay behind in the parent, so every worker
+            # process starts its own on first use.
+            if state["pool"] is None or state["pid"] != os.getpid():
+                state["pool"] = multiprocessing.Pool(state["size"])
+                state["pid"] = os.getpid()
+            return state["pool"]
+
+    def close(self, app):
+        state = app.extensions.get("password_hashing")
+        if state is None:
+            return
+        with state["lock"]:
+            if state["pool"] is not None and state["pid"] == os.getpid():
+                state["pool"].terminate()
+                state["pool"].join()
+            state["pool"] = None
+
+
+hashing = PasswordHashing()
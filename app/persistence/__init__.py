@@ -1,3 +1,17 @@
-from flask_sqlalchemy import SQLAlchemy
+from .replicas import RoutingSQLAlchemy, ReadReplicas
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+
+
+from .suggest import BookSuggest
+from .entity_cache import EntityCache
+from .coherence import CacheCoherence
+from .sqlite_tuning import SQLiteTuning
+from .write_queue import WriteQueue
+
+book_suggest = BookSuggest()
+entity_cache = EntityCache()
+cache_coherence = CacheCoherence()
+sqlite_tuning = SQLiteTuning()
+read_replicas = ReadReplicas()
+write_queue = WriteQueue()
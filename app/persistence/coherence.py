@@ -0,0 +1,118 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+
+from flask import current_app
+
+from .signals import books_changed, users_changed
+
+
+class SharedGenerations(object):
+    """
+    Write generation counters in a small memory mapped file, shared by every worker process on the host.
+
+    Reading a counter is a struct unpack from shared memory. Bumping one takes a thread lock and a POSIX
+    record lock on the file, so increments from different threads and processes are never lost.
+    """
+
+    SLOTS = ("books", "users")
+    SLOT_FORMAT = "<Q"
+
+    def __init__(self, path):
+        size = struct.calcsize(self.SLOT_FORMAT) * len(self.SLOTS)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.lock = threading.Lock()
+
+    def get_offset(self, name):
+        return self.SLOTS.index(name) * struct.calcsize(self.SLOT_FORMAT)
+
+    def read(self, name):
+        return struct.unpack_from(self.SLOT_FORMAT, self.map, self.get_offset(name))[0]
+
+    def bump(self, name):
+        offset = self.get_offset(name)
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                generation = struct.unpack_from(self.SLOT_FORMAT, self.map, offset)[0] + 1
+                struct.pack_into(self.SLOT_FORMAT, self.map, offset, generation)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+        return generation
+
+
+class CacheCoherence(object):
+    """
+    Keeps the in-process caches of several workers coherent, without an external cache server.
+
+    Local writes bump a shared generation per table. Before every request each worker compares the shared
+    generations with the ones it has seen, and when another worker has written it sends books_changed or
+    users_changed with ids=None and remote=True, which makes every cache drop what it holds for that table, or,
+    for the suggest index, catch up from the change feed.
+    Disabled unless CACHE_COHERENCE_FILE is set.
+    """
+
+    SIGNALS = {
+        "books": books_changed,
+        "users": users_changed
+    }
+
+    def __init__(self, app=None):
+        books_changed.connect(self.on_books_changed)
+        users_changed.connect(self.on_users_changed)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        path = app.config["CACHE_COHERENCE_FILE"]
+        if not path:
+            app.extensions["cache_coherence"] = None
+            return
+
+        generations = SharedGenerations(path)
+        app.extensions["cache_coherence"] = {
+            "generations": generations,
+            "seen": dict((name, generations.read(name)) for name in SharedGenerations.SLOTS),
+            "lock": threading.Lock()
+        }
+        app.before_request(self.check)
+
+    def check(self):
+        app = current_app._get_current_object()
+        state = app.extensions["cache_coherence"]
+        for name in SharedGenerations.SLOTS:
+            generation = state["generations"].read(name)
+            if generation != state["seen"][name]:
+                self.remote_change(app, state, name, generation)
+
+    def remote_change(self, app, state, name, generation):
+        with state["lock"]:
+            if generation == state["seen"][name]:
+                return
+            state["seen"][name] = generation
+        self.SIGNALS[name].send(app, ids=None, remote=True)
+
+    def on_books_changed(self, app, ids=None, remote=False):
+        self.local_change(app, "books", remote)
+
+    def on_users_changed(self, app, ids=None, remote=False):
+        self.local_change(app, "users", remote)
+
+    def local_change(self, app, name, remote):
+        state = app.extensions.get("cache_coherence")
+        if state is None or remote:
+            return
+
+        with state["lock"]:
+            seen = state["seen"][name]
+            generation = state["generations"].bump(name)
+            state["seen"][name] = generation
+        # Anything between the last seen generation and this bump was written by another worker.
+        if generation != seen + 1:
+            self.SIGNALS[name].send(app, ids=None, remote=True)
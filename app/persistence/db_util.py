@@ -1,7 +1,23 @@
 import os
+import sqlite3
+from datetime import datetime, timedelta
 
-from .models import Book, User
-from . import db
+from flask import current_app
+from sqlalchemy import text, column, bindparam, func, Float
+from sqlalchemy.orm import load_only
+
+from .models import Book, BookTombstone, ChangeSequence, User, TokenEpoch, RefreshToken
+from .signals import books_changed, users_changed
+from . import db, entity_cache, write_queue
+
+
+# Keeps IN lists and executemany batches below SQLite's bound parameter limit.
+BULK_BATCH_SIZE = 500
+
+# INSERT, UPDATE and DELETE ... RETURNING need SQLite 3.35 or newer.
+SQLITE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+BOOK_FIELDS = ("book_name", "author_name", "comments")
 
 
 def init_db():
@@ -13,7 +29,26 @@ def drop_tables():
     db.drop_all()
 
 
+@write_queue.job
 def add_book(book_json):
+    # Returns None when a book with the same name already exists.
+    use_primary()
+    if supports_returning():
+        book = execute_returning(
+            Book,
+            "INSERT INTO books (book_name, author_name, comments, updated_at) "
+            "VALUES (:book_name, :author_name, :comments, :updated_at) ON CONFLICT (book_name) DO NOTHING",
+            book_name=book_json["book_name"], author_name=book_json.get("author_name", ""),
+            comments=book_json.get("comments", ""), updated_at=datetime.utcnow())
+        if book is None:
+            return None
+        commit()
+        notify_books_changed([book.id])
+
+        return book
+
+    if get_book_ids_by_name([book_json["book_name"]]):
+        return None
     book = Book(book_name=book_json["book_name"])
     if "author_name" in book_json:
         book.author_name = book_json["author_name"]
@@ -21,12 +56,134 @@ def add_book(book_json):
         book.comments = book_json["comments"]
 
     db.session.add(book)
-    db.session.commit()
+    commit()
+    notify_books_changed([book.id])
 
     return book
 
 
+@write_queue.job
+def add_books(books_json):
+    # Inserts all new books in one transaction. Returns one (status, book_id) tuple per item,
+    # where status is "created" or "duplicate".
+    use_primary()
+    names = set(book_json["book_name"] for book_json in books_json)
+    book_ids = get_book_ids_by_name(names)
+
+    rows = []
+    results = []
+    for book_json in books_json:
+        book_name = book_json["book_name"]
+        if book_name in book_ids:
+            results.append(["duplicate", book_name])
+            continue
+
+        # Placeholder until the id is known, so a repeated name in the same batch is a duplicate too.
+        book_ids[book_name] = None
+        rows.append({
+            "book_name": book_name,
+            "author_name": book_json.get("author_name", ""),
+            "comments": book_json.get("comments", "")
+        })
+        results.append(["created", book_name])
+
+    for batch in get_batches(rows):
+        db.session.execute(Book.__table__.insert(), batch)
+    created_ids = get_book_ids_by_name([row["book_name"] for row in rows])
+    book_ids.update(created_ids)
+    commit()
+    notify_books_changed(list(created_ids.values()))
+
+    return [(status, book_ids[book_name]) for status, book_name in results]
+
+
+def get_books_version():
+    # (count, max(updated_at), max(id)) of the books table. Every insert, update and delete changes at least
+    # one of them, so together they version the whole collection.
+    return db.session.query(func.count(Book.id), func.max(Book.updated_at), func.max(Book.id)).one()
+
+
+def get_book_ids_by_name(book_names):
+    book_ids = {}
+    for batch in get_batches(list(book_names)):
+        for book_id, book_name in db.session.query(Book.id, Book.book_name).filter(Book.book_name.in_(batch)):
+            book_ids[book_name] = book_id
+
+    return book_ids
+
+
+def commit():
+    # In a group commit batch the write queue commits once for all of its jobs.
+    if write_queue.in_batch():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def notify_books_changed(ids):
+    if ids:
+        app = current_app._get_current_object()
+        write_queue.after_commit(lambda: books_changed.send(app, ids=ids))
+
+
+def notify_users_changed(ids):
+    if ids:
+        app = current_app._get_current_object()
+        write_queue.after_commit(lambda: users_changed.send(app, ids=ids))
+
+
+def get_batches(items):
+    for start in range(0, len(items), BULK_BATCH_SIZE):
+        yield items[start:start + BULK_BATCH_SIZE]
+
+
+def supports_returning():
+    return SQLITE_RETURNING and db.engine.dialect.name == "sqlite"
+
+
+def execute_returning(model, statement, **params):
+    # Runs a single row INSERT, UPDATE or DELETE with a RETURNING clause and maps the returned row onto an
+    # instance, so the write and the read back are one statement. Returns None when no row was affected.
+    table_columns = model.__table__.columns
+    statement = text("%s RETURNING %s" % (statement, ", ".join(table_column.name for table_column in table_columns)))
+    # Parameters named after a column are bound with its type, so values such as datetimes are stored the way
+    # the ORM stores them.
+    statement = statement.bindparams(*[bindparam(key, type_=table_columns[key].type)
+                                       for key in params if key in table_columns])
+    result = db.session.execute(statement.columns(*table_columns), params, mapper=model.__mapper__)
+    # The driver reports no result columns at all when nothing was affected.
+    if not result.returns_rows:
+        return None
+    rows = list(model.query.populate_existing().instances(result))
+    if not rows:
+        return None
+    # Detached with the returned values loaded, so it can be read after the commit without another SELECT.
+    db.session.expunge(rows[0])
+
+    return rows[0]
+
+
+def get_values(data, keys):
+    return dict((key, data[key]) for key in keys if key in data)
+
+
+def get_assignments(values):
+    # Keys always come from a fixed list of column names, the values are bound parameters.
+    return ", ".join("%s = :%s" % (key, key) for key in sorted(values))
+
+
+def use_primary():
+    # Sends the rest of this session's statements to the primary database, reads included, so a request
+    # that has started writing never reads from a replica that is behind.
+    db.session.info["use_primary"] = True
+
+
 def get_book(book_id):
+    return entity_cache.get(Book, book_id)
+
+
+def load_book(book_id):
+    # Always reads the database. Write paths use this instead of the cached get_book.
     return Book.query.filter_by(id=book_id).first()
 
 
@@ -34,6 +191,104 @@ def get_all_books():
     return Book.query.all()
 
 
+def get_books_page(limit, after_id=None, fields=None):
+    # Keyset pagination over the primary key, so deep pages cost the same as the first one.
+    query_obj = load_fields(Book.query, Book, fields).order_by(Book.id)
+    if after_id is not None:
+        query_obj = query_obj.filter(Book.id > after_id)
+
+    return query_obj.limit(limit).all()
+
+
+def iter_books(chunk_size, fields=None):
+    # Rows are fetched chunk_size at a time instead of materializing the whole table.
+    return load_fields(Book.query, Book, fields).order_by(Book.id).yield_per(chunk_size)
+
+
+def load_fields(query_obj, model, fields=None):
+    # Restricts the SELECT to the columns behind the requested fields. The rest are deferred, and only
+    # loaded if something reads them later. The primary key is always loaded.
+    if not fields:
+        return query_obj
+    column_names = [field for field in fields if field in model.__table__.columns] or ["id"]
+    return query_obj.options(load_only(*column_names))
+
+
+def search_books(query, limit, after=None):
+    # Full text search ranked by bm25, best match first. after is the (score, id) of the last result
+    # of the previous page. Returns a list of (book, score) tuples.
+    after_score, after_id = after if after is not None else (None, None)
+    columns = ", ".join("books.%s" % book_column.name for book_column in Book.__table__.columns)
+    statement = text(
+        "SELECT %s, bm25(books_fts) AS score FROM books_fts JOIN books ON books.id = books_fts.rowid "
+        "WHERE books_fts MATCH :query AND (:after_score IS NULL OR bm25(books_fts) > :after_score "
+        "OR (bm25(books_fts) = :after_score AND books.id > :after_id)) "
+        "ORDER BY score, books.id LIMIT :limit" % columns
+    ).columns(*(list(Book.__table__.columns) + [column("score", Float)]))
+
+    query_obj = db.session.query(Book, column("score")).from_statement(statement)
+    return query_obj.params(query=get_fts_query(query), after_score=after_score, after_id=after_id,
+                            limit=limit).all()
+
+
+def get_book_changes(since, limit, fields=None):
+    # Changes after the change sequence number since, oldest first, as (changes, cursor, more). changes holds
+    # up to limit (change_seq, book_id, book) tuples, where book is None for a delete. cursor is the change_seq
+    # to ask from next time, and more tells whether changes past it are already known. Returns
+    # (None, None, False) when since is below the compaction horizon, because deletes before it are gone.
+    # Everything is read from the primary, and only up to the sequence value read first. All changes up to that
+    # value are committed, so none can be skipped by a write that lands between the queries.
+    use_primary()
+    sequences = dict(db.session.query(ChangeSequence.name, ChangeSequence.value))
+    if since < sequences["book_tombstones_horizon"]:
+        return None, None, False
+    current = sequences["books"]
+
+    # populate_existing, because books already in the session may have changed since they were loaded.
+    query_obj = load_fields(Book.query, Book, fields and list(fields) + ["change_seq"]).populate_existing()
+    books = query_obj.filter(Book.change_seq > since, Book.change_seq <= current).order_by(Book.change_seq)
+    tombstones = BookTombstone.query.filter(BookTombstone.change_seq > since, BookTombstone.change_seq <= current)
+    tombstones = tombstones.order_by(BookTombstone.change_seq)
+
+    changes = [(book.change_seq, book.id, book) for book in books.limit(limit + 1)]
+    changes.extend((tombstone.change_seq, tombstone.book_id, None) for tombstone in tombstones.limit(limit + 1))
+    changes.sort(key=lambda change: change[0])
+    if len(changes) > limit:
+        changes = changes[:limit]
+        return changes, changes[-1][0], True
+
+    return changes, current, False
+
+
+def get_current_change_seq():
+    use_primary()
+    return db.session.query(ChangeSequence.value).filter_by(name="books").scalar()
+
+
+@write_queue.job
+def compact_tombstones(retention_days):
+    # Drops tombstones older than retention_days and raises the horizon to the newest one dropped.
+    # Returns the number of tombstones removed.
+    use_primary()
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    horizon = db.session.query(func.max(BookTombstone.change_seq)).filter(BookTombstone.deleted_at < cutoff).scalar()
+    if horizon is None:
+        return 0
+
+    removed = BookTombstone.query.filter(BookTombstone.change_seq <= horizon).delete(synchronize_session=False)
+    ChangeSequence.query.filter_by(name="book_tombstones_horizon").update({"value": horizon},
+                                                                         synchronize_session=False)
+    commit()
+
+    return removed
+
+
+def get_fts_query(query):
+    # Quotes every term, so user input is matched as plain words and never parsed as FTS5 syntax.
+    terms = query.split()
+    return " ".join('"%s"' % term.replace('"', '""') for term in terms)
+
+
 def get_books_by_filter(book_name=None, author_name=None):
     query_obj = Book.query
     if book_name is not None:
@@ -45,18 +300,74 @@ def get_books_by_filter(book_name=None, author_name=None):
     return query_obj.all()
 
 
+@write_queue.job
+def upsert_book(book_name, book_json):
+    # Creates the book, or updates the given fields of the existing book with this name.
+    use_primary()
+    values = get_values(book_json, ("author_name", "comments"))
+    if supports_returning():
+        # With nothing to change the row is still touched, so RETURNING reports it.
+        assignments = "".join(", %s = excluded.%s" % (key, key) for key in sorted(values))
+        book = execute_returning(
+            Book,
+            "INSERT INTO books (book_name, author_name, comments, updated_at) "
+            "VALUES (:book_name, :author_name, :comments, :updated_at) "
+            "ON CONFLICT (book_name) DO UPDATE SET updated_at = excluded.updated_at%s" % assignments,
+            book_name=book_name, author_name=values.get("author_name", ""), comments=values.get("comments", ""),
+            updated_at=datetime.utcnow())
+    else:
+        book = Book.query.filter_by(book_name=book_name).first()
+        if book is None:
+            book = Book(book_name=book_name, author_name="", comments="")
+        for key, value in values.items():
+            setattr(book, key, value)
+        db.session.add(book)
+        db.session.flush()
+
+    commit()
+    notify_books_changed([book.id])
+
+    return book
+
+
+@write_queue.job
 def remove_book(book_id):
-    book = get_book(book_id)
+    use_primary()
+    if supports_returning():
+        book = execute_returning(Book, "DELETE FROM books WHERE id = :id", id=book_id)
+        if book is None:
+            return None
+        commit()
+        notify_books_changed([book_id])
+
+        return book
+
+    book = load_book(book_id)
     if book is None:
         return None
     db.session.delete(book)
-    db.session.commit()
+    commit()
+    notify_books_changed([book_id])
 
     return book
 
 
+@write_queue.job
 def update_book(book_id, book_json):
-    book = get_book(book_id)
+    use_primary()
+    values = get_values(book_json, BOOK_FIELDS)
+    if supports_returning() and values:
+        values["updated_at"] = datetime.utcnow()
+        book = execute_returning(Book, "UPDATE books SET %s WHERE id = :id" % get_assignments(values),
+                                 id=book_id, **values)
+        if book is None:
+            return None
+        commit()
+        notify_books_changed([book.id])
+
+        return book
+
+    book = load_book(book_id)
     if book is None:
         return None
 
@@ -68,12 +379,109 @@ def update_book(book_id, book_json):
         book.comments = book_json["comments"]
 
     db.session.add(book)
-    db.session.commit()
+    commit()
+    notify_books_changed([book.id])
 
     return book
 
 
+@write_queue.job
+def update_books(book_json, book_ids=None, book_name=None, author_name=None):
+    # Set based UPDATE of the books given by id, or else matching the filters, in one transaction.
+    # Returns (updated_ids, not_found_ids).
+    use_primary()
+    updated_ids, not_found_ids = get_target_ids(Book, book_ids, book_name=book_name, author_name=author_name)
+    update_rows(Book, updated_ids, book_json)
+    commit()
+    notify_books_changed(updated_ids)
+
+    return updated_ids, not_found_ids
+
+
+@write_queue.job
+def remove_books(book_ids=None, book_name=None, author_name=None):
+    use_primary()
+    removed_ids, not_found_ids = get_target_ids(Book, book_ids, book_name=book_name, author_name=author_name)
+    delete_rows(Book, removed_ids)
+    commit()
+    notify_books_changed(removed_ids)
+
+    return removed_ids, not_found_ids
+
+
+def get_target_ids(model, ids=None, **filters):
+    # Resolves either a list of ids or a set of column filters to (existing ids, missing ids).
+    if ids is None:
+        filters = dict((key, value) for key, value in filters.items() if value is not None)
+        if not filters:
+            # An empty filter matches every row, which no bulk change means to do.
+            raise ValueError("A bulk change needs ids or at least one filter value.")
+        query_obj = db.session.query(model.id).filter_by(**filters).order_by(model.id)
+        return [row_id for row_id, in query_obj], []
+
+    found_ids = set()
+    for batch in get_batches(list(set(ids))):
+        found_ids.update(row_id for row_id, in db.session.query(model.id).filter(model.id.in_(batch)))
+
+    not_found_ids = []
+    for row_id in ids:
+        if row_id not in found_ids:
+            # Adding to found_ids keeps repeated ids out of the result.
+            found_ids.add(row_id)
+            not_found_ids.append(row_id)
+    found_ids.difference_update(not_found_ids)
+
+    return sorted(found_ids), not_found_ids
+
+
+def update_rows(model, ids, values):
+    if not values:
+        return
+    for batch in get_batches(ids):
+        db.session.execute(model.__table__.update().where(model.id.in_(batch)).values(values))
+
+
+def delete_rows(model, ids):
+    for batch in get_batches(ids):
+        db.session.execute(model.__table__.delete().where(model.id.in_(batch)))
+
+
+def add_user(user_json):
+    # The password is hashed on the calling thread, so the PBKDF2 rounds never hold up the writer.
+    return insert_user(user_json, User.hash_password(user_json["password"]))
+
+
+@write_queue.job
+def insert_user(user_json, password_hash):
+    use_primary()
+    user = User(email=user_json["email"], username=user_json["username"], password_hash=password_hash)
+
+    db.session.add(user)
+    commit()
+    notify_users_changed([user.id])
+
+    return user
+
+
+@write_queue.job
+def confirm_user(user_id, token):
+    use_primary()
+    user = load_user(user_id)
+    if user is None or not user.confirm(token):
+        return False
+
+    db.session.add(user)
+    commit()
+    notify_users_changed([user.id])
+
+    return True
+
+
 def get_user(user_id):
+    return entity_cache.get(User, user_id)
+
+
+def load_user(user_id):
     return User.query.filter_by(id=user_id).first()
 
 
@@ -81,6 +489,22 @@ def get_all_users():
     return User.query.all()
 
 
+def get_users_page(limit, after_id=None, fields=None):
+    query_obj = load_fields(User.query, User, fields).order_by(User.id)
+    if after_id is not None:
+        query_obj = query_obj.filter(User.id > after_id)
+
+    return query_obj.limit(limit).all()
+
+
+def iter_users(chunk_size, fields=None):
+    return load_fields(User.query, User, fields).order_by(User.id).yield_per(chunk_size)
+
+
+def get_user_by_email(email):
+    return User.query.filter_by(email=email).first()
+
+
 def get_users_by_filter(username=None, email=None):
     query_obj = User.query
     if username is not None:
@@ -92,18 +516,57 @@ def get_users_by_filter(username=None, email=None):
     return query_obj.all()
 
 
+@write_queue.job
 def remove_user(user_id):
-    user = get_user(user_id)
+    use_primary()
+    if supports_returning():
+        user = execute_returning(User, "DELETE FROM users WHERE id = :id", id=user_id)
+        if user is None:
+            return None
+        revoke_tokens([user_id])
+        commit()
+        notify_users_changed([user_id])
+
+        return user
+
+    user = load_user(user_id)
     if user is None:
         return None
     db.session.delete(user)
-    db.session.commit()
+    revoke_tokens([user_id])
+    commit()
+    notify_users_changed([user_id])
 
     return user
 
 
 def update_user(user_id, user_json):
-    user = get_user(user_id)
+    # The password is hashed on the calling thread, so the PBKDF2 rounds never hold up the writer.
+    password_hash = User.hash_password(user_json["password"]) if "password" in user_json else None
+    return write_user_update(user_id, user_json, password_hash)
+
+
+@write_queue.job
+def write_user_update(user_id, user_json, password_hash):
+    use_primary()
+    values = get_values(user_json, ("username", "email"))
+    if password_hash is not None:
+        # Requires re-confirmation of account.
+        values["password_hash"] = password_hash
+        values["confirmed"] = False
+    if supports_returning() and values:
+        user = execute_returning(User, "UPDATE users SET %s WHERE id = :id" % get_assignments(values),
+                                 id=user_id, **values)
+        if user is None:
+            return None
+        if password_hash is not None:
+            revoke_tokens([user.id])
+        commit()
+        notify_users_changed([user.id])
+
+        return user
+
+    user = load_user(user_id)
     if user is None:
         return None
 
@@ -111,12 +574,99 @@ def update_user(user_id, user_json):
         user.username = user_json["username"]
     if "email" in user_json:
         user.email = user_json["email"]
-    if "password" in user_json:
+    if password_hash is not None:
         # Requires re-confirmation of account.
-        user.password = user_json["password"]
+        user.password_hash = password_hash
         user.confirmed = False
+        revoke_tokens([user.id])
 
     db.session.add(user)
-    db.session.commit()
+    commit()
+    notify_users_changed([user.id])
 
     return user
+
+
+def revoke_tokens(user_ids):
+    # Raises the token epoch of every user, in the caller's transaction. Each row takes the next seq.
+    if not user_ids:
+        return
+    params = [{"user_id": user_id} for user_id in user_ids]
+    db.session.execute(text("INSERT OR IGNORE INTO token_epochs (user_id, epoch, seq) VALUES (:user_id, 0, 0)"),
+                       params)
+    db.session.execute(text("UPDATE token_epochs SET epoch = epoch + 1, "
+                            "seq = (SELECT MAX(seq) FROM token_epochs) + 1 WHERE user_id = :user_id"), params)
+    # Refresh tokens would hand out new access tokens at the new epoch.
+    for batch in get_batches(user_ids):
+        RefreshToken.query.filter(RefreshToken.user_id.in_(batch)).delete(synchronize_session=False)
+
+
+@write_queue.job
+def add_refresh_token(user_id, token_hash, family, expires_at):
+    use_primary()
+    # The user's expired tokens are dropped here, so the table only grows with its active users.
+    RefreshToken.query.filter(RefreshToken.user_id == user_id, RefreshToken.expires_at < datetime.utcnow()).delete(
+        synchronize_session=False)
+    db.session.add(RefreshToken(token_hash=token_hash, user_id=user_id, family=family, expires_at=expires_at))
+    commit()
+
+
+@write_queue.job
+def use_refresh_token(token_hash, new_token_hash, expires_at):
+    # Replaces a refresh token with the next one of its family. Returns the id of its confirmed user, or None
+    # for a token that is unknown, expired or used before. A used one revokes every token of its family.
+    use_primary()
+    refresh_token = RefreshToken.query.filter_by(token_hash=token_hash).first()
+    if refresh_token is None or refresh_token.expires_at < datetime.utcnow():
+        return None
+
+    user = load_user(refresh_token.user_id)
+    # Marked used only if nobody else has, so of two concurrent refreshes with the same token only one succeeds.
+    claimed = db.session.execute(text("UPDATE refresh_tokens SET used = 1 WHERE id = :id AND used = 0"),
+                                 {"id": refresh_token.id}).rowcount
+    if not claimed or user is None or not user.confirmed:
+        RefreshToken.query.filter_by(family=refresh_token.family).delete(synchronize_session=False)
+        commit()
+        return None
+
+    db.session.add(RefreshToken(token_hash=new_token_hash, user_id=user.id, family=refresh_token.family,
+                                expires_at=expires_at))
+    commit()
+
+    return user.id
+
+
+def get_token_epochs(after_seq):
+    # Returns [(user_id, epoch, seq)] for the epochs changed after seq, oldest first. Read from the primary on
+    # a connection of its own, so authorizing a request neither pins its session to the primary nor sees a
+    # replica that is behind.
+    table = TokenEpoch.__table__
+    statement = db.select([table.c.user_id, table.c.epoch, table.c.seq]).where(table.c.seq > after_seq)
+    with db.engine.connect() as connection:
+        return connection.execute(statement.order_by(table.c.seq)).fetchall()
+
+
+@write_queue.job
+def update_users(user_json, user_ids=None, username=None, email=None):
+    use_primary()
+    updated_ids, not_found_ids = get_target_ids(User, user_ids, username=username, email=email)
+    update_rows(User, updated_ids, user_json)
+    if "confirmed" in user_json:
+        # Tokens carry the confirmed flag they were issued with.
+        revoke_tokens(updated_ids)
+    commit()
+    notify_users_changed(updated_ids)
+
+    return updated_ids, not_found_ids
+
+
+@write_queue.job
+def remove_users(user_ids=None, username=None, email=None):
+    use_primary()
+    removed_ids, not_found_ids = get_target_ids(User, user_ids, username=username, email=email)
+    delete_rows(User, removed_ids)
+    revoke_tokens(removed_ids)
+    commit()
+    notify_users_changed(removed_ids)
+
+    return removed_ids, not_found_ids
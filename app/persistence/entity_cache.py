@@ -0,0 +1,76 @@
+from flask import current_app
+from sqlalchemy.orm import object_mapper, make_transient_to_detached
+
+from ..cache import LRUCache
+from .models import Book, User
+from .signals import books_changed, users_changed
+from . import db
+
+
+class EntityCache(object):
+    """
+    Per app LRU caches of books and users by id, consulted by db_util.get_book and db_util.get_user.
+
+    Misses are cached as None, so repeated lookups of missing ids do not reach the database. The cache holds
+    detached copies, and every hit is merged into the current session without a query. Entries are dropped
+    for the ids sent with books_changed and users_changed.
+    """
+
+    def __init__(self, app=None):
+        books_changed.connect(self.on_books_changed)
+        users_changed.connect(self.on_users_changed)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        size = app.config["ENTITY_CACHE_SIZE"]
+        ttl = app.config["ENTITY_CACHE_TTL"]
+        app.extensions["entity_cache"] = {
+            Book: LRUCache(size, ttl),
+            User: LRUCache(size, ttl)
+        }
+
+    def get(self, model, row_id):
+        cache = current_app.extensions["entity_cache"][model]
+        hit, instance = cache.get(row_id)
+        if hit:
+            return db.session.merge(instance, load=False) if instance is not None else None
+
+        invalidations = cache.invalidations
+        instance = model.query.filter_by(id=row_id).first()
+        cache.add(row_id, get_detached_copy(instance), invalidations)
+        return instance
+
+    def stats(self):
+        caches = current_app.extensions["entity_cache"]
+        return {
+            "books": caches[Book].stats(),
+            "users": caches[User].stats()
+        }
+
+    def on_books_changed(self, app, ids=None, **kwargs):
+        self.invalidate(app, Book, ids)
+
+    def on_users_changed(self, app, ids=None, **kwargs):
+        self.invalidate(app, User, ids)
+
+    def invalidate(self, app, model, ids):
+        cache = app.extensions["entity_cache"][model]
+        if ids is None:
+            cache.clear()
+            return
+        for row_id in ids:
+            cache.invalidate(row_id)
+
+
+def get_detached_copy(instance):
+    # A copy that no session knows about, so commits and session removal never expire the cached state.
+    if instance is None:
+        return None
+    mapper = object_mapper(instance)
+    copy = mapper.class_()
+    for column_property in mapper.column_attrs:
+        setattr(copy, column_property.key, getattr(instance, column_property.key))
+    make_transient_to_detached(copy)
+
+    return copy
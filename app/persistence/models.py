@@ -1,9 +1,13 @@
+import hashlib
+from datetime import datetime
+
 from flask import json, url_for, current_app
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+from sqlalchemy import event, DDL, FetchedValue
 
 from . import db
+from ..hashing import hashing
 
 
 class Book(db.Model):
@@ -12,23 +16,99 @@ class Book(db.Model):
     book_name = db.Column(db.String, nullable=False, unique=True, index=True)
     author_name = db.Column(db.String, default="")
     comments = db.Column(db.Text, default="")
+    # Set by every write. Statements written as raw SQL have to set it themselves.
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # Position in the change feed, assigned by triggers on every insert and update. Instances can hold the value
+    # from before the triggers ran, so the change feed always reads it from the database.
+    change_seq = db.Column(db.Integer, index=True, server_default=FetchedValue(), server_onupdate=FetchedValue())
 
     def __repr__(self):
         return "<Book %s>" % self.name
 
-    def to_json(self):
-        book_dict = {
-            "url": url_for("api_blueprint.get_book", book_id=self.id, _external=True),
-            "id": self.id,
-            "book_name": self.book_name,
-            "author_name": self.author_name,
-            "comments": self.comments
-        }
-        json_data = json.dumps(book_dict)
+    # Fields a client can select with ?fields=. url is built from id.
+    FIELDS = ("url", "id", "book_name", "author_name", "comments")
+
+    def to_dict(self, fields=None):
+        # Only the selected fields are read, so columns deferred by the query are never loaded.
+        book_dict = {}
+        for field in fields or Book.FIELDS:
+            if field == "url":
+                book_dict["url"] = url_for("api_blueprint.get_book", book_id=self.id, _external=True)
+            else:
+                book_dict[field] = getattr(self, field)
+
+        return book_dict
+
+    def to_json(self, fields=None):
+        json_data = json.dumps(self.to_dict(fields))
 
         return json_data
 
 
+# Full text index over books. It is an external content FTS5 table, so the text is stored once in books and
+# the triggers keep the index in sync with every insert, update and delete, including bulk statements.
+BOOKS_FTS_DDL = [
+    "CREATE VIRTUAL TABLE books_fts USING fts5(book_name, author_name, comments, content='books', content_rowid='id')",
+    "CREATE TRIGGER books_fts_insert AFTER INSERT ON books BEGIN "
+    "INSERT INTO books_fts(rowid, book_name, author_name, comments) "
+    "VALUES (new.id, new.book_name, new.author_name, new.comments); END",
+    "CREATE TRIGGER books_fts_delete AFTER DELETE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, book_name, author_name, comments) "
+    "VALUES ('delete', old.id, old.book_name, old.author_name, old.comments); END",
+    "CREATE TRIGGER books_fts_update AFTER UPDATE OF book_name, author_name, comments ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, book_name, author_name, comments) "
+    "VALUES ('delete', old.id, old.book_name, old.author_name, old.comments); "
+    "INSERT INTO books_fts(rowid, book_name, author_name, comments) "
+    "VALUES (new.id, new.book_name, new.author_name, new.comments); END"
+]
+
+for statement in BOOKS_FTS_DDL:
+    event.listen(Book.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Book.__table__, "after_drop", DDL("DROP TABLE IF EXISTS books_fts").execute_if(dialect="sqlite"))
+
+
+class BookTombstone(db.Model):
+    # Left behind by every deleted book, so the change feed can report deletes until they are compacted.
+    __tablename__ = "book_tombstones"
+    change_seq = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    book_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class ChangeSequence(db.Model):
+    # Named counters. "books" is the last change_seq handed out, and "book_tombstones_horizon" the highest
+    # change_seq whose tombstone may already be compacted away.
+    __tablename__ = "change_sequences"
+    name = db.Column(db.String, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Every insert, update and delete of a book takes the next number of the books sequence, whichever way it is
+# written, and a delete records it in a tombstone. Created once all three tables exist. DDL strings are
+# %-formatted, hence the doubled percent signs.
+CHANGE_SEQ_DDL = [
+    "INSERT OR IGNORE INTO change_sequences (name, value) VALUES ('books', 0)",
+    "INSERT OR IGNORE INTO change_sequences (name, value) VALUES ('book_tombstones_horizon', 0)",
+    "CREATE TRIGGER IF NOT EXISTS books_change_seq_insert AFTER INSERT ON books BEGIN "
+    "UPDATE change_sequences SET value = value + 1 WHERE name = 'books'; "
+    "UPDATE books SET change_seq = (SELECT value FROM change_sequences WHERE name = 'books') "
+    "WHERE id = new.id; END",
+    "CREATE TRIGGER IF NOT EXISTS books_change_seq_update "
+    "AFTER UPDATE OF book_name, author_name, comments, updated_at ON books BEGIN "
+    "UPDATE change_sequences SET value = value + 1 WHERE name = 'books'; "
+    "UPDATE books SET change_seq = (SELECT value FROM change_sequences WHERE name = 'books') "
+    "WHERE id = new.id; END",
+    "CREATE TRIGGER IF NOT EXISTS books_change_seq_delete AFTER DELETE ON books BEGIN "
+    "UPDATE change_sequences SET value = value + 1 WHERE name = 'books'; "
+    "INSERT INTO book_tombstones (change_seq, book_id, deleted_at) "
+    "VALUES ((SELECT value FROM change_sequences WHERE name = 'books'), old.id, "
+    "strftime('%%Y-%%m-%%d %%H:%%M:%%S', 'now') || '.000000'); END"
+]
+
+for statement in CHANGE_SEQ_DDL:
+    event.listen(db.metadata, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+
+
 class User(UserMixin, db.Model):
     __tablename__ = "users"
     id = db.Column(db.Integer, primary_key=True)
@@ -43,18 +123,26 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = User.hash_password(password)
+
+    @staticmethod
+    def hash_password(password):
+        return hashing.generate(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hashing.check(self.password_hash, password)
 
     def generate_confirmation_token(self):
         serializer = Serializer(current_app.config["SECRET_KEY"], 3600) #Token expires in one hour
         return serializer.dumps({"confirm": self.id})
 
-    def generate_auth_token(self):
-        serializer = Serializer(current_app.config["SECRET_KEY"], 3600)  # Token expires in one hour
-        return serializer.dumps({"token": self.id})
+    def generate_auth_token(self, epoch=None, expiration=3600):
+        # Carries everything token authorization checks, so verifying it needs no user lookup. A token is revoked
+        # by raising the user's epoch past the one it was issued with.
+        if epoch is None:
+            epoch = TokenEpoch.get_epoch(self.id)
+        serializer = Serializer(current_app.config["SECRET_KEY"], expiration)
+        return serializer.dumps({"uid": self.id, "confirmed": self.confirmed, "epoch": epoch})
 
     def confirm(self, token):
         status = True
@@ -79,22 +167,59 @@ class User(UserMixin, db.Model):
         except:
             return None
 
-        return User.query.get(data["token"])
+        # Tokens issued before epochs carry only the id, under "token".
+        user = User.query.get(data["uid"] if "uid" in data else data["token"])
+        if user is not None and "epoch" in data and data["epoch"] != TokenEpoch.get_epoch(user.id):
+            return None
+        return user
 
     def __repr__(self):
         return "<User %s>" % self.username
 
-    def to_dict(self):
-        user_dict = {
-            "url": url_for("api_blueprint.get_user", user_id=self.id, _external=True),
-            "id": self.id,
-            "email": self.email,
-            "username": self.username,
-            "confirmed": self.confirmed,
-        }
+    # Fields a client can select with ?fields=. url is built from id.
+    FIELDS = ("url", "id", "email", "username", "confirmed")
+
+    def to_dict(self, fields=None):
+        user_dict = {}
+        for field in fields or User.FIELDS:
+            if field == "url":
+                user_dict["url"] = url_for("api_blueprint.get_user", user_id=self.id, _external=True)
+            else:
+                user_dict[field] = getattr(self, field)
 
         return user_dict
 
-    def to_json(self):
-        json_data = json.dumps(self.to_dict())
+    def to_json(self, fields=None):
+        json_data = json.dumps(self.to_dict(fields))
         return json_data
+
+
+class TokenEpoch(db.Model):
+    # Raised whenever a user's auth tokens have to stop working. Users without a row are at epoch 0. Rows outlive
+    # their user, so tokens of a deleted user stay revoked even if SQLite hands the id out again.
+    __tablename__ = "token_epochs"
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    epoch = db.Column(db.Integer, nullable=False, default=0)
+    # Increases with every change to the table, so the epochs held in memory are refreshed by reading past it.
+    seq = db.Column(db.Integer, nullable=False, index=True)
+
+    @staticmethod
+    def get_epoch(user_id):
+        return db.session.query(TokenEpoch.epoch).filter_by(user_id=user_id).scalar() or 0
+
+
+class RefreshToken(db.Model):
+    # Only the hash of a refresh token is stored. Every refresh replaces the token with a new one of the same
+    # family, and a token presented twice revokes its whole family.
+    __tablename__ = "refresh_tokens"
+    id = db.Column(db.Integer, primary_key=True)
+    token_hash = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    family = db.Column(db.String(32), nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    used = db.Column(db.Boolean, nullable=False, default=False)
+
+    @staticmethod
+    def hash_token(token):
+        # Refresh tokens are random, so an unsalted fast hash is enough to keep them out of the database.
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
@@ -0,0 +1,80 @@
+import itertools
+import os
+import sqlite3
+import threading
+
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that reads from the app's read replicas, when it has any, and writes to the primary.
+
+    Flushes always go to the primary. Once db_util.use_primary has marked the session, which every write path
+    does, its reads go to the primary too, so a request reads its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.extensions.get("read_replicas")
+        if replicas is not None and not self._flushing and not self.info.get("use_primary"):
+            return replicas.choose()
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+
+class ReadReplicas(object):
+    """Engines for the SQLALCHEMY_REPLICA_URIS of an app, handed out round robin."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from .sqlite_tuning import SQLiteTuning
+
+        uris = app.config["SQLALCHEMY_REPLICA_URIS"]
+        if not uris:
+            app.extensions["read_replicas"] = None
+            return
+
+        engines = []
+        for uri in uris:
+            engine = create_engine(uri)
+            if engine.dialect.name == "sqlite" and app.config["SQLITE_PRAGMAS"]:
+                SQLiteTuning.listen(engine, app.config["SQLITE_PRAGMAS"])
+            engines.append(engine)
+        app.extensions["read_replicas"] = ReplicaPool(engines)
+
+
+class ReplicaPool(object):
+    def __init__(self, engines):
+        self.engines = engines
+        self.lock = threading.Lock()
+        self.cycle = itertools.cycle(engines)
+
+    def choose(self):
+        with self.lock:
+            return next(self.cycle)
+
+
+def sync_sqlite_replica(primary_uri, replica_uri):
+    # Copies the primary into a temporary file next to the replica and renames it into place, so readers
+    # see either the old copy or the new one. New connections pick up the new file.
+    primary_path = make_url(primary_uri).database
+    replica_path = make_url(replica_uri).database
+    temp_path = replica_path + ".sync"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    connection = sqlite3.connect(primary_path)
+    try:
+        connection.execute("VACUUM INTO ?", (temp_path,))
+    finally:
+        connection.close()
+    os.rename(temp_path, replica_path)
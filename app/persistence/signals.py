@@ -0,0 +1,10 @@
+from blinker import Namespace
+
+
+_signals = Namespace()
+
+# Sent by the db_util write functions once a write is committed, with the app as sender.
+# ids is the list of changed row ids, or None when any row may have changed. remote is True when the
+# change was made by another worker process and has only just been noticed.
+books_changed = _signals.signal("books-changed")
+users_changed = _signals.signal("users-changed")
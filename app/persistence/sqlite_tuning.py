@@ -0,0 +1,35 @@
+from sqlalchemy import event
+
+from . import db
+
+
+class SQLiteTuning(object):
+    """
+    Runs the PRAGMA statements in SQLITE_PRAGMAS on every new connection of the app's engine.
+
+    SQLITE_PRAGMAS is a list of (name, value) pairs, applied in order, so journal_mode can come first.
+    Engines for other databases are left alone.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        pragmas = app.config["SQLITE_PRAGMAS"]
+        if not pragmas:
+            return
+        engine = db.get_engine(app)
+        if engine.dialect.name != "sqlite":
+            return
+        self.listen(engine, pragmas)
+
+    @staticmethod
+    def listen(engine, pragmas):
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas:
+                cursor.execute("PRAGMA %s = %s" % (name, value))
+            cursor.close()
+
+        event.listen(engine, "connect", set_pragmas)
@@ -0,0 +1,212 @@
+import bisect
+import threading
+
+from flask import current_app
+
+from .models import Book, ChangeSequence
+from .signals import books_changed
+from . import db
+
+
+# Changes read from the change feed per query when the index catches up.
+CATCH_UP_BATCH_SIZE = 1000
+
+# Entries per block of the prefix index. A block is split in two once it holds twice as many.
+BLOCK_SIZE = 1000
+
+
+class PrefixIndex(object):
+    """
+    In-memory prefix index over book names and author names.
+
+    Entries are sorted (key, value, field, book_id) tuples, where key is the lower cased value, so a lookup is
+    a bisect to the first key with the prefix followed by a short scan. They are split into sorted blocks of
+    about BLOCK_SIZE, with maxes holding the last entry of each block, so an insert or a delete moves the
+    entries of one block and not the whole index. Every author has one entry however many books they wrote,
+    and author_counts tracks when it can be dropped. change_seq is the point in the change feed the index has
+    caught up to.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held while the index catches up, so changes are applied in feed order.
+        self.catch_up_lock = threading.Lock()
+        self.blocks = []
+        self.maxes = []
+        self.books = {}
+        self.author_counts = {}
+        self.change_seq = 0
+        self.built = False
+
+    def build(self, rows, change_seq):
+        entries = []
+        books = {}
+        author_counts = {}
+        for book_id, book_name, author_name in rows:
+            books[book_id] = (book_name, author_name)
+            entries.append((book_name.lower(), book_name, "book_name", book_id))
+            if author_name:
+                if author_name not in author_counts:
+                    entries.append((author_name.lower(), author_name, "author_name", None))
+                author_counts[author_name] = author_counts.get(author_name, 0) + 1
+        entries.sort()
+        blocks = [entries[start:start + BLOCK_SIZE] for start in range(0, len(entries), BLOCK_SIZE)]
+
+        with self.lock:
+            self.blocks = blocks
+            self.maxes = [block[-1] for block in blocks]
+            self.books = books
+            self.author_counts = author_counts
+            self.change_seq = change_seq
+            self.built = True
+
+    def add(self, book_id, book_name, author_name):
+        with self.lock:
+            self._remove(book_id)
+            self.books[book_id] = (book_name, author_name)
+            self._insert_entry((book_name.lower(), book_name, "book_name", book_id))
+            if author_name:
+                if author_name not in self.author_counts:
+                    self._insert_entry((author_name.lower(), author_name, "author_name", None))
+                self.author_counts[author_name] = self.author_counts.get(author_name, 0) + 1
+
+    def remove(self, book_id):
+        with self.lock:
+            self._remove(book_id)
+
+    def advance(self, change_seq):
+        with self.lock:
+            self.change_seq = max(self.change_seq, change_seq)
+
+    def _remove(self, book_id):
+        if book_id not in self.books:
+            return
+        book_name, author_name = self.books.pop(book_id)
+        self._remove_entry((book_name.lower(), book_name, "book_name", book_id))
+        if author_name:
+            self.author_counts[author_name] -= 1
+            if self.author_counts[author_name] == 0:
+                del self.author_counts[author_name]
+                self._remove_entry((author_name.lower(), author_name, "author_name", None))
+
+    def _insert_entry(self, entry):
+        if not self.blocks:
+            self.blocks.append([entry])
+            self.maxes.append(entry)
+            return
+        # The first block whose last entry is not below this one, or the last block for a new largest entry.
+        index = min(bisect.bisect_left(self.maxes, entry), len(self.blocks) - 1)
+        block = self.blocks[index]
+        bisect.insort(block, entry)
+        self.maxes[index] = block[-1]
+        if len(block) > 2 * BLOCK_SIZE:
+            self.blocks[index:index + 1] = [block[:BLOCK_SIZE], block[BLOCK_SIZE:]]
+            self.maxes[index:index + 1] = [block[BLOCK_SIZE - 1], block[-1]]
+
+    def _remove_entry(self, entry):
+        index = bisect.bisect_left(self.maxes, entry)
+        if index == len(self.blocks):
+            return
+        block = self.blocks[index]
+        position = bisect.bisect_left(block, entry)
+        if position < len(block) and block[position] == entry:
+            del block[position]
+            if block:
+                self.maxes[index] = block[-1]
+            else:
+                del self.blocks[index]
+                del self.maxes[index]
+
+    def lookup(self, prefix, limit):
+        key = prefix.lower()
+        results = []
+        with self.lock:
+            index = bisect.bisect_left(self.maxes, (key,))
+            position = bisect.bisect_left(self.blocks[index], (key,)) if index < len(self.blocks) else 0
+            while index < len(self.blocks) and len(results) < limit:
+                block = self.blocks[index]
+                if position == len(block):
+                    index += 1
+                    position = 0
+                    continue
+                entry_key, value, field, book_id = block[position]
+                if not entry_key.startswith(key):
+                    break
+                results.append((value, field, book_id))
+                position += 1
+
+        return results
+
+
+class BookSuggest(object):
+    """Keeps one PrefixIndex per app, built on the first request and updated from books_changed."""
+
+    def __init__(self, app=None):
+        books_changed.connect(self.on_books_changed)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["book_suggest"] = PrefixIndex()
+        app.before_first_request(self.build)
+
+    def get_index(self, app=None):
+        return (app or current_app).extensions["book_suggest"]
+
+    def build(self):
+        # The sequence is read first, so changes that land during the scan are applied again by the next catch up.
+        change_seq = db.session.query(ChangeSequence.value).filter_by(name="books").scalar() or 0
+        rows = db.session.query(Book.id, Book.book_name, Book.author_name).yield_per(1000)
+        self.get_index().build(rows, change_seq)
+
+    def suggest(self, prefix, limit):
+        index = self.get_index()
+        if not index.built:
+            self.build()
+        return index.lookup(prefix, limit)
+
+    def on_books_changed(self, app, ids=None, remote=False, **kwargs):
+        index = app.extensions.get("book_suggest")
+        if index is None or not index.built:
+            return
+        if remote:
+            self.catch_up(index)
+            return
+        if ids is None:
+            self.build()
+            return
+
+        # Imported on use, because db_util imports this package's extension instances, and this module is loaded
+        # before they exist.
+        from .db_util import get_batches
+
+        # Changed rows are read back by id; ids that are gone were deleted.
+        found_ids = set()
+        for batch in get_batches(ids):
+            query_obj = db.session.query(Book.id, Book.book_name, Book.author_name).filter(Book.id.in_(batch))
+            for book_id, book_name, author_name in query_obj:
+                found_ids.add(book_id)
+                index.add(book_id, book_name, author_name)
+        for book_id in ids:
+            if book_id not in found_ids:
+                index.remove(book_id)
+
+    def catch_up(self, index):
+        # Applies the changes of other workers from the change feed, so their writes cost a read of what changed
+        # instead of a rebuild. Only when the feed has been compacted past the index is it built again.
+        from .db_util import get_book_changes
+
+        with index.catch_up_lock:
+            more = True
+            while more:
+                changes, cursor, more = get_book_changes(index.change_seq, CATCH_UP_BATCH_SIZE,
+                                                         ("id", "book_name", "author_name"))
+                if changes is None:
+                    self.build()
+                    return
+                for change_seq, book_id, book in changes:
+                    if book is None:
+                        index.remove(book_id)
+                    else:
+                        index.add(book_id, book.book_name, book.author_name)
+                index.advance(cursor)
@@ -0,0 +1,202 @@
+import functools
+import os
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+
+from . import db
+
+
+class WriteJob(object):
+    def __init__(self, function, args, kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class WriteQueue(object):
+    """
+    Runs the db_util write functions of an app on one writer thread, with group commit.
+
+    Request threads put jobs on a queue and wait. The writer takes the jobs that arrive within
+    WRITE_QUEUE_WINDOW seconds of the first one, up to WRITE_QUEUE_MAX_BATCH, runs them in one transaction and
+    commits once. Inside a batch, db_util.commit only flushes and after_commit callbacks wait for the real
+    commit. When a job fails the batch is rolled back and every job is run again on its own, so one bad job
+    does not fail the others. "database is locked" errors are retried with exponential backoff, also when
+    the queue is disabled. A caller waits at most WRITE_QUEUE_TIMEOUT seconds for its job.
+
+    The writer session does not expire objects on commit, and the objects are detached before being handed
+    back to the request threads.
+    """
+
+    def __init__(self, app=None):
+        self.local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["write_queue"] = {
+            "enabled": app.config["WRITE_QUEUE_ENABLED"],
+            "queue": queue.Queue(),
+            "lock": threading.Lock(),
+            "thread": None,
+            "pid": None,
+            "stats": {"jobs": 0, "batches": 0, "retries": 0, "max_depth": 0, "batch_sizes": {}}
+        }
+
+    def job(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            state = current_app.extensions["write_queue"]
+            if not state["enabled"] or getattr(self.local, "in_writer", False):
+                return self.run_with_retry(function, args, kwargs)
+
+            self.ensure_writer(state)
+            job = WriteJob(function, args, kwargs)
+            state["queue"].put(job)
+            depth = state["queue"].qsize()
+            if depth > state["stats"]["max_depth"]:
+                state["stats"]["max_depth"] = depth
+            if not job.done.wait(current_app.config["WRITE_QUEUE_TIMEOUT"]):
+                # The job may still run later. The caller only learns that it did not finish in time.
+                raise RuntimeError("Write queue job did not finish within %s seconds." %
+                                   current_app.config["WRITE_QUEUE_TIMEOUT"])
+            # Like a commit on this thread would: later reads go to the primary and see the new rows.
+            db.session.info["use_primary"] = True
+            db.session.expire_all()
+            if job.error is not None:
+                raise job.error
+            return job.result
+
+        return wrapper
+
+    def in_batch(self):
+        return getattr(self.local, "callbacks", None) is not None
+
+    def after_commit(self, callback):
+        if self.in_batch():
+            self.local.callbacks.append(callback)
+        else:
+            callback()
+
+    def run_with_retry(self, function, args, kwargs):
+        delay = current_app.config["WRITE_RETRY_DELAY"]
+        for attempt in range(current_app.config["WRITE_RETRIES"] + 1):
+            try:
+                return function(*args, **kwargs)
+            except OperationalError as error:
+                db.session.rollback()
+                if "database is locked" not in str(error) or attempt == current_app.config["WRITE_RETRIES"]:
+                    raise
+                current_app.extensions["write_queue"]["stats"]["retries"] += 1
+                time.sleep(delay)
+                delay *= 2
+
+    def ensure_writer(self, state):
+        with state["lock"]:
+            # Threads do not survive a fork, so every worker process starts its own writer.
+            if state["thread"] is not None and state["thread"].is_alive() and state["pid"] == os.getpid():
+                return
+            thread = threading.Thread(target=self.write_loop, args=(current_app._get_current_object(), state))
+            thread.daemon = True
+            thread.start()
+            state["thread"] = thread
+            state["pid"] = os.getpid()
+
+    def write_loop(self, app, state):
+        self.local.in_writer = True
+        with app.app_context():
+            db.session().expire_on_commit = False
+            while True:
+                batch = self.get_batch(app, state)
+                try:
+                    self.write_batch(batch)
+                except Exception as error:
+                    # Whatever escapes, a failing rollback included, must neither stop the writer nor leave a
+                    # caller waiting. The session is replaced, since its state is unknown.
+                    app.logger.exception("Write queue batch failed.")
+                    for job in batch:
+                        if not job.done.is_set():
+                            job.error = error
+                            job.done.set()
+                    db.session.remove()
+                    db.session().expire_on_commit = False
+
+    def write_batch(self, batch):
+        try:
+            self.run_batch(batch)
+        except Exception as error:
+            # The batch was rolled back, so each job gets its own transaction and its own error.
+            db.session.rollback()
+            if len(batch) == 1:
+                self.finish(batch, error)
+                return
+            for job in batch:
+                try:
+                    self.run_batch([job])
+                except Exception as job_error:
+                    db.session.rollback()
+                    self.finish([job], job_error)
+
+    def get_batch(self, app, state):
+        batch = [state["queue"].get()]
+        deadline = time.time() + app.config["WRITE_QUEUE_WINDOW"]
+        while len(batch) < app.config["WRITE_QUEUE_MAX_BATCH"]:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(state["queue"].get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run_batch(self, batch):
+        def run_jobs():
+            self.local.callbacks = []
+            try:
+                for job in batch:
+                    job.result = job.function(*job.args, **job.kwargs)
+                db.session.commit()
+                return self.local.callbacks
+            finally:
+                self.local.callbacks = None
+
+        callbacks = self.run_with_retry(run_jobs, (), {})
+        for callback in callbacks:
+            # The batch is committed by now, so a failing callback must not fail its jobs.
+            try:
+                callback()
+            except Exception:
+                current_app.logger.exception("After commit callback failed.")
+
+        stats = current_app.extensions["write_queue"]["stats"]
+        stats["jobs"] += len(batch)
+        stats["batches"] += 1
+        stats["batch_sizes"][len(batch)] = stats["batch_sizes"].get(len(batch), 0) + 1
+        self.finish(batch, None)
+
+    def finish(self, batch, error):
+        db.session.expunge_all()
+        for job in batch:
+            job.error = error
+            job.done.set()
+
+    def stats(self):
+        state = current_app.extensions["write_queue"]
+        stats = dict(state["stats"])
+        stats["enabled"] = state["enabled"]
+        stats["depth"] = state["queue"].qsize()
+        stats["batch_sizes"] = dict(state["stats"]["batch_sizes"])
+        return stats
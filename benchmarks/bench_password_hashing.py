@@ -0,0 +1,76 @@
+"""
+Throughput of concurrent HTTP Basic logins with passwords hashed on the request threads and in the
+password hashing pool. The pool can only do better with more cores than the one the request threads share.
+
+Usage: python -m benchmarks.bench_password_hashing [seconds] [threads] [pool size] [method]
+"""
+import base64
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+
+def run(app, seconds, threads):
+    from flask import url_for
+
+    with app.test_request_context():
+        url = url_for("api_auth_blueprint.test_auth_token")
+    headers = {"Authorization": "Basic " + base64.b64encode("email:password")}
+    counts = [0] * threads
+    deadline = time.time() + seconds
+
+    def login(index):
+        client = app.test_client()
+        while time.time() < deadline:
+            response = client.get(url, headers=headers)
+            assert response.status_code == 200
+            counts[index] += 1
+
+    workers = [threading.Thread(target=login, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / float(seconds)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    pool_size = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    method = sys.argv[4] if len(sys.argv) > 4 else "pbkdf2:sha256:10000"
+
+    directory = tempfile.mkdtemp()
+    # Read by TestingConfig when the app package is imported.
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(directory, "bench.sqlite")
+    from app import create_app
+    from app.hashing import hashing
+    from app.persistence import db, db_util
+
+    try:
+        for size in (0, pool_size):
+            app = create_app("testing")
+            app.config["PASSWORD_HASH_POOL_SIZE"] = size
+            app.config["PASSWORD_HASH_METHOD"] = method
+            hashing.init_app(app)
+            with app.app_context():
+                db.create_all()
+                user = db_util.add_user({"email": "email", "username": "username", "password": "password"})
+                db_util.update_users({"confirmed": True}, [user.id])
+                db.session.remove()
+
+            logins = run(app, seconds, threads)
+            print("pool size %d, %d threads, %s: %8.1f logins/s" % (size, threads, method, logins))
+
+            with app.app_context():
+                db.drop_all()
+            hashing.close(app)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
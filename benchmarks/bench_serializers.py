@@ -0,0 +1,36 @@
+"""
+Encoding cost of a page of books with the version 1 to_json serialization and the version 2 serializer.
+
+Usage: python -m benchmarks.bench_serializers [rows] [repeats]
+"""
+import sys
+import timeit
+
+from app import create_app
+from app.api import serializers
+from app.persistence.models import Book
+
+
+def make_books(rows):
+    return [Book(id=i + 1, book_name="book_%d" % i, author_name="author_%d" % (i % 100), comments="comments " * 20)
+            for i in range(rows)]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    app = create_app("testing")
+    books = make_books(rows)
+    print("json backend: %s" % ("orjson" if serializers.orjson else "ujson" if serializers.ujson else "flask.json"))
+    with app.test_request_context():
+        for version, serializer_class in sorted(serializers.SERIALIZERS.items()):
+            def encode():
+                serializer_class(Book).encode_collection("books", books, None)
+
+            seconds = min(timeit.repeat(encode, number=1, repeat=repeats))
+            print("v%d  %6d rows: %8.2f ms  %10.0f rows/s" % (version, rows, seconds * 1000, rows / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Mixed read/write throughput of the books table with SQLite's default settings and with the
+production SQLITE_PRAGMAS profile.
+
+Usage: python -m benchmarks.bench_sqlite_pragmas [seconds] [readers]
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from config import ProductionConfig
+
+
+ROWS = 20000
+
+
+def create_database(path):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, book_name VARCHAR NOT NULL UNIQUE, "
+                       "author_name VARCHAR, comments TEXT)")
+    connection.executemany("INSERT INTO books (book_name, author_name, comments) VALUES (?, ?, ?)",
+                           (("book_%d" % i, "author_%d" % (i % 100), "comments " * 20) for i in range(ROWS)))
+    connection.commit()
+    connection.close()
+
+
+def connect(path, pragmas):
+    # Without a profile the connection still waits on locks, so the default run measures waiting, not errors.
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    for name, value in pragmas:
+        connection.execute("PRAGMA %s = %s" % (name, value))
+    return connection
+
+
+def reader(path, pragmas, stop, counts):
+    connection = connect(path, pragmas)
+    book_id = 0
+    while not stop.is_set():
+        book_id = book_id % ROWS + 1
+        connection.execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone()
+        counts["reads"] += 1
+    connection.close()
+
+
+def writer(path, pragmas, stop, counts):
+    connection = connect(path, pragmas)
+    book_id = 0
+    while not stop.is_set():
+        book_id = book_id % ROWS + 1
+        connection.execute("UPDATE books SET comments = ? WHERE id = ?", ("updated %f" % time.time(), book_id))
+        connection.commit()
+        counts["writes"] += 1
+    connection.close()
+
+
+def run(pragmas, seconds, readers):
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, "bench.sqlite")
+        create_database(path)
+
+        stop = threading.Event()
+        read_counts = [{"reads": 0} for _ in range(readers)]
+        write_counts = {"writes": 0}
+        threads = [threading.Thread(target=reader, args=(path, pragmas, stop, counts)) for counts in read_counts]
+        threads.append(threading.Thread(target=writer, args=(path, pragmas, stop, write_counts)))
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        reads = sum(counts["reads"] for counts in read_counts)
+        return reads / float(seconds), write_counts["writes"] / float(seconds)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    for label, pragmas in (("default", []), ("production", ProductionConfig.SQLITE_PRAGMAS)):
+        reads, writes = run(pragmas, seconds, readers)
+        print("%-10s reads/s: %10.0f  writes/s: %8.0f" % (label, reads, writes))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,50 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 class Config:
 	SECRET_KEY = os.environ.get("SECRET_KEY") or "Temporary_secret_key"
 	SQLALCHEMY_COMMIT_ON_TEARDOWN = True
+	API_PAGE_SIZE = 100
+	API_MAX_PAGE_SIZE = 1000
+	API_STREAM_CHUNK_SIZE = 500
+	API_MAX_BULK_SIZE = 10000
+	API_SUGGEST_SIZE = 10
+	ENTITY_CACHE_SIZE = 10000
+	ENTITY_CACHE_TTL = 60
+	RESPONSE_CACHE_SIZE = 1000
+	RESPONSE_CACHE_TTL = 30
+	RESPONSE_CACHE_STALE_TTL = 300
+	PRINCIPAL_CACHE_SIZE = 10000
+	TOKEN_EPOCH_REFRESH_INTERVAL = 5
+	# Lifetimes in seconds of the tokens handed out by /auth/api/login and /auth/api/refresh.
+	ACCESS_TOKEN_TTL = 900
+	REFRESH_TOKEN_TTL = 30 * 24 * 3600
+	# Worker processes for password hashing. 0 hashes on the request thread.
+	PASSWORD_HASH_POOL_SIZE = 0
+	PASSWORD_HASH_TIMEOUT = 30
+	# The number after the last colon is the work factor. Werkzeug's default, which stored hashes use.
+	PASSWORD_HASH_METHOD = "pbkdf2:sha1:1000"
+	# Requests of each class run at once, and how many more may wait, for at most ADMISSION_TIMEOUT seconds.
+	ADMISSION_LIMITS = {"read": 16, "write": 4, "auth": 4, "bulk": 2}
+	ADMISSION_QUEUE_SIZES = {"read": 64, "write": 32, "auth": 16, "bulk": 4}
+	ADMISSION_TIMEOUT = 10
+	ADMISSION_RETRY_AFTER = 1
+	CACHE_COHERENCE_FILE = None
+	SQLITE_PRAGMAS = []
+	SQLALCHEMY_REPLICA_URIS = []
+	WRITE_QUEUE_ENABLED = False
+	WRITE_QUEUE_WINDOW = 0.002
+	WRITE_QUEUE_MAX_BATCH = 100
+	WRITE_QUEUE_TIMEOUT = 30
+	WRITE_RETRIES = 5
+	WRITE_RETRY_DELAY = 0.01
+	TOMBSTONE_RETENTION_DAYS = 30
+	SSE_QUEUE_SIZE = 1000
+	SSE_BATCH_SIZE = 500
+	SSE_POLL_INTERVAL = 5
+	SSE_KEEPALIVE = 15
+	COMPRESS_MIN_SIZE = 500
+	COMPRESS_LEVEL = 6
+	COMPRESS_BROTLI_QUALITY = 5
+	COMPRESS_MIMETYPES = ["application/json", "application/x-ndjson", "application/msgpack", "application/x-msgpack",
+		"application/cbor", "text/html", "text/css", "text/plain", "application/javascript"]
 	
 	@staticmethod
 	def init_app(app):
@@ -15,6 +59,9 @@ class Config:
 
 class DevelopmentConfig(Config):
 	DEBUG = True
+	# Cheap compression keeps the development server responsive.
+	COMPRESS_LEVEL = 1
+	COMPRESS_BROTLI_QUALITY = 1
 	SQLALCHEMY_DATABASE_URI = os.environ.get("DEV_DATABASE_URL") or "sqlite:///" + os.path.join(basedir, "data-dev.sqlite")
 
 
@@ -25,6 +72,18 @@ class TestingConfig(Config):
 
 class ProductionConfig(Config):
 	SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL") or "sqlite:///" + os.path.join(basedir, "data.sqlite")
+	CACHE_COHERENCE_FILE = os.environ.get("CACHE_COHERENCE_FILE") or os.path.join(basedir, "data.sqlite-generations")
+	WRITE_QUEUE_ENABLED = True
+	PASSWORD_HASH_POOL_SIZE = 2
+	# WAL lets readers run alongside the writer, and with it synchronous=NORMAL only syncs at checkpoints.
+	SQLITE_PRAGMAS = [
+		("journal_mode", "WAL"),
+		("synchronous", "NORMAL"),
+		("mmap_size", 256 * 1024 * 1024),
+		("cache_size", -64 * 1024),
+		("temp_store", "MEMORY"),
+		("busy_timeout", 5000)
+	]
 
 
 config = {
@@ -50,5 +50,20 @@ def setup_db():
     init_db()
 
 
+@manager.command
+def sync_replicas():
+    from app.persistence.replicas import sync_sqlite_replica
+    for replica_uri in app.config["SQLALCHEMY_REPLICA_URIS"]:
+        sync_sqlite_replica(app.config["SQLALCHEMY_DATABASE_URI"], replica_uri)
+
+
+@manager.command
+def compact_tombstones():
+    # Drops book tombstones older than TOMBSTONE_RETENTION_DAYS. Meant to run periodically, e.g. from cron.
+    from app.persistence.db_util import compact_tombstones
+    removed = compact_tombstones(app.config["TOMBSTONE_RETENTION_DAYS"])
+    print("Removed %d tombstones." % removed)
+
+
 if __name__ == '__main__':
     manager.run()
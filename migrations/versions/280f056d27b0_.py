@@ -0,0 +1,39 @@
+"""full text search index over books
+
+Revision ID: 280f056d27b0
+Revises: 9026d7521ce0
+Create Date: 2026-10-18 10:12:41.305117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '280f056d27b0'
+down_revision = '9026d7521ce0'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute("CREATE VIRTUAL TABLE books_fts USING fts5("
+               "book_name, author_name, comments, content='books', content_rowid='id')")
+    op.execute("CREATE TRIGGER books_fts_insert AFTER INSERT ON books BEGIN "
+               "INSERT INTO books_fts(rowid, book_name, author_name, comments) "
+               "VALUES (new.id, new.book_name, new.author_name, new.comments); END")
+    op.execute("CREATE TRIGGER books_fts_delete AFTER DELETE ON books BEGIN "
+               "INSERT INTO books_fts(books_fts, rowid, book_name, author_name, comments) "
+               "VALUES ('delete', old.id, old.book_name, old.author_name, old.comments); END")
+    op.execute("CREATE TRIGGER books_fts_update AFTER UPDATE OF book_name, author_name, comments ON books BEGIN "
+               "INSERT INTO books_fts(books_fts, rowid, book_name, author_name, comments) "
+               "VALUES ('delete', old.id, old.book_name, old.author_name, old.comments); "
+               "INSERT INTO books_fts(rowid, book_name, author_name, comments) "
+               "VALUES (new.id, new.book_name, new.author_name, new.comments); END")
+    # Index the rows that already exist.
+    op.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    op.execute("DROP TRIGGER books_fts_update")
+    op.execute("DROP TRIGGER books_fts_delete")
+    op.execute("DROP TRIGGER books_fts_insert")
+    op.execute("DROP TABLE books_fts")
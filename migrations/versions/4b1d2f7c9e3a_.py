@@ -0,0 +1,27 @@
+"""updated_at on books
+
+Revision ID: 4b1d2f7c9e3a
+Revises: 280f056d27b0
+Create Date: 2026-10-18 14:02:17.518204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b1d2f7c9e3a'
+down_revision = '280f056d27b0'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('books', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    # Existing books count as modified now, so clients revalidate them once.
+    # Written in the format SQLAlchemy stores DateTime values in.
+    op.execute("UPDATE books SET updated_at = strftime('%Y-%m-%d %H:%M:%S', 'now') || '.000000'")
+    op.create_index(op.f('ix_books_updated_at'), 'books', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_books_updated_at'), table_name='books')
+    op.drop_column('books', 'updated_at')
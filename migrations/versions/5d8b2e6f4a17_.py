@@ -0,0 +1,28 @@
+"""token epochs for users
+
+Revision ID: 5d8b2e6f4a17
+Revises: 7c3e5a91d0b4
+Create Date: 2026-10-18 17:26:03.815432
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5d8b2e6f4a17'
+down_revision = '7c3e5a91d0b4'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('token_epochs',
+                    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+                    sa.Column('epoch', sa.Integer(), nullable=False),
+                    sa.Column('seq', sa.Integer(), nullable=False),
+                    sa.PrimaryKeyConstraint('user_id'))
+    op.create_index(op.f('ix_token_epochs_seq'), 'token_epochs', ['seq'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_token_epochs_seq'), table_name='token_epochs')
+    op.drop_table('token_epochs')
@@ -0,0 +1,60 @@
+"""change sequence and tombstones for books
+
+Revision ID: 7c3e5a91d0b4
+Revises: 4b1d2f7c9e3a
+Create Date: 2026-10-18 15:11:48.204631
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c3e5a91d0b4'
+down_revision = '4b1d2f7c9e3a'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('change_sequences',
+                    sa.Column('name', sa.String(), nullable=False),
+                    sa.Column('value', sa.Integer(), nullable=False),
+                    sa.PrimaryKeyConstraint('name'))
+    op.create_table('book_tombstones',
+                    sa.Column('change_seq', sa.Integer(), autoincrement=False, nullable=False),
+                    sa.Column('book_id', sa.Integer(), nullable=False),
+                    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+                    sa.PrimaryKeyConstraint('change_seq'))
+    op.create_index(op.f('ix_book_tombstones_deleted_at'), 'book_tombstones', ['deleted_at'], unique=False)
+    op.add_column('books', sa.Column('change_seq', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_books_change_seq'), 'books', ['change_seq'], unique=False)
+
+    # Existing books are numbered in id order, and the sequence continues after them.
+    op.execute("UPDATE books SET change_seq = id")
+    op.execute("INSERT INTO change_sequences (name, value) SELECT 'books', COALESCE(MAX(id), 0) FROM books")
+    op.execute("INSERT INTO change_sequences (name, value) VALUES ('book_tombstones_horizon', 0)")
+
+    op.execute("CREATE TRIGGER books_change_seq_insert AFTER INSERT ON books BEGIN "
+               "UPDATE change_sequences SET value = value + 1 WHERE name = 'books'; "
+               "UPDATE books SET change_seq = (SELECT value FROM change_sequences WHERE name = 'books') "
+               "WHERE id = new.id; END")
+    op.execute("CREATE TRIGGER books_change_seq_update "
+               "AFTER UPDATE OF book_name, author_name, comments, updated_at ON books BEGIN "
+               "UPDATE change_sequences SET value = value + 1 WHERE name = 'books'; "
+               "UPDATE books SET change_seq = (SELECT value FROM change_sequences WHERE name = 'books') "
+               "WHERE id = new.id; END")
+    op.execute("CREATE TRIGGER books_change_seq_delete AFTER DELETE ON books BEGIN "
+               "UPDATE change_sequences SET value = value + 1 WHERE name = 'books'; "
+               "INSERT INTO book_tombstones (change_seq, book_id, deleted_at) "
+               "VALUES ((SELECT value FROM change_sequences WHERE name = 'books'), old.id, "
+               "strftime('%Y-%m-%d %H:%M:%S', 'now') || '.000000'); END")
+
+
+def downgrade():
+    op.execute("DROP TRIGGER books_change_seq_delete")
+    op.execute("DROP TRIGGER books_change_seq_update")
+    op.execute("DROP TRIGGER books_change_seq_insert")
+    op.drop_index(op.f('ix_books_change_seq'), table_name='books')
+    op.drop_column('books', 'change_seq')
+    op.drop_index(op.f('ix_book_tombstones_deleted_at'), table_name='book_tombstones')
+    op.drop_table('book_tombstones')
+    op.drop_table('change_sequences')
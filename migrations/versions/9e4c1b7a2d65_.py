@@ -0,0 +1,35 @@
+"""refresh tokens
+
+Revision ID: 9e4c1b7a2d65
+Revises: 5d8b2e6f4a17
+Create Date: 2026-10-18 18:42:51.307214
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9e4c1b7a2d65'
+down_revision = '5d8b2e6f4a17'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('refresh_tokens',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('token_hash', sa.String(length=64), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('family', sa.String(length=32), nullable=False),
+                    sa.Column('expires_at', sa.DateTime(), nullable=False),
+                    sa.Column('used', sa.Boolean(), nullable=False),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index(op.f('ix_refresh_tokens_token_hash'), 'refresh_tokens', ['token_hash'], unique=True)
+    op.create_index(op.f('ix_refresh_tokens_user_id'), 'refresh_tokens', ['user_id'], unique=False)
+    op.create_index(op.f('ix_refresh_tokens_family'), 'refresh_tokens', ['family'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_refresh_tokens_family'), table_name='refresh_tokens')
+    op.drop_index(op.f('ix_refresh_tokens_user_id'), table_name='refresh_tokens')
+    op.drop_index(op.f('ix_refresh_tokens_token_hash'), table_name='refresh_tokens')
+    op.drop_table('refresh_tokens')
@@ -0,0 +1,99 @@
+import unittest
+import threading
+import time
+
+from flask import url_for, json
+
+from app import create_app
+from app.admission import Gate
+from app.persistence import db
+
+
+class AdmissionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config["SSE_KEEPALIVE"] = 0.05
+        self.app.config["SSE_POLL_INTERVAL"] = 0.05
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def fill(self, name):
+        # Takes every slot of a class and leaves no room to wait.
+        gate = self.app.extensions["admission"][name]
+        gate.queue_size = 0
+        for i in range(gate.limit):
+            self.assertTrue(gate.acquire())
+        return gate
+
+    def test_gate(self):
+        # Check that a gate admits up to its limit, queues up to its queue size and turns the rest away.
+        gate = Gate(1, 1, 5)
+        self.assertTrue(gate.acquire())
+
+        admitted = []
+        waiter = threading.Thread(target=lambda: admitted.append(gate.acquire()))
+        waiter.start()
+        while gate.stats()["waiting"] == 0:
+            time.sleep(0.01)
+        self.assertFalse(gate.acquire())
+
+        gate.release()
+        waiter.join()
+        self.assertEqual(admitted, [True])
+        stats = gate.stats()
+        self.assertEqual((stats["active"], stats["admitted"], stats["rejected"]), (1, 2, 1))
+        self.assertEqual(sum(stats["wait_ms"].values()), 2)
+
+    def test_gate_timeout(self):
+        # Check that a queued request gives up after the timeout.
+        gate = Gate(1, 1, 0.05)
+        self.assertTrue(gate.acquire())
+        self.assertFalse(gate.acquire())
+        self.assertEqual(gate.stats()["timed_out"], 1)
+        self.assertEqual(gate.stats()["waiting"], 0)
+
+    def test_full_queue(self):
+        # Check that a full class is answered with 503 and Retry-After, while other classes still get through.
+        gate = self.fill("bulk")
+        response = self.client.get(url_for("api_blueprint.get_all_books"))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], str(self.app.config["ADMISSION_RETRY_AFTER"]))
+        self.assertIn("Error", json.loads(response.get_data()))
+
+        response = self.client.get(url_for("api_blueprint.get_book", book_id=1))
+        self.assertEqual(response.status_code, 404)
+
+        gate.release()
+        response = self.client.get(url_for("api_blueprint.get_all_books"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_classes(self):
+        # Check that requests are classed by endpoint, blueprint and method, and release their slot.
+        self.client.get(url_for("api_blueprint.get_book", book_id=1))
+        self.client.post(url_for("api_blueprint.add_book"), data=json.dumps({"book_name": "book"}))
+        self.client.post(url_for("api_auth_blueprint.login"))
+        self.client.get(url_for("api_blueprint.get_all_users"))
+
+        stats = json.loads(self.client.get(url_for("api_blueprint.get_stats")).get_data())["admission"]
+        for name in ("read", "write", "auth", "bulk"):
+            self.assertEqual(stats[name]["admitted"], 1)
+            self.assertEqual(stats[name]["active"], 0)
+
+    def test_stream_exempt(self):
+        # Check that the event stream is not held back by a full read class.
+        self.fill("read")
+        response = self.client.get(url_for("api_blueprint.stream_book_changes"), buffered=False)
+        publisher = self.app.extensions["book_stream"]["thread"]
+        try:
+            self.assertEqual(response.status_code, 200)
+        finally:
+            response.close()
+            # Left running, the publisher would poll tables that tearDown drops.
+            publisher.join()
@@ -425,4 +425,126 @@ class AuthApiTestCase(unittest.TestCase):
             "Authorization": "Basic " + credentials
         }
         response = self.client.get(url_for("api_auth_blueprint.test_auth_token"), headers=auth_header)
-        self.assertEqual(response.status_code, 401)
\ No newline at end of file
+        self.assertEqual(response.status_code, 401)
+
+    def register_and_confirm(self, request):
+        response = self.client.post(url_for("api_auth_blueprint.register"), data=json.dumps(request))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        response = self.client.post(url_for("api_auth_blueprint.confirm", token=data["token"]),
+                                    data=json.dumps(request))
+        self.assertEqual(response.status_code, 200)
+        return data["id"]
+
+    def test_login(self):
+        # Check that logging in gives an access token that authorizes, and a refresh token.
+        request = {
+            "email": "test_email",
+            "username": "test_username",
+            "password": "test_password"
+        }
+        self.register_and_confirm(request)
+        response = self.client.post(url_for("api_auth_blueprint.login"), data=json.dumps(request))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual(data["expires_in"], self.app.config["ACCESS_TOKEN_TTL"])
+        self.assertNotEqual(data["refresh_token"], "")
+
+        auth_header = {
+            "Authorization": "Basic " + base64.b64encode(data["token"] + ":")
+        }
+        response = self.client.get(url_for("api_auth_blueprint.test_auth_token"), headers=auth_header)
+        self.assertEqual(response.status_code, 200)
+
+        # Only the hash of the refresh token is stored.
+        self.assertEqual(db.session.execute("SELECT COUNT(*) FROM refresh_tokens WHERE token_hash = :token",
+                                            {"token": data["refresh_token"]}).scalar(), 0)
+
+    def test_login_invalid(self):
+        # Check login with missing fields, a wrong password and an unconfirmed account.
+        request = {
+            "email": "test_email",
+            "username": "test_username",
+            "password": "test_password"
+        }
+        response = self.client.post(url_for("api_auth_blueprint.login"), data=json.dumps({"email": "test_email"}))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.get_data())["Error"], "password cannot be empty.")
+
+        # A null email must not match the first user.
+        self.register_and_confirm(dict(request, email="other_email", username="other_username"))
+        response = self.client.post(url_for("api_auth_blueprint.login"),
+                                    data=json.dumps({"email": None, "password": request["password"]}))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.get_data())["Error"], "email cannot be empty.")
+
+        response = self.client.post(url_for("api_auth_blueprint.register"), data=json.dumps(request))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(url_for("api_auth_blueprint.login"), data=json.dumps(request))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.get_data())["Error"], "Confirm your account before logging in.")
+
+        request["password"] = "wrong_password"
+        response = self.client.post(url_for("api_auth_blueprint.login"), data=json.dumps(request))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.get_data())["Error"], "Invalid email or password.")
+
+    def test_refresh(self):
+        # Check that a refresh token is rotated on use, and that using one twice revokes its family.
+        request = {
+            "email": "test_email",
+            "username": "test_username",
+            "password": "test_password"
+        }
+        self.register_and_confirm(request)
+        response = self.client.post(url_for("api_auth_blueprint.login"), data=json.dumps(request))
+        first = json.loads(response.get_data())["refresh_token"]
+
+        response = self.client.post(url_for("api_auth_blueprint.refresh"), data=json.dumps({"refresh_token": first}))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        second = data["refresh_token"]
+        self.assertNotEqual(first, second)
+        auth_header = {
+            "Authorization": "Basic " + base64.b64encode(data["token"] + ":")
+        }
+        response = self.client.get(url_for("api_auth_blueprint.test_auth_token"), headers=auth_header)
+        self.assertEqual(response.status_code, 200)
+
+        # The first token again, as a thief holding a copy would. The legitimate second one dies with it.
+        response = self.client.post(url_for("api_auth_blueprint.refresh"), data=json.dumps({"refresh_token": first}))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.get_data())["Error"], "The refresh token is invalid.")
+        response = self.client.post(url_for("api_auth_blueprint.refresh"), data=json.dumps({"refresh_token": second}))
+        self.assertEqual(response.status_code, 401)
+
+    def test_refresh_invalid(self):
+        # Check that a missing refresh token, or one that is not a string, is refused.
+        for request in ({}, {"refresh_token": 5}, {"refresh_token": None}, ["refresh_token"]):
+            response = self.client.post(url_for("api_auth_blueprint.refresh"), data=json.dumps(request))
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.get_data())["Error"], "refresh_token cannot be empty.")
+
+    def test_refresh_revoked(self):
+        # Check that changing the password revokes refresh tokens, and that expired ones are refused.
+        request = {
+            "email": "test_email",
+            "username": "test_username",
+            "password": "test_password"
+        }
+        user_id = self.register_and_confirm(request)
+        response = self.client.post(url_for("api_auth_blueprint.login"), data=json.dumps(request))
+        refresh_token = json.loads(response.get_data())["refresh_token"]
+        db_util.update_user(user_id, {"password": "new_password"})
+        response = self.client.post(url_for("api_auth_blueprint.refresh"),
+                                    data=json.dumps({"refresh_token": refresh_token}))
+        self.assertEqual(response.status_code, 401)
+
+        db_util.update_users({"confirmed": True}, [user_id])
+        request["password"] = "new_password"
+        self.app.config["REFRESH_TOKEN_TTL"] = -1
+        response = self.client.post(url_for("api_auth_blueprint.login"), data=json.dumps(request))
+        refresh_token = json.loads(response.get_data())["refresh_token"]
+        response = self.client.post(url_for("api_auth_blueprint.refresh"),
+                                    data=json.dumps({"refresh_token": refresh_token}))
+        self.assertEqual(response.status_code, 401)
@@ -2,6 +2,7 @@ import unittest
 import collections
 
 from flask import url_for, json
+from sqlalchemy import inspect
 
 from app import create_app
 from app.persistence import db_util
@@ -98,6 +99,52 @@ class BookAPITestCase(unittest.TestCase):
         self.assertIn("Error", data)
         self.assertEqual(data["Error"], "book_name cannot be empty.")
 
+    def test_post_book_duplicate(self):
+        # Check response when a book with an existing book_name is added.
+        book_dict = self.get_book_dict(self.get_book_data(0))
+        db_util.add_book(book_dict)
+
+        response = self.client.post(url_for("api_blueprint.add_book"), data=json.dumps(book_dict))
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("Error", json.loads(response.get_data()))
+        self.assertEqual(len(db_util.get_all_books()), 1)
+
+    def test_upsert_book(self):
+        # Check that PUT by name creates a book, then updates only the fields given.
+        book_data = self.get_book_data(0)
+        url = url_for("api_blueprint.upsert_book", book_name=book_data.book_name)
+
+        response = self.client.put(url, data=json.dumps({"author_name": book_data.author_name}))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual(data["book_name"], book_data.book_name)
+        self.assertEqual(data["author_name"], book_data.author_name)
+        self.assertEqual(data["comments"], "")
+
+        response = self.client.put(url, data=json.dumps({"comments": book_data.comments}))
+        self.assertEqual(response.status_code, 200)
+        updated = json.loads(response.get_data())
+        self.assertEqual(updated["id"], data["id"])
+        self.assertEqual(updated["author_name"], book_data.author_name)
+        self.assertEqual(updated["comments"], book_data.comments)
+
+        response = self.client.put(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data()), updated)
+        self.assertEqual(len(db_util.get_all_books()), 1)
+
+    def test_upsert_book_invalid_values(self):
+        # Check that PUT by name refuses fields that are not strings, without creating the book.
+        url = url_for("api_blueprint.upsert_book", book_name="book_name_0")
+        for request_data in ({"author_name": [1]}, {"comments": None}):
+            response = self.client.put(url, data=json.dumps(request_data))
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.get_data())["Error"], "comments must be a string.")
+
+        response = self.client.put(url, data=json.dumps(["author_name"]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(db_util.get_all_books(), [])
+
     def test_update_book_no_json(self):
         # Check response when a book update is requested without json data.
         response = self.client.put(url_for("api_blueprint.update_book", book_id=123))
@@ -261,4 +308,207 @@ class BookAPITestCase(unittest.TestCase):
             self.assertEqual(books[index].book_name, book["book_name"])
             self.assertEqual(books[index].author_name, book["author_name"])
             self.assertEqual(books[index].comments, book["comments"])
-            self.assertEqual(books[index].author_name, book["author_name"])
\ No newline at end of file
+            self.assertEqual(books[index].author_name, book["author_name"])
+
+    def test_get_all_books_pagination(self):
+        # Check that pages follow the primary key and the next link walks through all the books.
+        books = [db_util.add_book(self.get_book_dict(self.get_book_data(i))) for i in range(5)]
+        response = self.client.get(url_for("api_blueprint.get_all_books", limit=2))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual([json.loads(book)["id"] for book in data["books"]], [books[0].id, books[1].id])
+        self.assertIsNotNone(data["next"])
+
+        seen_ids = [json.loads(book)["id"] for book in data["books"]]
+        while data["next"] is not None:
+            response = self.client.get(data["next"])
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.get_data())
+            seen_ids.extend(json.loads(book)["id"] for book in data["books"])
+        self.assertEqual(seen_ids, [book.id for book in books])
+
+    def test_get_all_books_last_page(self):
+        # Check that an exactly full last page has no next link.
+        books = [db_util.add_book(self.get_book_dict(self.get_book_data(i))) for i in range(4)]
+        response = self.client.get(url_for("api_blueprint.get_all_books", limit=2, after=books[1].id))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual(len(data["books"]), 2)
+        self.assertIsNone(data["next"])
+
+    def test_get_all_books_fields(self):
+        # Check that a sparse fieldset limits the response and carries over to the next link.
+        books = [db_util.add_book(self.get_book_dict(self.get_book_data(i))) for i in range(3)]
+        response = self.client.get(url_for("api_blueprint.get_all_books", limit=2, fields="id,book_name"))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual([json.loads(book) for book in data["books"]],
+                         [{"id": book.id, "book_name": book.book_name} for book in books[:2]])
+
+        response = self.client.get(data["next"])
+        data = json.loads(response.get_data())
+        self.assertEqual([json.loads(book) for book in data["books"]],
+                         [{"id": books[2].id, "book_name": books[2].book_name}])
+
+    def test_get_books_page_defers_unselected_columns(self):
+        # Check that columns outside the fieldset are not loaded from the database.
+        db_util.add_book(self.get_book_dict(self.get_book_data(0)))
+        db.session.remove()
+        book = db_util.get_books_page(1, fields=["url", "book_name"])[0]
+        self.assertEqual(inspect(book).unloaded, set(["author_name", "comments", "updated_at", "change_seq"]))
+
+    def test_get_book_fields(self):
+        # Check a sparse fieldset on a single book, and an unknown field.
+        book = db_util.add_book(self.get_book_dict(self.get_book_data(0)))
+        response = self.client.get(url_for("api_blueprint.get_book", book_id=book.id, fields="url,comments"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(json.loads(response.get_data()).keys()), ["comments", "url"])
+
+        for fields in ("", ",", "id,password"):
+            response = self.client.get(url_for("api_blueprint.get_book", book_id=book.id, fields=fields))
+            self.assertEqual(response.status_code, 400)
+
+    def test_get_all_books_invalid_page_args(self):
+        # Check response for invalid limit and after values.
+        for args in ({"limit": 0}, {"limit": "abc"}, {"limit": 100000}, {"after": "abc"}):
+            response = self.client.get(url_for("api_blueprint.get_all_books", **args))
+            self.assertEqual(response.status_code, 400)
+            data = json.loads(response.get_data())
+            self.assertIn("Error", data)
+
+    def test_get_all_books_stream_json(self):
+        # Check that the streamed response has the same shape as a paged one and holds every book.
+        books = [db_util.add_book(self.get_book_dict(self.get_book_data(i))) for i in range(5)]
+        self.app.config["API_STREAM_CHUNK_SIZE"] = 2
+        response = self.client.get(url_for("api_blueprint.get_all_books", stream=1))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        data = json.loads(response.get_data())
+        self.assertIsNone(data["next"])
+        self.assertEqual([json.loads(book)["id"] for book in data["books"]], [book.id for book in books])
+
+    def test_get_all_books_stream_ndjson(self):
+        # Check that NDJSON is returned one book per line when asked for through the Accept header.
+        books = [db_util.add_book(self.get_book_dict(self.get_book_data(i))) for i in range(3)]
+        response = self.client.get(url_for("api_blueprint.get_all_books"),
+                                   headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)["book_name"] for line in lines], [book.book_name for book in books])
+
+    def test_get_all_books_stream_empty(self):
+        # Check the streamed response of an empty table.
+        response = self.client.get(url_for("api_blueprint.get_all_books", stream=1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data()), {"books": [], "next": None})
+
+    def test_add_books_bulk(self):
+        # Check per item results of a bulk add with new, duplicate and invalid books.
+        existing_book = db_util.add_book(self.get_book_dict(self.get_book_data(0)))
+        books = [self.get_book_dict(self.get_book_data(i)) for i in range(3)]
+        books.append(self.get_book_dict(self.get_book_data(1)))
+        books.append({"author_name": "No book name"})
+
+        response = self.client.post(url_for("api_blueprint.add_books_bulk"), data=json.dumps(books))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual(data["created"], 2)
+        statuses = [result["status"] for result in data["results"]]
+        self.assertEqual(statuses, ["duplicate", "created", "created", "duplicate", "invalid"])
+        self.assertEqual(data["results"][0]["id"], existing_book.id)
+        self.assertEqual(data["results"][3]["id"], data["results"][1]["id"])
+        self.assertEqual(len(db_util.get_all_books()), 3)
+
+        book = db_util.get_book(data["results"][2]["id"])
+        self.assertEqual(book.book_name, books[2]["book_name"])
+        self.assertEqual(book.author_name, books[2]["author_name"])
+        self.assertEqual(book.comments, books[2]["comments"])
+
+    def test_add_books_bulk_invalid_json(self):
+        # Check response when the bulk add body is empty or is not a list.
+        response = self.client.post(url_for("api_blueprint.add_books_bulk"))
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(url_for("api_blueprint.add_books_bulk"),
+                                    data=json.dumps(self.get_book_dict(self.get_book_data(0))))
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.get_data())
+        self.assertEqual(data["Error"], "JSON data must be a list of books.")
+
+    def test_add_books_bulk_invalid_values(self):
+        # Check that items with non-string values are reported as invalid and the rest are added.
+        request_data = json.dumps([
+            {"book_name": ["book_name_0"]},
+            {"book_name": "book_name_1", "author_name": {"name": "author_name_1"}},
+            self.get_book_dict(self.get_book_data(2))
+        ])
+        response = self.client.post(url_for("api_blueprint.add_books_bulk"), data=request_data)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual(data["created"], 1)
+        self.assertEqual([result["status"] for result in data["results"]], ["invalid", "invalid", "created"])
+        self.assertEqual(data["results"][0]["Error"], "book_name must be a string.")
+        self.assertEqual(data["results"][1]["Error"], "author_name must be a string.")
+
+    def test_update_books_bulk_by_ids(self):
+        # Check a bulk update by ids, reporting the ids that do not exist.
+        books = [db_util.add_book(self.get_book_dict(self.get_book_data(i))) for i in range(3)]
+        request_data = json.dumps({
+            "ids": [books[0].id, books[2].id, 123],
+            "changes": {"author_name": "Updated author name"}
+        })
+        response = self.client.patch(url_for("api_blueprint.update_books_bulk"), data=request_data)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual(data["updated"], 2)
+        self.assertEqual(data["not_found"], [123])
+
+        author_names = [db_util.get_book(book.id).author_name for book in books]
+        self.assertEqual(author_names, ["Updated author name", "author_name_1", "Updated author name"])
+
+    def test_update_books_bulk_invalid_changes(self):
+        # Check that only author_name and comments can be changed in bulk.
+        book = db_util.add_book(self.get_book_dict(self.get_book_data(0)))
+        request_data = json.dumps({"ids": [book.id], "changes": {"book_name": "Updated book name"}})
+        response = self.client.patch(url_for("api_blueprint.update_books_bulk"), data=request_data)
+        self.assertEqual(response.status_code, 400)
+
+        request_data = json.dumps({"changes": {"comments": "No target."}})
+        response = self.client.patch(url_for("api_blueprint.update_books_bulk"), data=request_data)
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_books_bulk_invalid_values(self):
+        # Check that changes to anything but a string are refused and nothing is written.
+        book = db_util.add_book(self.get_book_dict(self.get_book_data(0)))
+        for value in ({"a": 1}, None, 5):
+            request_data = json.dumps({"ids": [book.id], "changes": {"comments": value}})
+            response = self.client.patch(url_for("api_blueprint.update_books_bulk"), data=request_data)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.get_data())["Error"], "comments must be a string.")
+        self.assertEqual(db_util.get_book(book.id).comments, "comments_0")
+
+    def test_delete_books_bulk_null_filter(self):
+        # Check that a filter of nulls is refused instead of matching every book.
+        for i in range(3):
+            db_util.add_book(self.get_book_dict(self.get_book_data(i)))
+
+        request_data = json.dumps({"filter": {"author_name": None}})
+        response = self.client.delete(url_for("api_blueprint.delete_books_bulk"), data=request_data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(db_util.get_all_books()), 3)
+        self.assertRaises(ValueError, db_util.remove_books, author_name=None)
+        self.assertEqual(len(db_util.get_all_books()), 3)
+
+    def test_delete_books_bulk_by_filter(self):
+        # Check a bulk delete using a filter on author_name.
+        books = [db_util.add_book(self.get_book_dict(self.get_book_data(i))) for i in range(3)]
+        db_util.update_book(books[1].id, {"author_name": books[0].author_name})
+
+        request_data = json.dumps({"filter": {"author_name": books[0].author_name}})
+        response = self.client.delete(url_for("api_blueprint.delete_books_bulk"), data=request_data)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual(data["removed"], 2)
+        self.assertEqual(data["not_found"], [])
+        self.assertEqual([book.book_name for book in db_util.get_all_books()], ["book_name_2"])
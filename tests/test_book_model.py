@@ -178,13 +178,9 @@ class BookModelTestCase(unittest.TestCase):
         book_json["author"] = "somethingelse"
         book_json["comments"] = "some other comment."
 
-        unique_constraint_raised = False
-        try:
-            db_util.add_book(book_json)
-        except:
-            unique_constraint_raised = True
-
-        self.assertTrue(unique_constraint_raised)
+        # The duplicate is not inserted and no exception is raised.
+        self.assertIsNone(db_util.add_book(book_json))
+        self.assertEqual(len(db_util.get_all_books()), 1)
 
     def test_get_book_by_filter_no_filter(self):
         # Check response of get_book_by_filter if no filters are specified. [Should return all books]
@@ -0,0 +1,95 @@
+import unittest
+from datetime import datetime, timedelta
+
+from flask import url_for, json
+
+from app import create_app
+from app.persistence import db_util
+from app.persistence.models import BookTombstone
+from app.persistence import db
+
+
+class BookStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config["SSE_KEEPALIVE"] = 0.05
+        self.app.config["SSE_POLL_INTERVAL"] = 0.05
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.responses = []
+
+    def tearDown(self):
+        for response in self.responses:
+            response.close()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def connect(self, **kwargs):
+        response = self.client.get(url_for("api_blueprint.stream_book_changes"), buffered=False, **kwargs)
+        self.responses.append(response)
+        return response, iter(response.response)
+
+    def read_events(self, chunks, count):
+        # Parses events until count of them arrived, skipping keepalive comments.
+        events = []
+        for _ in range(200):
+            chunk = next(chunks)
+            if chunk.startswith(":"):
+                continue
+            fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+            events.append((fields.get("id"), fields["event"], json.loads(fields["data"])))
+            if len(events) == count:
+                return events
+        self.fail("Expected %d events, got %d." % (count, len(events)))
+
+    def test_live_changes(self):
+        # Changes committed after connecting arrive as events with change_seq ids.
+        response, chunks = self.connect()
+        self.assertEqual(response.mimetype, "text/event-stream")
+        book = db_util.add_book({"book_name": "Inferno"})
+        events = self.read_events(chunks, 1)
+        # Read in between, because a feed read after the delete only reports the delete.
+        db_util.remove_book(book.id)
+        events.extend(self.read_events(chunks, 1))
+        self.assertEqual([event for event_id, event, data in events], ["upsert", "delete"])
+        self.assertEqual(events[0][2]["book"]["book_name"], "Inferno")
+        self.assertEqual([int(event_id) for event_id, event, data in events], [data["seq"] for _, _, data in events])
+
+    def test_resume_from_last_event_id(self):
+        # A reconnecting client first gets what it missed, then live changes, each exactly once.
+        books = [db_util.add_book({"book_name": "book_name_%d" % i}) for i in range(3)]
+        response, chunks = self.connect(headers={"Last-Event-ID": "1"})
+        db_util.update_book(books[0].id, {"comments": "Updated."})
+
+        events = self.read_events(chunks, 3)
+        self.assertEqual([data["id"] for event_id, event, data in events], [books[1].id, books[2].id, books[0].id])
+        self.assertEqual(events[2][2]["book"]["comments"], "Updated.")
+
+    def test_slow_subscriber_catches_up(self):
+        # A subscriber whose queue overflows reads the missed changes from the database instead.
+        self.app.config["SSE_QUEUE_SIZE"] = 1
+        response, chunks = self.connect()
+        db_util.add_books([{"book_name": "book_name_%d" % i} for i in range(5)])
+
+        events = self.read_events(chunks, 5)
+        self.assertEqual([data["book"]["book_name"] for event_id, event, data in events],
+                         ["book_name_%d" % i for i in range(5)])
+
+    def test_compacted_last_event_id_resyncs(self):
+        # Resuming from before compacted tombstones tells the client to resync.
+        book = db_util.add_book({"book_name": "Inferno"})
+        db_util.remove_book(book.id)
+        BookTombstone.query.update({"deleted_at": datetime.utcnow() - timedelta(days=31)})
+        db.session.commit()
+        db_util.compact_tombstones(30)
+
+        response, chunks = self.connect(query_string={"since": 0})
+        self.assertEqual(self.read_events(chunks, 1)[0][1], "resync")
+
+    def test_invalid_last_event_id(self):
+        # Last-Event-ID has to be a change sequence number.
+        response = self.client.get(url_for("api_blueprint.stream_book_changes"), headers={"Last-Event-ID": "abc"})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,83 @@
+import unittest
+from datetime import datetime, timedelta
+
+from flask import url_for, json
+
+from app import create_app
+from app.persistence import db_util
+from app.persistence.models import BookTombstone
+from app.persistence import db
+
+
+class ChangesAPITestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_changes(self, since, **args):
+        response = self.client.get(url_for("api_blueprint.get_book_changes", since=since, **args))
+        return response.status_code, json.loads(response.get_data())
+
+    def test_changes_since_cursor(self):
+        # Inserts, updates and deletes after the cursor come back once each, oldest first.
+        first = db_util.add_book({"book_name": "Inferno"})
+        status, data = self.get_changes(0)
+        self.assertEqual(status, 200)
+        self.assertEqual([(change["op"], change["id"]) for change in data["changes"]], [("upsert", first.id)])
+        self.assertEqual(data["changes"][0]["book"]["book_name"], "Inferno")
+        cursor = data["cursor"]
+
+        second = db_util.add_book({"book_name": "Origin"})
+        db_util.update_book(first.id, {"comments": "Read it twice."})
+        db_util.remove_book(second.id)
+        status, data = self.get_changes(cursor)
+        self.assertEqual([(change["op"], change["id"]) for change in data["changes"]],
+                         [("upsert", first.id), ("delete", second.id)])
+        self.assertEqual(data["changes"][0]["book"]["comments"], "Read it twice.")
+        self.assertIsNone(data["next"])
+
+        status, data = self.get_changes(data["cursor"])
+        self.assertEqual(data["changes"], [])
+
+    def test_bulk_writes_are_tracked(self):
+        # Changes made by the bulk statements show up as well.
+        db_util.add_books([{"book_name": "book_name_%d" % i} for i in range(5)])
+        db_util.remove_books(book_name="book_name_0")
+        status, data = self.get_changes(0, limit=2, fields="id")
+        self.assertEqual([change["book"] for change in data["changes"]], [{"id": 2}, {"id": 3}])
+
+        ops = []
+        while True:
+            ops.extend(change["op"] for change in data["changes"])
+            if data["next"] is None:
+                break
+            data = json.loads(self.client.get(data["next"]).get_data())
+        self.assertEqual(ops, ["upsert"] * 4 + ["delete"])
+
+    def test_compacted_cursor_is_gone(self):
+        # A cursor older than compacted tombstones gets 410, a newer one still works.
+        book = db_util.add_book({"book_name": "Inferno"})
+        db_util.remove_book(book.id)
+        self.assertEqual(db_util.compact_tombstones(30), 0)
+        BookTombstone.query.update({"deleted_at": datetime.utcnow() - timedelta(days=31)})
+        db.session.commit()
+        self.assertEqual(db_util.compact_tombstones(30), 1)
+
+        status, data = self.get_changes(0)
+        self.assertEqual(status, 410)
+        status, data = self.get_changes(2)
+        self.assertEqual(status, 200)
+
+    def test_invalid_since(self):
+        # since is required and must be a non-negative integer.
+        for args in ({}, {"since": "abc"}, {"since": -1}):
+            response = self.client.get(url_for("api_blueprint.get_book_changes", **args))
+            self.assertEqual(response.status_code, 400)
@@ -0,0 +1,96 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from flask import url_for, json
+
+from app import create_app
+from app.persistence import db_util, book_suggest
+from app.persistence import db
+from app.persistence.coherence import SharedGenerations
+from config import config
+
+
+class CacheCoherenceTestCase(unittest.TestCase):
+    # Two apps on one database and one generations file stand in for two worker processes.
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        config["testing"].CACHE_COHERENCE_FILE = os.path.join(self.tempdir, "generations")
+        self.app = create_app("testing")
+        self.other_app = create_app("testing")
+        config["testing"].CACHE_COHERENCE_FILE = None
+
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.tempdir)
+
+    def write_in_other_app(self, function, *args):
+        db.session.remove()
+        with self.other_app.app_context():
+            function(*args)
+            db.session.remove()
+
+    def test_shared_generations(self):
+        path = os.path.join(self.tempdir, "shared")
+        first = SharedGenerations(path)
+        second = SharedGenerations(path)
+        self.assertEqual(first.bump("books"), 1)
+        self.assertEqual(second.bump("books"), 2)
+        self.assertEqual(first.read("books"), 2)
+        self.assertEqual(second.read("users"), 0)
+
+    def test_write_in_other_worker_invalidates_caches(self):
+        book = db_util.add_book({"book_name": "Inferno"})
+        response = self.client.get(url_for("api_blueprint.get_book", book_id=book.id))
+        self.assertEqual(json.loads(response.get_data())["book_name"], "Inferno")
+        self.client.get(url_for("api_blueprint.get_all_books"))
+
+        self.write_in_other_app(db_util.update_book, book.id, {"book_name": "Origin"})
+
+        response = self.client.get(url_for("api_blueprint.get_book", book_id=book.id))
+        self.assertEqual(json.loads(response.get_data())["book_name"], "Origin")
+        response = self.client.get(url_for("api_blueprint.get_all_books"))
+        self.assertEqual(response.headers["X-Cache"], "miss")
+        self.assertEqual(json.loads(json.loads(response.get_data())["books"][0])["book_name"], "Origin")
+
+    def test_write_in_other_worker_invalidates_missing_ids(self):
+        response = self.client.get(url_for("api_blueprint.get_user", user_id=1))
+        self.assertEqual(response.status_code, 404)
+
+        self.write_in_other_app(db_util.add_user, {"email": "email", "username": "username", "password": "password"})
+
+        response = self.client.get(url_for("api_blueprint.get_user", user_id=1))
+        self.assertEqual(response.status_code, 200)
+
+    def test_write_in_other_worker_updates_suggest_index(self):
+        book = db_util.add_book({"book_name": "Inferno", "author_name": "Dan Brown"})
+        self.client.get(url_for("api_blueprint.suggest_books", prefix="inf"))
+        builds = []
+        build = book_suggest.build
+        book_suggest.build = lambda: builds.append(1) or build()
+        try:
+            self.write_in_other_app(db_util.update_book, book.id, {"book_name": "Origin"})
+            self.write_in_other_app(db_util.add_book, {"book_name": "Angels and Demons", "author_name": "Dan Brown"})
+            response = self.client.get(url_for("api_blueprint.suggest_books", prefix="o"))
+            self.write_in_other_app(db_util.remove_book, book.id)
+            response_after_remove = self.client.get(url_for("api_blueprint.suggest_books", prefix="o"))
+        finally:
+            book_suggest.build = build
+
+        # The index follows the other worker through the change feed, without a rebuild.
+        self.assertEqual(builds, [])
+        self.assertEqual([suggestion["value"] for suggestion in json.loads(response.get_data())["suggestions"]],
+                         ["Origin"])
+        self.assertEqual(json.loads(response_after_remove.get_data())["suggestions"], [])
+        response = self.client.get(url_for("api_blueprint.suggest_books", prefix="an"))
+        self.assertEqual([suggestion["value"] for suggestion in json.loads(response.get_data())["suggestions"]],
+                         ["Angels and Demons"])
@@ -0,0 +1,73 @@
+import unittest
+import zlib
+
+from flask import url_for, json
+
+from app import create_app
+from app.compression import brotli
+from app.persistence import db_util
+from app.persistence import db
+
+
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        db_util.add_books([{"book_name": "book_name_%d" % i, "comments": "comments " * 10} for i in range(50)])
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def gunzip(self, data):
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+    def test_large_response_is_gzipped(self):
+        # A body above COMPRESS_MIN_SIZE is gzipped for a client that accepts it.
+        plain = self.client.get(url_for("api_blueprint.get_all_books", v=2))
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertIn("Accept-Encoding", plain.headers["Vary"])
+
+        response = self.client.get(url_for("api_blueprint.get_all_books", v=2), headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(int(response.headers["Content-Length"]), len(response.get_data()))
+        self.assertLess(len(response.get_data()), len(plain.get_data()))
+        self.assertEqual(self.gunzip(response.get_data()), plain.get_data())
+
+    def test_small_response_is_not_compressed(self):
+        # Bodies below COMPRESS_MIN_SIZE go out as they are.
+        response = self.client.get(url_for("api_blueprint.get_book", book_id=1), headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(json.loads(response.get_data())["id"], 1)
+
+    def test_refused_encoding_is_not_used(self):
+        # An encoding the client gives q=0 is never chosen.
+        response = self.client.get(url_for("api_blueprint.get_all_books"), headers={"Accept-Encoding": "gzip;q=0"})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_stream_is_gzipped_incrementally(self):
+        # Every chunk of a stream is flushed, so each one can be decompressed as it arrives.
+        self.app.config["API_STREAM_CHUNK_SIZE"] = 10
+        plain = self.client.get(url_for("api_blueprint.get_all_books", stream="ndjson"))
+        response = self.client.get(url_for("api_blueprint.get_all_books", stream="ndjson"),
+                                   headers={"Accept-Encoding": "gzip"}, buffered=False)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", response.headers)
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = [decompressor.decompress(chunk) for chunk in response.response]
+        response.close()
+        self.assertGreater(len([chunk for chunk in chunks if chunk]), 1)
+        self.assertEqual("".join(chunks), plain.get_data())
+
+    @unittest.skipIf(brotli is None, "brotli is not installed.")
+    def test_brotli_is_preferred(self):
+        # brotli wins over gzip when the client accepts both.
+        plain = self.client.get(url_for("api_blueprint.get_all_books"))
+        response = self.client.get(url_for("api_blueprint.get_all_books"), headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.get_data()), plain.get_data())
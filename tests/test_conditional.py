@@ -0,0 +1,105 @@
+import unittest
+import zlib
+
+from flask import url_for, json
+
+from app import create_app
+from app.persistence import db_util
+from app.persistence import db
+
+
+class ConditionalGetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.book = db_util.add_book({"book_name": "Inferno", "author_name": "Dan Brown"})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_get_book_if_none_match(self):
+        # A matching ETag gets an empty 304, and a write makes the old ETag stale.
+        url = url_for("api_blueprint.get_book", book_id=self.book.id)
+        response = self.client.get(url)
+        etag = response.headers["ETag"]
+        self.assertIn("Last-Modified", response.headers)
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b"")
+        self.assertEqual(response.headers["ETag"], etag)
+
+        db_util.update_book(self.book.id, {"comments": "Read it twice."})
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(json.loads(response.get_data())["comments"], "Read it twice.")
+
+    def test_get_book_if_modified_since(self):
+        # Last-Modified works as a validator on its own.
+        url = url_for("api_blueprint.get_book", book_id=self.book.id)
+        last_modified = self.client.get(url).headers["Last-Modified"]
+        response = self.client.get(url, headers={"If-Modified-Since": last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_representations_have_own_etags(self):
+        # Different fieldsets or versions of the same book never share an ETag.
+        etags = set()
+        for args in ({}, {"fields": "id"}, {"v": 2}):
+            response = self.client.get(url_for("api_blueprint.get_book", book_id=self.book.id, **args))
+            etags.add(response.headers["ETag"])
+        self.assertEqual(len(etags), 3)
+
+    def test_get_all_books_etag(self):
+        # The collection ETag follows inserts, updates and deletes, and is answered from the response cache.
+        url = url_for("api_blueprint.get_all_books")
+        etags = [self.client.get(url).headers["ETag"]]
+        response = self.client.get(url, headers={"If-None-Match": etags[0]})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["X-Cache"], "hit")
+
+        other = db_util.add_book({"book_name": "Origin"})
+        etags.append(self.client.get(url).headers["ETag"])
+        db_util.update_book(other.id, {"comments": "Finished."})
+        etags.append(self.client.get(url).headers["ETag"])
+        db_util.remove_book(other.id)
+        etags.append(self.client.get(url).headers["ETag"])
+        self.assertEqual(len(set(etags[:3])), 3)
+        # Deleting the new book restores the original collection, and with it the original ETag.
+        self.assertEqual(etags[3], etags[0])
+
+        response = self.client.get(url, headers={"If-None-Match": etags[1]})
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_all_books_ignores_if_modified_since(self):
+        # The collection has no Last-Modified, so a date sent back after a delete still gets the new list.
+        url = url_for("api_blueprint.get_all_books")
+        other = db_util.add_book({"book_name": "Origin"})
+        response = self.client.get(url)
+        self.assertNotIn("Last-Modified", response.headers)
+        last_modified = self.client.get(url_for("api_blueprint.get_book", book_id=other.id)).headers["Last-Modified"]
+
+        db_util.remove_book(self.book.id)
+        response = self.client.get(url, headers={"If-Modified-Since": last_modified})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([json.loads(book)["book_name"] for book in json.loads(response.get_data())["books"]],
+                         ["Origin"])
+
+    def test_compressed_etag_revalidates(self):
+        # The ETag of a gzipped response carries a suffix, and sending it back still gets a 304.
+        db_util.add_books([{"book_name": "book_name_%d" % i, "comments": "comments " * 10} for i in range(20)])
+        url = url_for("api_blueprint.get_all_books")
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        etag = response.headers["ETag"]
+        self.assertTrue(etag.endswith('-gzip"'))
+        self.assertEqual(json.loads(zlib.decompress(response.get_data(), 16 + zlib.MAX_WBITS))["next"], None)
+
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
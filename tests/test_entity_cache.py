@@ -0,0 +1,114 @@
+import unittest
+
+from flask import url_for, json
+from sqlalchemy import event
+
+from app import create_app
+from app.cache import LRUCache
+from app.persistence import db_util
+from app.persistence import db
+
+
+class EntityCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.statements = []
+        event.listen(db.engine, "before_cursor_execute", self.count_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, "before_cursor_execute", self.count_statement)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def get_stats(self):
+        response = self.client.get(url_for("api_blueprint.get_stats"))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.get_data())["entity_cache"]
+
+    def test_get_book_hits_cache(self):
+        # The second read of a book is served without a query.
+        book = db_util.add_book({"book_name": "Inferno", "author_name": "Dan Brown"})
+        db.session.remove()
+        self.assertEqual(db_util.get_book(book.id).book_name, "Inferno")
+        db.session.remove()
+
+        del self.statements[:]
+        cached_book = db_util.get_book(book.id)
+        self.assertEqual(self.statements, [])
+        self.assertEqual(cached_book.book_name, "Inferno")
+        self.assertEqual(cached_book.author_name, "Dan Brown")
+
+        stats = self.get_stats()["books"]
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_get_book_caches_misses(self):
+        # Repeated lookups of a missing id reach the database only once, until a book is added with that id.
+        self.assertIsNone(db_util.get_book(1))
+        del self.statements[:]
+        self.assertIsNone(db_util.get_book(1))
+        self.assertEqual(self.statements, [])
+
+        book = db_util.add_book({"book_name": "Inferno"})
+        self.assertEqual(book.id, 1)
+        self.assertEqual(db_util.get_book(1).book_name, "Inferno")
+
+    def test_writes_invalidate_cache(self):
+        # Every write path drops the changed ids from the cache.
+        book = db_util.add_book({"book_name": "Inferno"})
+        db_util.get_book(book.id)
+        db_util.update_book(book.id, {"book_name": "Origin"})
+        self.assertEqual(db_util.get_book(book.id).book_name, "Origin")
+
+        db_util.update_books({"comments": "Updated comments."}, [book.id])
+        self.assertEqual(db_util.get_book(book.id).comments, "Updated comments.")
+
+        db_util.remove_book(book.id)
+        self.assertIsNone(db_util.get_book(book.id))
+
+        user_id = db_util.add_user({"email": "email", "username": "username", "password": "password"}).id
+        db_util.get_user(user_id)
+        db_util.update_user(user_id, {"username": "Updated username"})
+        self.assertEqual(db_util.get_user(user_id).username, "Updated username")
+        db_util.remove_users([user_id])
+        self.assertIsNone(db_util.get_user(user_id))
+
+    def test_cached_book_can_be_updated(self):
+        # A book merged from the cache is a normal persistent object.
+        book = db_util.add_book({"book_name": "Inferno"})
+        db.session.remove()
+        db_util.get_book(book.id)
+        db.session.remove()
+
+        cached_book = db_util.get_book(book.id)
+        cached_book.comments = "Changed through the session."
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(db_util.load_book(book.id).comments, "Changed through the session.")
+
+    def test_lru_cache_eviction_and_ttl(self):
+        cache = LRUCache(2)
+        cache.add("a", 1)
+        cache.add("b", None)
+        self.assertEqual(cache.get("a"), (True, 1))
+        cache.add("c", 3)
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("a"), (True, 1))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        cache.add("d", 4, ttl=-1)
+        self.assertEqual(cache.get("d"), (False, None))
+
+        # A value loaded before an invalidation is not stored.
+        invalidations = cache.invalidations
+        cache.invalidate("e")
+        cache.add("e", 5, invalidations)
+        self.assertEqual(cache.get("e"), (False, None))
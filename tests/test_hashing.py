@@ -0,0 +1,97 @@
+import multiprocessing
+import os
+import threading
+import time
+import unittest
+
+from werkzeug.security import generate_password_hash
+
+from app import create_app
+from app.hashing import hashing
+from app.persistence import db, db_util
+from app.persistence.models import User
+
+
+class HashingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config["PASSWORD_HASH_POOL_SIZE"] = 2
+        self.app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:2000"
+        hashing.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        hashing.close(self.app)
+
+    def test_pool(self):
+        # Check that hashes made in the pool use the configured method and can be checked.
+        password_hash = hashing.generate("password")
+        self.assertTrue(password_hash.startswith("pbkdf2:sha256:2000$"))
+        self.assertTrue(hashing.check(password_hash, "password"))
+        self.assertFalse(hashing.check(password_hash, "wrong password"))
+
+    def test_timeout(self):
+        # Check that a task that does not come back in time raises instead of blocking the caller.
+        state = self.app.extensions["password_hashing"]
+        state["timeout"] = 0.05
+        self.assertRaises(multiprocessing.TimeoutError, hashing.run, state, time.sleep, 1)
+
+    def test_existing_hashes(self):
+        # Check that hashes made with another method still verify.
+        password_hash = generate_password_hash("password", "pbkdf2:sha1:1000")
+        self.assertTrue(hashing.check(password_hash, "password"))
+        self.assertFalse(hashing.check(password_hash, "wrong password"))
+
+    def test_users(self):
+        # Check that user passwords go through the pool, on add and on update.
+        user = db_util.add_user({"email": "email", "username": "username", "password": "password"})
+        self.assertTrue(user.password_hash.startswith("pbkdf2:sha256:2000$"))
+        self.assertTrue(user.verify_password("password"))
+
+        user = db_util.update_user(user.id, {"password": "new_password"})
+        self.assertTrue(user.verify_password("new_password"))
+        self.assertFalse(user.verify_password("password"))
+
+    def test_hashed_outside_write_queue(self):
+        # Check that passwords are hashed on the calling thread, not in the write job other writes queue behind.
+        self.app.extensions["write_queue"]["enabled"] = True
+        hash_password = User.hash_password
+        threads = []
+
+        def record(password):
+            threads.append(threading.current_thread())
+            return hash_password(password)
+
+        User.hash_password = staticmethod(record)
+        try:
+            user = db_util.add_user({"email": "email", "username": "username", "password": "password"})
+            user = db_util.update_user(user.id, {"password": "new_password"})
+        finally:
+            User.hash_password = staticmethod(hash_password)
+        self.assertEqual(threads, [threading.current_thread()] * 2)
+        self.assertTrue(user.verify_password("new_password"))
+
+    def test_forked_process(self):
+        # Check that a process forked after the pool started uses a pool of its own.
+        self.app.extensions["password_hashing"]["timeout"] = 5
+        password_hash = hashing.generate("password")
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os._exit(0 if hashing.check(password_hash, "password") else 1)
+            except Exception:
+                os._exit(2)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+    def test_no_app(self):
+        # Check that hashing works outside of an app.
+        self.app_context.pop()
+        try:
+            self.assertTrue(hashing.check(hashing.generate("password"), "password"))
+        finally:
+            self.app_context.push()
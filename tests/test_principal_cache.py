@@ -0,0 +1,163 @@
+import unittest
+import base64
+
+from flask import url_for, json
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+
+from app import create_app
+from app.auth import principal_cache, token_epochs
+from app.persistence import db, db_util
+from app.persistence.signals import users_changed
+
+
+class PrincipalCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_confirmed_user(self):
+        user = db_util.add_user({"email": "email_0", "username": "username_0", "password": "password_0"})
+        self.assertTrue(db_util.confirm_user(user.id, user.generate_confirmation_token()))
+        return db_util.load_user(user.id)
+
+    def get_legacy_token(self, user):
+        # The token format from before epochs, which only carries the user id.
+        return Serializer(self.app.config["SECRET_KEY"], 3600).dumps({"token": user.id})
+
+    def get_headers(self, token):
+        return {"Authorization": "Basic " + base64.b64encode(token + ":")}
+
+    def test_verify_token(self):
+        # Check that a valid token gives the principal, and that the second lookup is a hit.
+        user = self.add_confirmed_user()
+        token = user.generate_auth_token()
+        principal = principal_cache.verify_token(token)
+        self.assertEqual(principal.user_id, user.id)
+        self.assertTrue(principal.confirmed)
+
+        hits = principal_cache.stats()["hits"]
+        self.assertEqual(principal_cache.verify_token(token), principal)
+        self.assertEqual(principal_cache.stats()["hits"], hits + 1)
+
+    def test_invalid_token(self):
+        # Check that a bad signature is rejected and not cached.
+        self.assertIsNone(principal_cache.verify_token("not a token"))
+        self.assertEqual(principal_cache.stats()["size"], 0)
+
+    def test_user_changed(self):
+        # Check that a change to the user makes the cached principal of a legacy token stale.
+        user = self.add_confirmed_user()
+        token = self.get_legacy_token(user)
+        self.assertTrue(principal_cache.verify_token(token).confirmed)
+
+        db_util.update_user(user.id, {"password": "new_password"})
+        self.assertFalse(principal_cache.verify_token(token).confirmed)
+
+        db_util.remove_user(user.id)
+        self.assertIsNone(principal_cache.verify_token(token))
+
+    def test_revoked_token(self):
+        # Check that changing the password, the confirmed flag or removing the user revokes issued tokens.
+        user = self.add_confirmed_user()
+        token = user.generate_auth_token()
+        self.assertTrue(principal_cache.verify_token(token).confirmed)
+        db_util.update_user(user.id, {"username": "new_username"})
+        self.assertIsNotNone(principal_cache.verify_token(token))
+
+        db_util.update_user(user.id, {"password": "new_password"})
+        self.assertIsNone(principal_cache.verify_token(token))
+
+        db_util.update_users({"confirmed": True}, [user.id])
+        token = user.generate_auth_token()
+        self.assertEqual(principal_cache.verify_token(token).user_id, user.id)
+        db_util.update_users({"confirmed": False}, [user.id])
+        self.assertIsNone(principal_cache.verify_token(token))
+
+        db_util.update_users({"confirmed": True}, [user.id])
+        token = user.generate_auth_token()
+        db_util.remove_user(user.id)
+        self.assertIsNone(principal_cache.verify_token(token))
+
+    def test_stateless_token(self):
+        # Check that a token with claims is verified without loading the user.
+        user = self.add_confirmed_user()
+        user_id = user.id
+        token = user.generate_auth_token()
+        db.session.execute("DELETE FROM users")
+        db.session.commit()
+        self.assertEqual(principal_cache.verify_token(token).user_id, user_id)
+
+    def test_epochs_refreshed(self):
+        # Check that epochs changed by another process are picked up after the refresh interval, and at once by
+        # a token issued with a newer epoch.
+        self.app.config["TOKEN_EPOCH_REFRESH_INTERVAL"] = 3600
+        user = self.add_confirmed_user()
+        token = user.generate_auth_token()
+        self.assertIsNotNone(principal_cache.verify_token(token))
+
+        # Written without users_changed, as another process would.
+        db_util.revoke_tokens([user.id])
+        db.session.commit()
+        self.assertEqual(token_epochs.get_epoch(user.id), 0)
+        new_token = user.generate_auth_token()
+        self.assertIsNotNone(principal_cache.verify_token(new_token))
+        self.assertEqual(token_epochs.get_epoch(user.id), 1)
+        self.assertIsNone(principal_cache.verify_token(token))
+
+        db_util.revoke_tokens([user.id])
+        db.session.commit()
+        self.app.config["TOKEN_EPOCH_REFRESH_INTERVAL"] = 0
+        self.assertIsNone(principal_cache.verify_token(new_token))
+
+    def test_failed_refresh(self):
+        # Check that a failed read of the epochs is retried by the next lookup.
+        user = self.add_confirmed_user()
+        token = user.generate_auth_token()
+        get_token_epochs = db_util.get_token_epochs
+
+        def fail(after_seq):
+            raise RuntimeError("Database unavailable.")
+
+        db_util.get_token_epochs = fail
+        try:
+            self.assertRaises(RuntimeError, token_epochs.get_epoch, user.id)
+        finally:
+            db_util.get_token_epochs = get_token_epochs
+        self.assertEqual(principal_cache.verify_token(token).user_id, user.id)
+
+    def test_all_users_changed(self):
+        # Check that a change to unknown users makes every cached principal stale.
+        user = self.add_confirmed_user()
+        token = self.get_legacy_token(user)
+        principal_cache.verify_token(token)
+
+        # Changed behind the cache's back, so the cached principal is still served.
+        db.session.execute("UPDATE users SET confirmed = 0")
+        db.session.commit()
+        self.assertTrue(principal_cache.verify_token(token).confirmed)
+
+        users_changed.send(self.app)
+        self.assertFalse(principal_cache.verify_token(token).confirmed)
+
+    def test_token_auth(self):
+        # Check that token authorization goes through the cache and the token route still issues tokens.
+        user = self.add_confirmed_user()
+        token = user.generate_auth_token()
+        for i in range(2):
+            response = self.client.get(url_for("api_auth_blueprint.test_auth_token"), headers=self.get_headers(token))
+            self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url_for("api_blueprint.get_stats"))
+        self.assertEqual(json.loads(response.get_data())["principal_cache"]["hits"], 1)
+
+        response = self.client.get(url_for("api_auth_blueprint.token"), headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(principal_cache.verify_token(json.loads(response.get_data())["token"]))
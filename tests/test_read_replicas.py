@@ -0,0 +1,65 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from app import create_app
+from app.persistence import db_util
+from app.persistence import db
+from app.persistence.replicas import sync_sqlite_replica
+from config import config
+
+
+class ReadReplicasTestCase(unittest.TestCase):
+    # A primary and a replica SQLite file, with sync_sqlite_replica as the replication step.
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        testing_config = config["testing"]
+        self.saved_config = (testing_config.SQLALCHEMY_DATABASE_URI, testing_config.SQLALCHEMY_REPLICA_URIS)
+        self.primary_uri = "sqlite:///" + os.path.join(self.tempdir, "primary.sqlite")
+        self.replica_uri = "sqlite:///" + os.path.join(self.tempdir, "replica.sqlite")
+        testing_config.SQLALCHEMY_DATABASE_URI = self.primary_uri
+        testing_config.SQLALCHEMY_REPLICA_URIS = [self.replica_uri]
+        self.app = create_app("testing")
+        testing_config.SQLALCHEMY_DATABASE_URI, testing_config.SQLALCHEMY_REPLICA_URIS = self.saved_config
+
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.sync()
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+        shutil.rmtree(self.tempdir)
+
+    def sync(self):
+        db.session.remove()
+        sync_sqlite_replica(self.primary_uri, self.replica_uri)
+
+    def get_book_names(self):
+        return [book.book_name for book in db_util.get_books_page(10)]
+
+    def test_reads_go_to_replica(self):
+        db_util.add_book({"book_name": "Inferno"})
+        db.session.remove()
+        self.assertEqual(self.get_book_names(), [])
+
+        self.sync()
+        self.assertEqual(self.get_book_names(), ["Inferno"])
+
+    def test_reads_after_write_stick_to_primary(self):
+        db_util.add_book({"book_name": "Inferno"})
+        self.assertEqual(self.get_book_names(), ["Inferno"])
+        self.assertEqual([book.book_name for book, score in db_util.search_books("inferno", 10)], ["Inferno"])
+
+    def test_writes_go_to_primary(self):
+        book = db_util.add_book({"book_name": "Inferno"})
+        self.sync()
+        db_util.update_book(book.id, {"book_name": "Origin"})
+        db.session.remove()
+        self.assertEqual(self.get_book_names(), ["Inferno"])
+
+        self.sync()
+        self.assertEqual(self.get_book_names(), ["Origin"])
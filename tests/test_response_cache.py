@@ -0,0 +1,94 @@
+import unittest
+import time
+
+from flask import url_for, json
+
+from app import create_app
+from app.persistence import db_util
+from app.persistence import db
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_books(self, **args):
+        response = self.client.get(url_for("api_blueprint.get_all_books", **args))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        return response.headers["X-Cache"], [json.loads(book)["book_name"] for book in data["books"]]
+
+    def test_repeated_get_is_cached(self):
+        db_util.add_book({"book_name": "Inferno"})
+        self.assertEqual(self.get_books(), ("miss", ["Inferno"]))
+        self.assertEqual(self.get_books(), ("hit", ["Inferno"]))
+
+        # Query args are part of the key, in any order.
+        self.assertEqual(self.get_books(limit=5, after=0), ("miss", ["Inferno"]))
+        response = self.client.get("/api/books?after=0&limit=5")
+        self.assertEqual(response.headers["X-Cache"], "hit")
+
+    def test_hosts_are_cached_apart(self):
+        db_util.add_book({"book_name": "Inferno"})
+        self.get_books()
+        response = self.client.get("/api/books", base_url="https://localhost/")
+        self.assertEqual(response.headers["X-Cache"], "miss")
+        book = json.loads(json.loads(response.get_data())["books"][0])
+        self.assertTrue(book["url"].startswith("https://localhost/"))
+
+    def test_write_invalidates_cache(self):
+        book = db_util.add_book({"book_name": "Inferno"})
+        self.get_books()
+        db_util.add_book({"book_name": "Origin"})
+        self.assertEqual(self.get_books(), ("miss", ["Inferno", "Origin"]))
+
+        db_util.remove_book(book.id)
+        self.assertEqual(self.get_books(), ("miss", ["Origin"]))
+
+    def test_expired_entry_is_served_stale_and_refreshed(self):
+        self.app.config["RESPONSE_CACHE_TTL"] = 0.5
+        db_util.add_book({"book_name": "Inferno"})
+        self.assertEqual(self.get_books(), ("miss", ["Inferno"]))
+        time.sleep(0.5)
+        self.assertEqual(self.get_books(), ("stale", ["Inferno"]))
+
+        # Wait for the background refresh to store a new entry.
+        state = self.app.extensions["response_cache"]
+        for _ in range(100):
+            if not state["refreshing"]:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.get_books(), ("hit", ["Inferno"]))
+
+    def test_conditional_request_refreshes_entry(self):
+        self.app.config["RESPONSE_CACHE_TTL"] = 0.5
+        db_util.add_book({"book_name": "Inferno"})
+        etag = self.client.get(url_for("api_blueprint.get_all_books")).headers["ETag"]
+        time.sleep(0.5)
+        response = self.client.get(url_for("api_blueprint.get_all_books"), headers={"If-None-Match": etag})
+        self.assertEqual((response.status_code, response.headers["X-Cache"]), (304, "stale"))
+
+        # The refresh renders the whole list, not the 304 this client asked for.
+        state = self.app.extensions["response_cache"]
+        for _ in range(100):
+            if not state["refreshing"]:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.get_books(), ("hit", ["Inferno"]))
+
+    def test_streamed_responses_are_not_cached(self):
+        db_util.add_book({"book_name": "Inferno"})
+        for _ in range(2):
+            response = self.client.get(url_for("api_blueprint.get_all_books", stream=1))
+            self.assertEqual(response.headers["X-Cache"], "miss")
+            self.assertTrue(response.is_streamed)
+            self.assertEqual(len(json.loads(response.get_data())["books"]), 1)
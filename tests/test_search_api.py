@@ -0,0 +1,145 @@
+import unittest
+
+from flask import url_for, json
+
+from app import create_app
+from app.persistence import db_util, suggest
+from app.persistence import db
+
+
+class SearchAPITestCase(unittest.TestCase):
+    books = [
+        {"book_name": "Harry Potter and the Prisoner of Azkaban", "author_name": "J K Rowling",
+         "comments": "This is the 3rd book in the series."},
+        {"book_name": "Inferno", "author_name": "Dan Brown", "comments": "Latest Dan Brown book."},
+        {"book_name": "To Kill a Mocking Bird", "author_name": "Harper Lee", "comments": "A pretty awesome book!!"},
+        {"book_name": "Harry Potter and the Philosophers Stone", "author_name": "J K Rowling",
+         "comments": "Harry Potter goes to Hogwarts."}
+    ]
+
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def search(self, **args):
+        response = self.client.get(url_for("api_blueprint.search_books", **args))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        return [json.loads(book)["book_name"] for book in data["books"]], data["next"]
+
+    def test_search_ranks_by_relevance(self):
+        # The book mentioning "Harry Potter" in both name and comments should rank first.
+        for book in SearchAPITestCase.books:
+            db_util.add_book(book)
+
+        book_names, next_url = self.search(q="harry potter")
+        self.assertEqual(book_names, [SearchAPITestCase.books[3]["book_name"], SearchAPITestCase.books[0]["book_name"]])
+        self.assertIsNone(next_url)
+
+        book_names, next_url = self.search(q="brown")
+        self.assertEqual(book_names, ["Inferno"])
+
+    def test_search_follows_writes(self):
+        # The index is kept in sync by add, update and remove.
+        book = db_util.add_book(SearchAPITestCase.books[1])
+        self.assertEqual(self.search(q="inferno")[0], ["Inferno"])
+
+        db_util.update_book(book.id, {"book_name": "Origin"})
+        self.assertEqual(self.search(q="inferno")[0], [])
+        self.assertEqual(self.search(q="origin")[0], ["Origin"])
+
+        db_util.remove_book(book.id)
+        self.assertEqual(self.search(q="origin")[0], [])
+
+    def test_search_pagination(self):
+        # Paging with the cursor returns every match exactly once.
+        for book in SearchAPITestCase.books:
+            db_util.add_book(book)
+
+        book_names, next_url = self.search(q="book", limit=1)
+        self.assertIsNotNone(next_url)
+        while next_url is not None:
+            response = self.client.get(next_url)
+            data = json.loads(response.get_data())
+            book_names.extend(json.loads(book)["book_name"] for book in data["books"])
+            next_url = data["next"]
+        self.assertEqual(sorted(book_names), ["Harry Potter and the Prisoner of Azkaban", "Inferno",
+                                              "To Kill a Mocking Bird"])
+
+    def test_search_invalid_args(self):
+        # Check response for an empty query, an invalid cursor and FTS5 syntax in the query.
+        response = self.client.get(url_for("api_blueprint.search_books"))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.get_data())["Error"], "q cannot be empty.")
+
+        response = self.client.get(url_for("api_blueprint.search_books", q="book", after="garbage"))
+        self.assertEqual(response.status_code, 400)
+
+        book_names, next_url = self.search(q='"harry" OR (NEAR')
+        self.assertEqual(book_names, [])
+
+    def suggest(self, prefix, **args):
+        response = self.client.get(url_for("api_blueprint.suggest_books", prefix=prefix, **args))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        return [(suggestion["field"], suggestion["value"]) for suggestion in data["suggestions"]]
+
+    def test_suggest_book_and_author_names(self):
+        # Suggestions come back sorted, case insensitive, with each author listed once.
+        for book in SearchAPITestCase.books:
+            db_util.add_book(book)
+
+        self.assertEqual(self.suggest("har"), [
+            ("author_name", "Harper Lee"),
+            ("book_name", "Harry Potter and the Philosophers Stone"),
+            ("book_name", "Harry Potter and the Prisoner of Azkaban")
+        ])
+        self.assertEqual(self.suggest("j k"), [("author_name", "J K Rowling")])
+        self.assertEqual(self.suggest("HARRY P", limit=1), [("book_name", "Harry Potter and the Philosophers Stone")])
+        self.assertEqual(self.suggest("xyz"), [])
+
+    def test_suggest_follows_writes(self):
+        # The index is updated incrementally once it has been built.
+        book = db_util.add_book(SearchAPITestCase.books[1])
+        self.assertEqual(self.suggest("inf"), [("book_name", "Inferno")])
+
+        db_util.update_book(book.id, {"book_name": "Origin"})
+        self.assertEqual(self.suggest("inf"), [])
+        self.assertEqual(self.suggest("dan"), [("author_name", "Dan Brown")])
+
+        db_util.add_books([SearchAPITestCase.books[0], SearchAPITestCase.books[3]])
+        db_util.remove_books(author_name="J K Rowling")
+        db_util.remove_book(book.id)
+        self.assertEqual(self.suggest("o"), [])
+        self.assertEqual(self.suggest("dan"), [])
+        self.assertEqual(self.suggest("j"), [])
+
+    def test_suggest_across_blocks(self):
+        # With tiny blocks, inserts split blocks, deletes empty them, and a lookup runs on into the next block.
+        block_size = suggest.BLOCK_SIZE
+        suggest.BLOCK_SIZE = 2
+        try:
+            db_util.add_book({"book_name": "book_00"})
+            self.suggest("book")
+            books = [db_util.add_book({"book_name": "book_%02d" % i}) for i in range(10, 0, -1)]
+            for book in books[::2]:
+                db_util.remove_book(book.id)
+            self.assertEqual(self.suggest("book", limit=20),
+                             [("book_name", "book_%02d" % i) for i in (0, 1, 3, 5, 7, 9)])
+            self.assertEqual(self.suggest("book_0", limit=3),
+                             [("book_name", "book_%02d" % i) for i in (0, 1, 3)])
+        finally:
+            suggest.BLOCK_SIZE = block_size
+
+    def test_suggest_empty_prefix(self):
+        response = self.client.get(url_for("api_blueprint.suggest_books"))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.get_data())["Error"], "prefix cannot be empty.")
@@ -0,0 +1,110 @@
+import unittest
+
+from flask import url_for, json
+
+from app import create_app
+from app.api import serializers
+from app.persistence import db_util
+from app.persistence.models import Book
+from app.persistence import db
+
+
+class SerializersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.books = [db_util.add_book({"book_name": "book_name_%d" % i, "author_name": "author_name_%d" % i,
+                                        "comments": "comments_%d" % i}) for i in range(3)]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_url_template_matches_url_for(self):
+        # The template built url and fields match the version 1 output.
+        serializer = serializers.ModelSerializer(Book)
+        for book in self.books:
+            self.assertEqual(serializer.to_dict(book), json.loads(book.to_json()))
+
+    def test_get_all_books_v2_is_nested_json(self):
+        # A v2 page holds objects, not JSON strings, and the next link keeps the version.
+        response = self.client.get(url_for("api_blueprint.get_all_books", limit=2))
+        legacy = json.loads(response.get_data())
+        response = self.client.get(url_for("api_blueprint.get_all_books", limit=2, v=2))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+
+        self.assertEqual(data["books"], [json.loads(book) for book in legacy["books"]])
+        self.assertIn("v=2", data["next"])
+        data = json.loads(self.client.get(data["next"]).get_data())
+        self.assertEqual([book["id"] for book in data["books"]], [self.books[2].id])
+
+    def test_stream_v2_is_nested_json(self):
+        # A v2 stream uses the same nested shape and respects the fieldset.
+        response = self.client.get(url_for("api_blueprint.get_all_books", stream="json", v=2, fields="id"))
+        self.assertEqual(json.loads(response.get_data())["books"], [{"id": book.id} for book in self.books])
+
+    def test_get_book_v2(self):
+        # A single v2 book matches to_json.
+        response = self.client.get(url_for("api_blueprint.get_book", book_id=self.books[0].id, v=2))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data()), json.loads(self.books[0].to_json()))
+
+    def test_invalid_version(self):
+        # Unknown or malformed versions are rejected.
+        for version in ("3", "abc"):
+            response = self.client.get(url_for("api_blueprint.get_all_books", v=version))
+            self.assertEqual(response.status_code, 400)
+
+    @unittest.skipIf(serializers.msgpack is None, "msgpack is not installed.")
+    def test_get_all_books_msgpack(self):
+        # A msgpack client gets the version 2 document in msgpack.
+        expected = json.loads(self.client.get(url_for("api_blueprint.get_all_books", v=2)).get_data())
+        response = self.client.get(url_for("api_blueprint.get_all_books"), headers={"Accept": "application/msgpack"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/msgpack")
+        self.assertEqual(serializers.msgpack.unpackb(response.get_data(), raw=False), expected)
+
+    @unittest.skipIf(serializers.msgpack is None, "msgpack is not installed.")
+    def test_post_book_msgpack(self):
+        # Request bodies are decoded according to their Content-Type.
+        body = serializers.msgpack.packb({"book_name": "Inferno", "author_name": "Dan Brown"}, use_bin_type=True)
+        response = self.client.post(url_for("api_blueprint.add_book"), data=body, content_type="application/msgpack")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(db_util.get_books_by_filter(book_name="Inferno")[0].author_name, "Dan Brown")
+
+    @unittest.skipIf(serializers.msgpack is None, "msgpack is not installed.")
+    def test_write_responses_msgpack(self):
+        # Write endpoints answer in the negotiated format too, for a book and for a bulk result.
+        headers = {"Accept": "application/msgpack"}
+        response = self.client.put(url_for("api_blueprint.update_book", book_id=self.books[0].id),
+                                   data=json.dumps({"comments": "Updated comments"}), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/msgpack")
+        book = serializers.msgpack.unpackb(response.get_data(), raw=False)
+        self.assertEqual((book["id"], book["comments"]), (self.books[0].id, "Updated comments"))
+
+        response = self.client.delete(url_for("api_blueprint.delete_books_bulk"),
+                                      data=json.dumps({"ids": [self.books[0].id, 0]}), headers=headers)
+        self.assertEqual(response.mimetype, "application/msgpack")
+        self.assertEqual(serializers.msgpack.unpackb(response.get_data(), raw=False), {"removed": 1, "not_found": [0]})
+
+    @unittest.skipIf(serializers.cbor2 is None, "cbor2 is not installed.")
+    def test_get_book_cbor(self):
+        # A CBOR client gets a single book in CBOR.
+        book = self.books[0]
+        response = self.client.get(url_for("api_blueprint.get_book", book_id=book.id),
+                                   headers={"Accept": "application/cbor"})
+        self.assertEqual(response.mimetype, "application/cbor")
+        self.assertEqual(serializers.cbor2.loads(response.get_data()), json.loads(book.to_json()))
+
+    def test_unknown_accept_falls_back_to_json(self):
+        # Clients that accept nothing we can produce still get JSON.
+        response = self.client.get(url_for("api_blueprint.get_book", book_id=self.books[0].id),
+                                   headers={"Accept": "application/xml"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/json")
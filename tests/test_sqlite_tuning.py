@@ -0,0 +1,45 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from app import create_app
+from app.persistence import db_util
+from app.persistence import db
+from config import config
+
+
+class SQLiteTuningTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        testing_config = config["testing"]
+        self.saved_config = (testing_config.SQLALCHEMY_DATABASE_URI, testing_config.SQLITE_PRAGMAS)
+        testing_config.SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(self.tempdir, "data.sqlite")
+        testing_config.SQLITE_PRAGMAS = config["production"].SQLITE_PRAGMAS
+        self.app = create_app("testing")
+        testing_config.SQLALCHEMY_DATABASE_URI, testing_config.SQLITE_PRAGMAS = self.saved_config
+
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.tempdir)
+
+    def get_pragma(self, name):
+        return db.session.execute("PRAGMA %s" % name).scalar()
+
+    def test_pragmas_applied_to_connections(self):
+        self.assertEqual(self.get_pragma("journal_mode"), "wal")
+        self.assertEqual(self.get_pragma("synchronous"), 1)
+        self.assertEqual(self.get_pragma("busy_timeout"), 5000)
+        self.assertEqual(self.get_pragma("temp_store"), 2)
+        self.assertEqual(self.get_pragma("cache_size"), -64 * 1024)
+
+    def test_reads_and_writes_work_in_wal_mode(self):
+        book = db_util.add_book({"book_name": "Inferno"})
+        db.session.remove()
+        self.assertEqual(db_util.load_book(book.id).book_name, "Inferno")
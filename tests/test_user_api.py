@@ -50,6 +50,31 @@ class UserAPITestCase(unittest.TestCase):
             self.assertEqual(users[index].username, user["username"])
             self.assertEqual(users[index].email, user["email"])
 
+    def test_get_all_users_pagination(self):
+        # Check that users are paged by id with a next link.
+        users = [UserAPITestCase.register_and_confirm(self, self.get_user_dict(self.get_user_data(i))) for i in range(3)]
+        response = self.client.get(url_for("api_blueprint.get_all_users", limit=2))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual([json.loads(user)["id"] for user in data["users"]], [users[0].id, users[1].id])
+
+        response = self.client.get(data["next"])
+        data = json.loads(response.get_data())
+        self.assertEqual([json.loads(user)["id"] for user in data["users"]], [users[2].id])
+        self.assertIsNone(data["next"])
+
+    def test_get_all_users_fields(self):
+        # Check a sparse fieldset on the user list and an unknown field.
+        users = [UserAPITestCase.register_and_confirm(self, self.get_user_dict(self.get_user_data(i))) for i in range(2)]
+        response = self.client.get(url_for("api_blueprint.get_all_users", fields="id,username"))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual([json.loads(user) for user in data["users"]],
+                         [{"id": user.id, "username": user.username} for user in users])
+
+        response = self.client.get(url_for("api_blueprint.get_all_users", fields="password_hash"))
+        self.assertEqual(response.status_code, 400)
+
     def test_get_user_non_exitent(self):
         # Check the response when a get_user on a non-existent user is performed.
         response = self.client.get(url_for("api_blueprint.get_user", user_id=123))
@@ -214,6 +239,28 @@ class UserAPITestCase(unittest.TestCase):
         response = self.client.delete("/api/users")
         self.assertEqual(response.status_code, 405)
 
+    def test_update_users_bulk(self):
+        # Check that users can be unconfirmed in bulk.
+        users = [UserAPITestCase.register_and_confirm(self, self.get_user_dict(self.get_user_data(i))) for i in range(2)]
+        request_data = json.dumps({"ids": [user.id for user in users], "changes": {"confirmed": False}})
+        response = self.client.patch(url_for("api_blueprint.update_users_bulk"), data=request_data)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual(data["updated"], 2)
+        for user in users:
+            self.assertFalse(db_util.get_user(user.id).confirmed)
+
+    def test_delete_users_bulk(self):
+        # Check bulk delete of users by ids.
+        users = [UserAPITestCase.register_and_confirm(self, self.get_user_dict(self.get_user_data(i))) for i in range(3)]
+        request_data = json.dumps({"ids": [users[0].id, users[1].id, 123, 123]})
+        response = self.client.delete(url_for("api_blueprint.delete_users_bulk"), data=request_data)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual(data["removed"], 2)
+        self.assertEqual(data["not_found"], [123])
+        self.assertEqual([user.id for user in db_util.get_all_users()], [users[2].id])
+
     @staticmethod
     def register_user(test_obj, user_dict):
         # Helper function to register a user.
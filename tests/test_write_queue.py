@@ -0,0 +1,131 @@
+import unittest
+import threading
+
+from flask import url_for, json
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app import create_app
+from app.persistence import db_util, write_queue
+from app.persistence import db
+
+
+class WriteQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config["WRITE_QUEUE_ENABLED"] = True
+        self.app.config["WRITE_QUEUE_WINDOW"] = 0.05
+        self.app.extensions["write_queue"]["enabled"] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_books_concurrently(self, book_names):
+        results = {}
+
+        def add(book_name):
+            with self.app.app_context():
+                try:
+                    book = db_util.add_book({"book_name": book_name})
+                    results[book_name] = (book.id, book.book_name)
+                except Exception as error:
+                    results[book_name] = error
+                finally:
+                    db.session.remove()
+
+        threads = [threading.Thread(target=add, args=(book_name,)) for book_name in book_names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_writes_are_group_committed(self):
+        book_names = ["book_name_%d" % i for i in range(10)]
+        results = self.add_books_concurrently(book_names)
+
+        for book_name in book_names:
+            book_id, result_book_name = results[book_name]
+            self.assertEqual(result_book_name, book_name)
+            self.assertEqual(db_util.get_book(book_id).book_name, book_name)
+
+        stats = write_queue.stats()
+        self.assertEqual(stats["jobs"], 10)
+        self.assertLess(stats["batches"], 10)
+        self.assertEqual(stats["depth"], 0)
+
+    def test_failed_job_does_not_fail_batch(self):
+        db_util.add_book({"book_name": "Inferno"})
+        # A book without a name breaks the NOT NULL constraint.
+        results = self.add_books_concurrently([None, "Origin", "Deception Point"])
+
+        self.assertIsInstance(results[None], IntegrityError)
+        self.assertEqual(results["Origin"][1], "Origin")
+        self.assertEqual(results["Deception Point"][1], "Deception Point")
+        self.assertEqual(len(db_util.get_all_books()), 3)
+
+    def test_writer_survives_failing_error_handling(self):
+        # Check that an error raised while handling a failed job reaches the caller and the writer goes on.
+        def fail(*args):
+            raise ValueError("Batch failed.")
+
+        def fail_finish(*args):
+            raise RuntimeError("Rollback failed.")
+
+        self.app.config["WRITE_QUEUE_TIMEOUT"] = 5
+        write_queue.run_batch = fail
+        write_queue.finish = fail_finish
+        try:
+            self.assertRaises(RuntimeError, db_util.add_book, {"book_name": "book_name"})
+        finally:
+            del write_queue.run_batch
+            del write_queue.finish
+
+        book = db_util.add_book({"book_name": "book_name"})
+        self.assertEqual(db_util.get_book(book.id).book_name, "book_name")
+
+    def test_job_timeout(self):
+        # Check that a caller stops waiting for a job that does not finish in time.
+        release = threading.Event()
+
+        def block(*args):
+            release.wait(5)
+            raise ValueError("Too late.")
+
+        self.app.config["WRITE_QUEUE_TIMEOUT"] = 0.05
+        write_queue.run_batch = block
+        try:
+            self.assertRaises(RuntimeError, db_util.add_book, {"book_name": "book_name"})
+        finally:
+            del write_queue.run_batch
+            release.set()
+
+    def test_write_from_request_thread(self):
+        response = self.client.post(url_for("api_blueprint.add_book"), data=json.dumps({"book_name": "Inferno"}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data())["book_name"], "Inferno")
+
+        response = self.client.get(url_for("api_blueprint.get_stats"))
+        self.assertEqual(json.loads(response.get_data())["write_queue"]["jobs"], 1)
+
+    def test_locked_database_is_retried(self):
+        attempts = []
+
+        def locked_twice():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise OperationalError("COMMIT", {}, Exception("database is locked"))
+            return "done"
+
+        self.assertEqual(write_queue.run_with_retry(locked_twice, (), {}), "done")
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(write_queue.stats()["retries"], 2)
+
+        self.app.config["WRITE_RETRIES"] = 0
+        del attempts[:]
+        self.assertRaises(OperationalError, write_queue.run_with_retry, locked_twice, (), {})